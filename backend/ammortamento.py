@@ -0,0 +1,127 @@
+"""
+Piani di ammortamento salvati: un BLOB compatto per mutuo.
+
+Ogni mese occupa un record di quattro float64 little-endian (rata, quota
+capitale, quota interessi, debito residuo), quindi i mesi da `a` a `b` sono un
+intervallo di byte che SQLite estrae con substr() senza leggere il resto.
+L'impronta registra i parametri da cui il piano \u00e8 stato generato: se non
+corrisponde pi\u00f9 al mutuo il piano viene rigenerato.
+"""
+import numpy as np
+
+from mortgage_engine import calcola_piani_ammortamento
+
+# Da aumentare se cambia il calcolo del piano: invalida tutti i BLOB salvati
+VERSIONE_PIANO = 1
+
+_CAMPI = ("rata", "quota_capitale", "quota_interessi", "debito_residuo")
+_FORMATO = np.dtype("<f8")
+BYTE_PER_MESE = len(_CAMPI) * _FORMATO.itemsize
+
+
+def impronta_piano(importo: float, tan: float, durata_anni: int) -> str:
+    return f"v{VERSIONE_PIANO}:{float(importo)!r}:{float(tan)!r}:{int(durata_anni)}"
+
+
+def impacchetta_piani(importi, tan, durate_anni) -> list[bytes]:
+    """Genera in blocco i piani di N mutui e li impacchetta nel formato salvato."""
+    piani = calcola_piani_ammortamento(importi, tan, durate_anni)
+    blob = []
+    for i in range(len(piani)):
+        n = int(piani.num_rate[i])
+        mesi = np.empty((n, len(_CAMPI)), dtype=_FORMATO)
+        mesi[:, 0] = piani.rata[i]
+        mesi[:, 1] = piani.quota_capitale[i, :n]
+        mesi[:, 2] = piani.quota_interessi[i, :n]
+        mesi[:, 3] = piani.debito_residuo[i, :n]
+        blob.append(mesi.tobytes())
+    return blob
+
+
+def spacchetta_piano(dati: bytes, primo_mese: int = 1) -> list[dict]:
+    """Righe del piano (formato di calcola_piano_ammortamento) da un BLOB o da una sua parte."""
+    mesi = np.frombuffer(dati, dtype=_FORMATO).reshape(-1, len(_CAMPI))
+    return [
+        {"mese": mese, **dict(zip(_CAMPI, valori))}
+        for mese, valori in enumerate(mesi.tolist(), primo_mese)
+    ]
+
+
+async def salva_piani(db, mutui: list[tuple[int, float, float, int]]) -> None:
+    """Genera e salva (senza commit) i piani di (id, importo, tan, durata_anni)."""
+    if not mutui:
+        return
+    ids, importi, tan, durate = zip(*mutui)
+    blob = impacchetta_piani(importi, tan, durate)
+    await db.executemany(
+        """INSERT INTO ammortamenti (mutuo_id, impronta, num_rate, dati)
+           VALUES (?, ?, ?, ?)
+           ON CONFLICT(mutuo_id) DO UPDATE SET
+               impronta=excluded.impronta, num_rate=excluded.num_rate, dati=excluded.dati""",
+        [
+            (i, impronta_piano(imp, t, d), len(b) // BYTE_PER_MESE, b)
+            for i, imp, t, d, b in zip(ids, importi, tan, durate, blob)
+        ],
+    )
+
+
+async def leggi_piano(db, mutuo_id: int, da: int | None = None, a: int | None = None) -> dict | None:
+    """
+    Mutuo e mesi da `da` ad `a` (inclusi) del suo piano salvato, con una sola
+    lettura per chiave primaria.
+
+    Ritorna None se il mutuo non esiste; "dati" \u00e8 None se il piano manca o
+    non corrisponde pi\u00f9 ai parametri del mutuo.
+    """
+    primo = da or 1
+    parametri = {"id": mutuo_id, "inizio": (primo - 1) * BYTE_PER_MESE + 1}
+    estratto = "substr(a.dati, :inizio)"
+    if a is not None:
+        estratto = "substr(a.dati, :inizio, :lunghezza)"
+        parametri["lunghezza"] = (a - primo + 1) * BYTE_PER_MESE
+    cursor = await db.execute(
+        f"""SELECT m.importo, m.tan, m.durata_anni, a.impronta, {estratto} AS dati
+            FROM mutui m LEFT JOIN ammortamenti a ON a.mutuo_id = m.id
+            WHERE m.id = :id""",
+        parametri,
+    )
+    row = await cursor.fetchone()
+    if row is None:
+        return None
+    risultato = dict(row)
+    if risultato["impronta"] != impronta_piano(risultato["importo"], risultato["tan"], risultato["durata_anni"]):
+        risultato["dati"] = None
+    return risultato
+
+
+async def carica_piani(db, ids) -> dict[int, dict]:
+    """
+    Parametri e piano (matrice mesi x [rata, quota capitale, quota interessi,
+    debito residuo]) dei mutui indicati, per id. I piani mancanti o superati
+    si rigenerano in memoria, senza scriverli.
+    """
+    ids = list(ids)
+    placeholders = ",".join("?" for _ in ids)
+    cursor = await db.execute(
+        f"""SELECT m.id, m.banca, m.importo, m.tan, m.durata_anni, a.impronta, a.dati
+            FROM mutui m LEFT JOIN ammortamenti a ON a.mutuo_id = m.id
+            WHERE m.id IN ({placeholders})""",
+        ids,
+    )
+    mutui = {r["id"]: dict(r) for r in await cursor.fetchall()}
+    superati = [
+        m for m in mutui.values()
+        if m["impronta"] != impronta_piano(m["importo"], m["tan"], m["durata_anni"])
+    ]
+    if superati:
+        blob = impacchetta_piani(
+            [m["importo"] for m in superati],
+            [m["tan"] for m in superati],
+            [m["durata_anni"] for m in superati],
+        )
+        for m, dati in zip(superati, blob):
+            m["dati"] = dati
+    for m in mutui.values():
+        del m["impronta"]
+        m["piano"] = np.frombuffer(m.pop("dati"), dtype=_FORMATO).reshape(-1, len(_CAMPI))
+    return mutui
@@ -0,0 +1,101 @@
+"""
+Confronto tra il piano in float e il piano esatto in centesimi interi.
+
+Per ogni dimensione del lotto misura il tempo dei due calcoli vettoriali e
+riporta quanti piani in float non chiudono il debito con l'ultima rata
+(quota capitale diversa dal debito rimasto) e lo scarto massimo sul totale
+degli interessi. Come termine di paragone misura anche il piano in Decimal
+riga per riga di tests/genera_golden.py.
+
+    python benchmarks/centesimi.py [--mutui 1 100 10000] [--ripetizioni 5] [--json]
+"""
+import argparse
+import json
+import random
+import sys
+import time
+from pathlib import Path
+
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "tests"))
+
+from mortgage_engine import calcola_piani_ammortamento, calcola_piani_centesimi  # noqa: E402
+from genera_golden import _euro, piano_decimal  # noqa: E402
+
+
+def mutui_casuali(n: int, seme: int = 42) -> tuple[list, list, list]:
+    rng = random.Random(seme)
+    importi = [round(rng.uniform(50_000, 500_000), 2) for _ in range(n)]
+    tan = [round(rng.uniform(0.5, 6.0), 2) for _ in range(n)]
+    durate = [rng.choice((10, 15, 20, 25, 30)) for _ in range(n)]
+    return importi, tan, durate
+
+
+def _migliore(funzione, ripetizioni: int) -> float:
+    tempi = []
+    for _ in range(ripetizioni):
+        inizio = time.perf_counter()
+        funzione()
+        tempi.append(time.perf_counter() - inizio)
+    return min(tempi)
+
+
+def confronta(n: int, ripetizioni: int) -> dict:
+    importi, tan, durate = mutui_casuali(n)
+    float_s = _migliore(lambda: calcola_piani_ammortamento(importi, tan, durate), ripetizioni)
+    centesimi_s = _migliore(lambda: calcola_piani_centesimi(importi, tan, durate), ripetizioni)
+
+    piani = calcola_piani_ammortamento(importi, tan, durate)
+    esatti = calcola_piani_centesimi(importi, tan, durate)
+    righe = np.arange(n)
+    ultimo = esatti.num_rate - 1
+    # Nel float l'ultima quota capitale \u00e8 la rata meno gli interessi, non il debito rimasto
+    debito_prima = np.where(ultimo > 0, piani.debito_residuo[righe, np.maximum(ultimo - 1, 0)], importi)
+    non_chiusi = int((np.abs(piani.quota_capitale[righe, ultimo] - debito_prima) >= 0.005).sum())
+    interessi_float = piani.quota_interessi.sum(axis=1)
+    interessi_esatti = esatti.quota_interessi.sum(axis=1) / 100
+
+    campione = min(n, 20)
+    decimal_s = _migliore(
+        lambda: [
+            piano_decimal(importi[i], tan[i], durate[i], _euro(esatti.rata[i] / 100))
+            for i in range(campione)
+        ],
+        1,
+    ) * n / campione
+    return {
+        "mutui": n,
+        "float_s": round(float_s, 5),
+        "centesimi_s": round(centesimi_s, 5),
+        "decimal_stimato_s": round(decimal_s, 4),
+        "rapporto_centesimi_float": round(centesimi_s / float_s, 2),
+        "float_non_chiusi": non_chiusi,
+        "scarto_max_interessi": round(float(np.abs(interessi_float - interessi_esatti).max()), 2),
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--mutui", type=int, nargs="+", default=[1, 100, 10_000])
+    parser.add_argument("--ripetizioni", type=int, default=5)
+    parser.add_argument("--json", action="store_true", help="stampa i risultati in JSON")
+    args = parser.parse_args()
+
+    risultati = [confronta(n, args.ripetizioni) for n in args.mutui]
+    if args.json:
+        print(json.dumps(risultati, indent=2))
+        return
+    intestazione = ("mutui", "float s", "cent s", "x", "Decimal s", "non chiusi", "scarto \u20ac")
+    print(" ".join(f"{t:>{w}}" for t, w in zip(intestazione, (7, 9, 9, 5, 10, 11, 9))))
+    for r in risultati:
+        print(
+            f"{r['mutui']:>7} {r['float_s']:>9.4f} {r['centesimi_s']:>9.4f} "
+            f"{r['rapporto_centesimi_float']:>5.2f} {r['decimal_stimato_s']:>10.4f} "
+            f"{r['float_non_chiusi']:>11} {r['scarto_max_interessi']:>9.2f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
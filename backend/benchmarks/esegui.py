@@ -0,0 +1,351 @@
+"""
+Benchmark del motore di calcolo e degli endpoint pi\u00f9 usati.
+
+Due sezioni:
+- motore: funzioni di mortgage_engine su importi e durate diverse, con la
+  cache LRU svuotata prima di ogni chiamata dove serve misurare il calcolo;
+- api: carico in-process (httpx + ASGITransport, senza rete) su database
+  sintetici di 1k/10k/100k mutui, con richieste concorrenti.
+
+I risultati vanno in un file JSON; con --confronta si paragonano a un file
+precedente e si esce con codice 1 se qualche misura peggiora oltre la soglia.
+
+    python benchmarks/esegui.py
+    python benchmarks/esegui.py --righe 1000 --solo api --uscita base.json
+    python benchmarks/esegui.py --confronta base.json --soglia 1.25
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import sqlite3
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+from pathlib import Path
+
+import numpy as np
+
+CARTELLA = Path(__file__).resolve().parent
+sys.path.insert(0, str(CARTELLA.parent))
+# Il database del server non va mai toccato: ogni taglia ha la sua cartella
+os.environ["DB_DIR"] = tempfile.mkdtemp(prefix="bancadvisor-bench-")
+
+import database  # noqa: E402
+from mortgage_engine import (  # noqa: E402
+    COLONNE_PUNTEGGIO,
+    SPESE_ACCESSORIE,
+    calcola_metriche,
+    calcola_piani_ammortamento,
+    calcola_piano_ammortamento,
+    calcola_punteggi,
+    calcola_punteggio,
+    calcola_rata_mensile,
+    confronta_mutui,
+    svuota_cache,
+)
+
+IMPORTI = (100_000, 300_000)
+DURATE = (10, 20, 30, 40)
+TAN = 3.45
+BANCHE = ("Intesa", "UniCredit", "BPER", "Banco BPM", "Cr\u00e9dit Agricole", "MPS", "Fineco", "ING")
+TIPI = ("fisso", "variabile", "misto")
+
+
+def mutui_sintetici(n: int, seme: int = 7) -> list[dict]:
+    """Mutui plausibili e riproducibili, con i campi derivati gi\u00e0 calcolati."""
+    rng = random.Random(seme)
+    righe = []
+    for _ in range(n):
+        importo = round(rng.uniform(60_000, 450_000), 2)
+        righe.append({
+            "banca": rng.choice(BANCHE),
+            "tipo_tasso": rng.choice(TIPI),
+            "tan": round(rng.uniform(1.5, 5.5), 2),
+            "taeg": rng.choice((None, round(rng.uniform(1.7, 6.0), 2))),
+            "spread": None,
+            "importo": importo,
+            "valore_immobile": round(importo / rng.uniform(0.5, 0.95), 2),
+            "durata_anni": rng.choice((10, 15, 20, 25, 30)),
+            "spese_istruttoria": rng.choice((0, 500, 1000, 1500)),
+            "spese_perizia": rng.choice((0, 250, 350)),
+            "costo_assicurazione": rng.choice((0, 800, 2500)),
+            "spese_notarili": rng.choice((0, 1800, 3200)),
+            "altre_spese": 0,
+            "note": None,
+            "verificato": rng.random() < 0.3,
+        })
+    colonne = {nome: [r[nome] for r in righe] for nome in righe[0]}
+    for nome, valori in calcola_metriche(colonne).items():
+        for riga, valore in zip(righe, valori.tolist()):
+            riga[nome] = valore
+    return righe
+
+
+# --- Motore -----------------------------------------------------------------
+
+def _misura(funzione, ripetizioni: int, numero: int = 1) -> dict:
+    """Tempo per chiamata (minimo e mediana su `ripetizioni` giri di `numero` chiamate)."""
+    tempi = []
+    for _ in range(ripetizioni):
+        inizio = time.perf_counter()
+        for _ in range(numero):
+            funzione()
+        tempi.append((time.perf_counter() - inizio) / numero)
+    return {"secondi_min": min(tempi), "secondi_mediana": statistics.median(tempi)}
+
+
+def _a_freddo(funzione, *args):
+    def chiamata():
+        svuota_cache()
+        return funzione(*args)
+    return chiamata
+
+
+def benchmark_motore(ripetizioni: int) -> list[dict]:
+    risultati = []
+
+    def registra(nome: str, parametri: dict, misura: dict) -> None:
+        risultati.append({"nome": nome, "parametri": parametri, **misura})
+        print(f"  {nome:<32} {json.dumps(parametri):<42} {misura['secondi_min'] * 1e3:>10.3f} ms")
+
+    for importo in IMPORTI:
+        for durata in DURATE:
+            parametri = {"importo": importo, "durata_anni": durata}
+            registra(
+                "calcola_rata_mensile",
+                parametri,
+                _misura(_a_freddo(calcola_rata_mensile, importo, TAN, durata), ripetizioni, 50),
+            )
+            registra(
+                "calcola_piano_ammortamento",
+                parametri,
+                _misura(_a_freddo(calcola_piano_ammortamento, importo, TAN, durata), ripetizioni, 5),
+            )
+            registra(
+                "calcola_piano_ammortamento/cache",
+                parametri,
+                _misura(lambda: calcola_piano_ammortamento(importo, TAN, durata), ripetizioni, 20),
+            )
+
+    for n in (1_000, 10_000, 100_000):
+        mutui = mutui_sintetici(n)
+        colonne = {nome: [m[nome] for m in mutui] for nome in mutui[0]}
+        punteggio = {nome: colonne[nome] for nome in COLONNE_PUNTEGGIO}
+        registra("calcola_metriche", {"mutui": n}, _misura(lambda: calcola_metriche(colonne), ripetizioni))
+        registra("calcola_punteggi", {"mutui": n}, _misura(lambda: calcola_punteggi(punteggio), ripetizioni))
+        if n <= 10_000:
+            registra(
+                "calcola_punteggio (per riga)",
+                {"mutui": n},
+                _misura(lambda: [calcola_punteggio(m) for m in mutui], ripetizioni),
+            )
+            registra(
+                "confronta_mutui",
+                {"mutui": n},
+                _misura(lambda: confronta_mutui([{"id": i, **m} for i, m in enumerate(mutui)]), ripetizioni),
+            )
+            registra(
+                "calcola_piani_ammortamento",
+                {"mutui": n},
+                _misura(
+                    lambda: calcola_piani_ammortamento(
+                        colonne["importo"], colonne["tan"], colonne["durata_anni"]
+                    ),
+                    ripetizioni,
+                ),
+            )
+    return risultati
+
+
+# --- API --------------------------------------------------------------------
+
+_COLONNE_INSERT = (
+    "banca", "tipo_tasso", "tan", "taeg", "spread", "importo", "valore_immobile", "durata_anni",
+    *SPESE_ACCESSORIE, "note", "verificato", "rata_mensile", "ltv", "totale_interessi",
+    "costo_totale", "taeg_calcolato", "punteggio",
+)
+
+
+async def prepara_database(righe: int) -> Path:
+    """Crea un database con lo schema corrente e `righe` mutui sintetici."""
+    cartella = Path(os.environ["DB_DIR"]) / str(righe)
+    cartella.mkdir(exist_ok=True)
+    database.DB_PATH = cartella / "bancadvisor.db"
+    database.DB_PATH.unlink(missing_ok=True)
+    await database.init_db()
+    con = sqlite3.connect(database.DB_PATH)
+    with con:
+        con.executemany(
+            f"INSERT INTO mutui ({', '.join(_COLONNE_INSERT)}) "
+            f"VALUES ({', '.join('?' for _ in _COLONNE_INSERT)})",
+            ([m[nome] for nome in _COLONNE_INSERT] for m in mutui_sintetici(righe)),
+        )
+    con.execute("ANALYZE")
+    con.close()
+    return database.DB_PATH
+
+
+async def carico(client, richiesta, totale: int, concorrenza: int) -> dict:
+    """Esegue `totale` richieste con `concorrenza` client; latenze in ms."""
+    latenze, errori = [], 0
+    prossima = 0
+
+    async def cliente():
+        nonlocal prossima, errori
+        while prossima < totale:
+            numero = prossima
+            prossima += 1
+            metodo, url, opzioni = richiesta(numero)
+            inizio = time.perf_counter()
+            risposta = await client.request(metodo, url, **opzioni)
+            latenze.append((time.perf_counter() - inizio) * 1e3)
+            if risposta.status_code >= 400:
+                errori += 1
+
+    inizio = time.perf_counter()
+    await asyncio.gather(*(cliente() for _ in range(concorrenza)))
+    secondi = time.perf_counter() - inizio
+    p50, p95, p99 = np.percentile(latenze, (50, 95, 99))
+    return {
+        "richieste": totale,
+        "concorrenza": concorrenza,
+        "errori": errori,
+        "secondi": secondi,
+        "richieste_al_secondo": totale / secondi,
+        "p50_ms": float(p50),
+        "p95_ms": float(p95),
+        "p99_ms": float(p99),
+        "max_ms": max(latenze),
+    }
+
+
+async def benchmark_api(taglie: list[int], richieste: int, concorrenza: int) -> list[dict]:
+    import httpx
+    from main import app
+
+    risultati = []
+    for righe in taglie:
+        inizio = time.perf_counter()
+        await prepara_database(righe)
+        print(f"  database da {righe} mutui pronto in {time.perf_counter() - inizio:.1f} s")
+        rng = random.Random(righe)
+
+        # La lista completa legge tutte le righe: meno richieste sulle tabelle grandi
+        lista = max(3, min(richieste, 200_000 // righe))
+        # (nome, richieste, concorrenza, richiesta): il ricalcolo scrive, una volta sola
+        scenari = [
+            ("GET /api/mutui/", lista, concorrenza, lambda i: ("GET", "/api/mutui/", {})),
+            (
+                "GET /api/mutui/pagina",
+                richieste,
+                concorrenza,
+                lambda i: ("GET", "/api/mutui/pagina", {"params": {"limite": 50}}),
+            ),
+            (
+                "POST /api/confronto/",
+                richieste,
+                concorrenza,
+                lambda i: ("POST", "/api/confronto/", {"json": rng.sample(range(1, righe + 1), 5)}),
+            ),
+            (
+                "GET /api/confronto/top",
+                max(3, richieste // 10),
+                concorrenza,
+                lambda i: ("GET", "/api/confronto/top", {"params": {"k": 10}}),
+            ),
+            ("POST /api/mutui/ricalcola", 1, 1, lambda i: ("POST", "/api/mutui/ricalcola", {})),
+        ]
+        async with app.router.lifespan_context(app):
+            transport = httpx.ASGITransport(app=app)
+            async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as client:
+                for nome, totale, paralleli, richiesta in scenari:
+                    esito = await carico(client, richiesta, totale, paralleli)
+                    risultati.append({"nome": nome, "parametri": {"righe": righe}, **esito})
+                    print(
+                        f"  {nome:<28} {righe:>7} righe {esito['richieste_al_secondo']:>9.1f} req/s "
+                        f"p50 {esito['p50_ms']:>8.2f} ms  p95 {esito['p95_ms']:>8.2f} ms"
+                        + (f"  {esito['errori']} errori" if esito["errori"] else "")
+                    )
+    return risultati
+
+
+# --- Confronto --------------------------------------------------------------
+
+# Misura principale di ogni voce: pi\u00f9 alta = peggio
+_METRICA = {"motore": "secondi_min", "api": "p50_ms"}
+
+
+def confronta(attuale: dict, precedente: dict, soglia: float) -> int:
+    peggiorati = 0
+    for sezione, metrica in _METRICA.items():
+        base = {
+            (r["nome"], json.dumps(r["parametri"], sort_keys=True)): r[metrica]
+            for r in precedente.get(sezione, [])
+        }
+        for r in attuale.get(sezione, []):
+            chiave = (r["nome"], json.dumps(r["parametri"], sort_keys=True))
+            if chiave not in base or not base[chiave]:
+                continue
+            rapporto = r[metrica] / base[chiave]
+            segno = "PEGGIO" if rapporto > soglia else ("meglio" if rapporto < 1 / soglia else "")
+            peggiorati += rapporto > soglia
+            if segno:
+                print(f"  {segno:<6} {sezione}: {chiave[0]} {chiave[1]} x{rapporto:.2f}")
+    print(f"{peggiorati} misure peggiorate oltre x{soglia}")
+    return 1 if peggiorati else 0
+
+
+def _commit() -> str | None:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, cwd=CARTELLA, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--solo", choices=("motore", "api"))
+    parser.add_argument("--righe", type=int, nargs="+", default=[1_000, 10_000, 100_000])
+    parser.add_argument("--richieste", type=int, default=200, help="richieste per endpoint")
+    parser.add_argument("--concorrenza", type=int, default=8)
+    parser.add_argument("--ripetizioni", type=int, default=5)
+    parser.add_argument("--uscita", type=Path, help="file JSON dei risultati")
+    parser.add_argument("--confronta", type=Path, help="risultati precedenti da confrontare")
+    parser.add_argument("--soglia", type=float, default=1.2, help="rapporto oltre il quale \u00e8 un peggioramento")
+    args = parser.parse_args()
+
+    risultati = {
+        "meta": {
+            "data": datetime.now().isoformat(timespec="seconds"),
+            "commit": _commit(),
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+            "piattaforma": platform.platform(),
+            "cpu": os.cpu_count(),
+        }
+    }
+    if args.solo != "api":
+        print("Motore:")
+        risultati["motore"] = benchmark_motore(args.ripetizioni)
+    if args.solo != "motore":
+        print("API:")
+        risultati["api"] = asyncio.run(benchmark_api(args.righe, args.richieste, args.concorrenza))
+
+    uscita = args.uscita or CARTELLA / "risultati" / f"{datetime.now():%Y%m%d-%H%M%S}.json"
+    uscita.parent.mkdir(parents=True, exist_ok=True)
+    uscita.write_text(json.dumps(risultati, indent=2) + "\n")
+    print(f"Risultati in {uscita}")
+    if args.confronta:
+        sys.exit(confronta(risultati, json.loads(args.confronta.read_text()), args.soglia))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,19 +1,177 @@
 import aiosqlite
+import asyncio
+import logging
+import math
 import os
+import time
+from contextlib import asynccontextmanager
 from pathlib import Path
+import numpy as np
+from eurirs import allinea_spread
+from metriche import ConnessioneMisurata
+from mortgage_engine import (
+    COLONNE_PUNTEGGIO,
+    MESI_ANNO,
+    SPESE_ACCESSORIE,
+    calcola_punteggi,
+    calcola_taeg,
+)
+
+logger = logging.getLogger(__name__)
 
 DB_PATH = Path(os.environ.get("DB_DIR", str(Path(__file__).parent))) / "bancadvisor.db"
 
 
-async def get_db():
+# Dimensione e tuning del pool di connessioni
+DB_POOL_LETTORI = int(os.environ.get("DB_POOL_READERS", "4"))
+DB_SYNCHRONOUS = os.environ.get("DB_SYNCHRONOUS", "NORMAL")
+DB_CACHE_KIB = int(os.environ.get("DB_CACHE_KIB", "8192"))
+DB_MMAP_BYTES = int(os.environ.get("DB_MMAP_BYTES", str(64 * 1024 * 1024)))
+DB_BUSY_TIMEOUT_MS = int(os.environ.get("DB_BUSY_TIMEOUT_MS", "5000"))
+
+
+async def apri_connessione(sola_lettura: bool = False) -> aiosqlite.Connection:
+    """Apre una connessione con i PRAGMA di tuning del pool."""
     db = await aiosqlite.connect(DB_PATH)
     db.row_factory = aiosqlite.Row
-    await db.execute("PRAGMA journal_mode=WAL")
     await db.execute("PRAGMA foreign_keys=ON")
-    try:
+    await db.execute(f"PRAGMA synchronous={DB_SYNCHRONOUS}")
+    await db.execute(f"PRAGMA cache_size=-{DB_CACHE_KIB}")
+    await db.execute(f"PRAGMA mmap_size={DB_MMAP_BYTES}")
+    await db.execute("PRAGMA temp_store=MEMORY")
+    await db.execute(f"PRAGMA busy_timeout={DB_BUSY_TIMEOUT_MS}")
+    if sola_lettura:
+        await db.execute("PRAGMA query_only=ON")
+    return db
+
+
+class PoolConnessioni:
+    """
+    Connessioni SQLite persistenti: uno scrittore esclusivo e N lettori.
+
+    In WAL i lettori non bloccano lo scrittore e viceversa, quindi le letture
+    vanno in parallelo mentre le scritture sono serializzate da un lock
+    (SQLite ne ammette comunque una sola alla volta).
+    """
+
+    def __init__(self, lettori: int = DB_POOL_LETTORI):
+        self.num_lettori = max(1, lettori)
+        self._scrittore: aiosqlite.Connection | None = None
+        self._lock_scrittura = asyncio.Lock()
+        self._lettori: asyncio.Queue[aiosqlite.Connection] = asyncio.Queue()
+        self._connessioni: list[aiosqlite.Connection] = []
+        self._statistiche = {
+            "acquisizioni_lettura": 0,
+            "acquisizioni_scrittura": 0,
+            "attesa_lettura_s": 0.0,
+            "attesa_scrittura_s": 0.0,
+            "rollback": 0,
+        }
+
+    async def apri(self) -> None:
+        # Connessioni misurate: i tempi delle query finiscono in /api/metrics
+        self._scrittore = ConnessioneMisurata(await apri_connessione(), "scrittore")
+        await self._scrittore.execute("PRAGMA journal_mode=WAL")
+        self._connessioni.append(self._scrittore)
+        for _ in range(self.num_lettori):
+            db = ConnessioneMisurata(await apri_connessione(sola_lettura=True), "lettore")
+            self._connessioni.append(db)
+            self._lettori.put_nowait(db)
+
+    async def chiudi(self) -> None:
+        for db in self._connessioni:
+            await db.close()
+        self._connessioni.clear()
+        self._scrittore = None
+        self._lettori = asyncio.Queue()
+
+    @asynccontextmanager
+    async def scrittore(self):
+        """Connessione di scrittura, in uso esclusivo finch\u00e9 il blocco \u00e8 aperto."""
+        inizio = time.perf_counter()
+        async with self._lock_scrittura:
+            self._statistiche["attesa_scrittura_s"] += time.perf_counter() - inizio
+            self._statistiche["acquisizioni_scrittura"] += 1
+            db = self._scrittore
+            try:
+                yield db
+            finally:
+                # Una transazione lasciata aperta da un errore non deve passare al prossimo
+                if db.in_transaction:
+                    await db.rollback()
+                    self._statistiche["rollback"] += 1
+
+    @asynccontextmanager
+    async def lettore(self):
+        """Connessione di sola lettura presa dal pool e restituita all'uscita."""
+        inizio = time.perf_counter()
+        db = await self._lettori.get()
+        self._statistiche["attesa_lettura_s"] += time.perf_counter() - inizio
+        self._statistiche["acquisizioni_lettura"] += 1
+        try:
+            yield db
+        finally:
+            self._lettori.put_nowait(db)
+
+    def stato(self) -> dict:
+        s = self._statistiche
+        return {
+            "lettori": self.num_lettori,
+            "lettori_liberi": self._lettori.qsize(),
+            "scrittore_occupato": self._lock_scrittura.locked(),
+            **{k: round(v, 6) if isinstance(v, float) else v for k, v in s.items()},
+            "attesa_media_lettura_ms": round(
+                s["attesa_lettura_s"] * 1000 / s["acquisizioni_lettura"], 3
+            ) if s["acquisizioni_lettura"] else 0.0,
+            "attesa_media_scrittura_ms": round(
+                s["attesa_scrittura_s"] * 1000 / s["acquisizioni_scrittura"], 3
+            ) if s["acquisizioni_scrittura"] else 0.0,
+        }
+
+    async def salute(self) -> dict:
+        """Verifica che il database risponda e riporta lo stato del pool."""
+        try:
+            async with self.lettore() as db:
+                await db.execute("SELECT 1")
+            ok = True
+        except Exception:
+            ok = False
+        return {"ok": ok, **self.stato()}
+
+
+_pool: PoolConnessioni | None = None
+
+
+async def apri_pool(lettori: int = DB_POOL_LETTORI) -> PoolConnessioni:
+    global _pool
+    _pool = PoolConnessioni(lettori)
+    await _pool.apri()
+    return _pool
+
+
+async def chiudi_pool() -> None:
+    global _pool
+    if _pool is not None:
+        await _pool.chiudi()
+        _pool = None
+
+
+def get_pool() -> PoolConnessioni:
+    if _pool is None:
+        raise RuntimeError("Pool di connessioni non inizializzato")
+    return _pool
+
+
+async def get_db():
+    """Dependency per gli endpoint che scrivono: connessione di scrittura esclusiva."""
+    async with get_pool().scrittore() as db:
+        yield db
+
+
+async def get_db_lettura():
+    """Dependency per gli endpoint di sola lettura."""
+    async with get_pool().lettore() as db:
         yield db
-    finally:
-        await db.close()
 
 
 async def init_db():
@@ -69,9 +227,242 @@ async def init_db():
 
         await db.commit()
 
-        # Migrate: add verificato column if missing
-        cursor = await db.execute("PRAGMA table_info(mutui)")
-        cols = [row[1] for row in await cursor.fetchall()]
-        if "verificato" not in cols:
-            await db.execute("ALTER TABLE mutui ADD COLUMN verificato INTEGER DEFAULT 0")
-            await db.commit()
+        await applica_migrazioni(db)
+        await verifica_piani_query(db)
+
+
+async def _colonne_tabella(db, tabella: str) -> list[str]:
+    cursor = await db.execute(f"PRAGMA table_info({tabella})")
+    return [row[1] for row in await cursor.fetchall()]
+
+
+async def _m001_verificato(db):
+    """Colonna verificato sui database creati prima della sua introduzione."""
+    if "verificato" not in await _colonne_tabella(db, "mutui"):
+        await db.execute("ALTER TABLE mutui ADD COLUMN verificato INTEGER DEFAULT 0")
+
+
+async def _m002_indici(db):
+    """Indici per ordinamenti e filtri di lista mutui e storico consulenze."""
+    await db.execute("CREATE INDEX IF NOT EXISTS idx_mutui_punteggio ON mutui(punteggio)")
+    await db.execute("CREATE INDEX IF NOT EXISTS idx_mutui_banca ON mutui(banca)")
+    await db.execute("CREATE INDEX IF NOT EXISTS idx_mutui_tipo_tasso ON mutui(tipo_tasso)")
+    await db.execute("CREATE INDEX IF NOT EXISTS idx_mutui_verificato ON mutui(verificato)")
+    await db.execute(
+        "CREATE INDEX IF NOT EXISTS idx_consulenze_created_at ON consulenze(created_at)"
+    )
+
+
+async def _m003_indici_composti(db):
+    """Indici composti filtro + punteggio per la lista paginata."""
+    await db.execute("DROP INDEX IF EXISTS idx_mutui_banca")
+    await db.execute("DROP INDEX IF EXISTS idx_mutui_tipo_tasso")
+    await db.execute("DROP INDEX IF EXISTS idx_mutui_verificato")
+    await db.execute(
+        "CREATE INDEX IF NOT EXISTS idx_mutui_banca_punteggio ON mutui(banca, punteggio)"
+    )
+    await db.execute(
+        "CREATE INDEX IF NOT EXISTS idx_mutui_tipo_tasso_punteggio ON mutui(tipo_tasso, punteggio)"
+    )
+    await db.execute(
+        "CREATE INDEX IF NOT EXISTS idx_mutui_verificato_punteggio ON mutui(verificato, punteggio)"
+    )
+
+
+async def _m004_cache_consulenze(db):
+    """Impronta e modello delle consulenze, per riusare le risposte identiche."""
+    colonne = await _colonne_tabella(db, "consulenze")
+    if "fingerprint" not in colonne:
+        await db.execute("ALTER TABLE consulenze ADD COLUMN fingerprint TEXT")
+    if "modello" not in colonne:
+        await db.execute("ALTER TABLE consulenze ADD COLUMN modello TEXT")
+    await db.execute(
+        "CREATE INDEX IF NOT EXISTS idx_consulenze_fingerprint ON consulenze(fingerprint)"
+    )
+
+
+async def _m005_spread_eurirs(db):
+    """Storico versionato dell'Eurirs e spread dei fissi calcolato lato server."""
+    await db.execute("""
+        CREATE TABLE IF NOT EXISTS eurirs_storico (
+            versione INTEGER PRIMARY KEY AUTOINCREMENT,
+            valore REAL NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+    colonne = await _colonne_tabella(db, "mutui")
+    if "spread_eurirs" not in colonne:
+        await db.execute("ALTER TABLE mutui ADD COLUMN spread_eurirs REAL")
+    if "eurirs_versione" not in colonne:
+        await db.execute("ALTER TABLE mutui ADD COLUMN eurirs_versione INTEGER")
+    # Il valore gi\u00e0 impostato diventa la prima versione
+    await db.execute("""
+        INSERT INTO eurirs_storico (valore, created_at)
+        SELECT CAST(value AS REAL), updated_at FROM settings
+        WHERE key = 'eurirs_30y' AND NOT EXISTS (SELECT 1 FROM eurirs_storico)
+    """)
+    await allinea_spread(db)
+
+
+async def _m006_ammortamenti(db):
+    """Piani di ammortamento salvati come BLOB, uno per mutuo."""
+    await db.execute("""
+        CREATE TABLE IF NOT EXISTS ammortamenti (
+            mutuo_id INTEGER PRIMARY KEY REFERENCES mutui(id) ON DELETE CASCADE,
+            impronta TEXT NOT NULL,
+            num_rate INTEGER NOT NULL,
+            dati BLOB NOT NULL
+        )
+    """)
+
+
+async def _aggiorna_punteggi(db):
+    """Ricalcola il punteggio salvato di tutti i mutui dalle colonne correnti."""
+    cursor = await db.execute(f"SELECT id, {', '.join(COLONNE_PUNTEGGIO)} FROM mutui")
+    rows = await cursor.fetchall()
+    if not rows:
+        return
+    ids, *valori = zip(*rows)
+    punteggi = calcola_punteggi(dict(zip(COLONNE_PUNTEGGIO, valori)))
+    await db.executemany(
+        "UPDATE mutui SET punteggio = ? WHERE id = ?", zip(punteggi.tolist(), ids)
+    )
+
+
+async def _m007_taeg_calcolato(db):
+    """TAEG calcolato dai flussi di cassa, accanto a quello dichiarato."""
+    if "taeg_calcolato" not in await _colonne_tabella(db, "mutui"):
+        await db.execute("ALTER TABLE mutui ADD COLUMN taeg_calcolato REAL")
+    cursor = await db.execute(
+        f"SELECT id, importo, rata_mensile, durata_anni, "
+        f"{' + '.join(f'COALESCE({nome}, 0)' for nome in SPESE_ACCESSORIE)} FROM mutui"
+    )
+    rows = await cursor.fetchall()
+    if not rows:
+        return
+    ids, importi, rate, durate, spese = (
+        np.array(colonna, dtype=np.float64) for colonna in zip(*rows)
+    )
+    taeg = calcola_taeg(importi, rate, durate * MESI_ANNO, spese)
+    await db.executemany(
+        "UPDATE mutui SET taeg_calcolato = ? WHERE id = ?",
+        ((None if math.isnan(t) else t, int(i)) for t, i in zip(taeg.tolist(), ids.tolist())),
+    )
+    # Il punteggio dipende dal TAEG calcolato: senza ricalcolo lista e pagine
+    # ordinerebbero con i valori vecchi, diversi da quelli di /confronto/top
+    await _aggiorna_punteggi(db)
+
+
+async def _m008_punteggio_taeg(db):
+    """Punteggi con il maggiore tra TAEG dichiarato e calcolato."""
+    await _aggiorna_punteggi(db)
+
+
+async def _m009_punteggio_senza_taeg(db):
+    """Punteggi senza il TAEG calcolato per le offerte prive di TAEG dichiarato."""
+    await _aggiorna_punteggi(db)
+
+
+# Migrazioni in ordine: la posizione (da 1) \u00e8 la versione registrata in
+# PRAGMA user_version. Non riordinare: aggiungere solo in coda.
+MIGRAZIONI = [
+    _m001_verificato,
+    _m002_indici,
+    _m003_indici_composti,
+    _m004_cache_consulenze,
+    _m005_spread_eurirs,
+    _m006_ammortamenti,
+    _m007_taeg_calcolato,
+    _m008_punteggio_taeg,
+    _m009_punteggio_senza_taeg,
+]
+
+
+async def applica_migrazioni(db) -> int:
+    """
+    Applica le migrazioni mancanti e ritorna la versione raggiunta.
+
+    Ogni migrazione gira in un BEGIN esplicito insieme al PRAGMA user_version:
+    il modulo sqlite3 apre da s\u00e9 una transazione solo prima di INSERT/UPDATE,
+    quindi senza BEGIN gli ALTER/CREATE sarebbero gi\u00e0 confermati uno per uno.
+    Se una migrazione fallisce a met\u00e0 si torna allo schema e alla versione
+    di prima.
+    """
+    await db.commit()
+    cursor = await db.execute("PRAGMA user_version")
+    versione = (await cursor.fetchone())[0]
+    for numero, migrazione in enumerate(MIGRAZIONI, 1):
+        if numero <= versione:
+            continue
+        logger.info("Migrazione %d: %s", numero, migrazione.__doc__)
+        await db.execute("BEGIN")
+        try:
+            await migrazione(db)
+            await db.execute(f"PRAGMA user_version={numero}")
+        except BaseException:
+            await db.rollback()
+            raise
+        await db.commit()
+        versione = numero
+    return versione
+
+
+# Query calde e indice che il planner deve usare per servirle
+PIANI_ATTESI = {
+    "lista_mutui": ("SELECT * FROM mutui ORDER BY punteggio DESC", "idx_mutui_punteggio"),
+    "pagina_mutui": (
+        "SELECT * FROM mutui WHERE punteggio IS NOT NULL AND punteggio <= 50 "
+        "AND (punteggio < 50 OR id < 10) ORDER BY punteggio DESC, id DESC LIMIT 51",
+        "idx_mutui_punteggio",
+    ),
+    "pagina_banca": (
+        "SELECT * FROM mutui WHERE banca = 'x' AND punteggio IS NOT NULL "
+        "ORDER BY punteggio DESC, id DESC LIMIT 51",
+        "idx_mutui_banca_punteggio",
+    ),
+    "pagina_tipo_tasso": (
+        "SELECT * FROM mutui WHERE tipo_tasso = 'fisso' AND punteggio IS NOT NULL "
+        "ORDER BY punteggio DESC, id DESC LIMIT 51",
+        "idx_mutui_tipo_tasso_punteggio",
+    ),
+    "pagina_verificato": (
+        "SELECT * FROM mutui WHERE verificato = 1 AND punteggio IS NOT NULL "
+        "ORDER BY punteggio DESC, id DESC LIMIT 51",
+        "idx_mutui_verificato_punteggio",
+    ),
+    "cache_consulenze": (
+        "SELECT id, risposta FROM consulenze WHERE fingerprint = 'x' ORDER BY id DESC LIMIT 1",
+        "idx_consulenze_fingerprint",
+    ),
+    "storico_consulenze": (
+        "SELECT * FROM consulenze ORDER BY created_at DESC LIMIT 50",
+        "idx_consulenze_created_at",
+    ),
+    "piano_ammortamento": (
+        "SELECT m.importo, a.impronta, substr(a.dati, 1, 32) FROM mutui m "
+        "LEFT JOIN ammortamenti a ON a.mutuo_id = m.id WHERE m.id = 1",
+        "INTEGER PRIMARY KEY",
+    ),
+}
+
+controllo_piani: dict = {}
+
+
+async def verifica_piani_query(db) -> dict:
+    """
+    Controlla con EXPLAIN QUERY PLAN che le query calde usino i loro indici.
+
+    Non blocca l'avvio: le regressioni (scansione completa o ordinamento in
+    B-tree temporaneo) finiscono nel log e in /api/health.
+    """
+    risultati = {}
+    for nome, (query, indice) in PIANI_ATTESI.items():
+        cursor = await db.execute(f"EXPLAIN QUERY PLAN {query}")
+        dettagli = [row[3] for row in await cursor.fetchall()]
+        ok = any(indice in d for d in dettagli) and not any("TEMP B-TREE" in d for d in dettagli)
+        if not ok:
+            logger.warning("Piano di query inatteso per %s: %s", nome, " | ".join(dettagli))
+        risultati[nome] = {"ok": ok, "piano": dettagli}
+    controllo_piani.clear()
+    controllo_piani.update(risultati)
+    return risultati
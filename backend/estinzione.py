@@ -0,0 +1,212 @@
+"""
+Estinzioni anticipate, parziali e totali, e surroga su un piano di ammortamento.
+
+Gli eventi valgono dopo il pagamento della rata del loro mese. I mesi prima
+del primo evento sono quelli del piano base (salvato o in cache) e non si
+ricalcolano: la simulazione riparte dal debito residuo di quel mese, con gli
+stessi arrotondamenti al centesimo del piano base. Nell'ultimo mese la quota
+capitale chiude esattamente il debito rimasto.
+"""
+import math
+from dataclasses import dataclass
+
+import numpy as np
+
+from mortgage_engine import MESI_ANNO
+
+TIPI_EVENTO = ("parziale", "totale", "surroga")
+STRATEGIE = ("riduci_durata", "riduci_rata")
+
+# Colonne dei piani base: come nel BLOB di ammortamento.py
+_RATA, _CAPITALE, _INTERESSI, _DEBITO = range(4)
+
+
+class EventoNonValido(ValueError):
+    """Evento incompleto o fuori dalla durata del mutuo."""
+
+
+@dataclass(frozen=True)
+class Evento:
+    tipo: str
+    mese: int
+    importo: float | None = None
+    strategia: str = "riduci_durata"
+    tan: float | None = None
+    durata_mesi: int | None = None
+    spese: float = 0.0
+
+
+def rata_per_mesi(debito: float, tan: float, mesi: int) -> float:
+    """Rata alla francese per `mesi` rate, con gli arrotondamenti del motore."""
+    if mesi <= 0:
+        raise EventoNonValido("Nessuna rata rimasta su cui ricalcolare la rata")
+    if tan == 0:
+        return debito / mesi
+    tasso_mensile = (tan / 100) / MESI_ANNO
+    fattore = pow(1 + tasso_mensile, mesi)
+    return round((debito * tasso_mensile * fattore) / (fattore - 1), 2)
+
+
+def _controlla(evento: Evento, num_rate: int) -> None:
+    if evento.tipo not in TIPI_EVENTO:
+        raise EventoNonValido(f"Tipo di evento sconosciuto: {evento.tipo}")
+    if not 1 <= evento.mese <= num_rate:
+        raise EventoNonValido(f"Mese {evento.mese} fuori dalla durata del mutuo ({num_rate} rate)")
+    if evento.tipo == "parziale":
+        if not evento.importo or evento.importo <= 0:
+            raise EventoNonValido(f"Estinzione parziale al mese {evento.mese}: manca l'importo")
+        if evento.strategia not in STRATEGIE:
+            raise EventoNonValido(f"Strategia sconosciuta: {evento.strategia}")
+    if evento.tipo == "surroga" and evento.tan is None:
+        raise EventoNonValido(f"Surroga al mese {evento.mese}: manca il TAN della nuova offerta")
+
+
+def _controlla_rate_rimaste(evento: Evento, mese: int, mesi_restanti: int) -> None:
+    """
+    Riduci_rata e surroga ricalcolano la rata sulle rate rimaste: all'ultima
+    rata del piano (anche dopo una surroga) non ce ne sono pi\u00f9, e il debito
+    residuo lasciato dagli arrotondamenti non si pu\u00f2 ripartire.
+    """
+    if mesi_restanti > 0:
+        return
+    if evento.tipo == "surroga":
+        raise EventoNonValido(
+            f"Surroga al mese {mese}: \u00e8 l'ultima rata del piano, indicare durata_mesi"
+        )
+    raise EventoNonValido(
+        f"Estinzione parziale al mese {mese}: \u00e8 l'ultima rata del piano, "
+        "nessuna rata da ridurre (usare riduci_durata)"
+    )
+
+
+def simula_eventi(
+    base: np.ndarray, tan: float, eventi: list[Evento], includi_piano: bool = False
+) -> dict:
+    """
+    Applica `eventi` al piano `base` (matrice mesi x [rata, quota capitale,
+    quota interessi, debito residuo]) di un mutuo al TAN `tan`.
+
+    Ritorna i totali dello scenario e del piano base, gli eventi applicati e,
+    con `includi_piano`, le righe ricalcolate dal mese dopo il primo evento
+    (le precedenti sono quelle del piano base).
+    """
+    num_rate = len(base)
+    for evento in eventi:
+        _controlla(evento, num_rate)
+    # fsum: somme esatte, indipendenti dall'ordine in cui si sommano i mesi
+    interessi_base = round(math.fsum(base[:, _INTERESSI].tolist()), 2)
+    rata_base = float(base[0, _RATA])
+    base_totali = {"mesi": num_rate, "rata": rata_base, "totale_interessi": interessi_base}
+    if not eventi:
+        return {
+            "mesi": num_rate,
+            "rata_finale": rata_base,
+            "totale_interessi": interessi_base,
+            "versamenti_extra": 0.0,
+            "spese_eventi": 0.0,
+            "totale_versato": round(math.fsum(base[:, _RATA].tolist()), 2),
+            "interessi_risparmiati": 0.0,
+            "mesi_risparmiati": 0,
+            "base": base_totali,
+            "eventi": [],
+            **({"piano_da": None, "piano": []} if includi_piano else {}),
+        }
+
+    # Eventi dello stesso mese nell'ordine in cui sono stati indicati
+    eventi = sorted(eventi, key=lambda e: e.mese)
+    primo = eventi[0].mese
+    mese = primo
+    debito = float(base[primo - 1, _DEBITO])
+    rata = rata_base
+    tan_corrente = tan
+    mesi_restanti = num_rate - primo
+    interessi = base[:primo, _INTERESSI].tolist()
+    rate_versate = base[:primo, _RATA].tolist()
+    extra = 0.0
+    spese = 0.0
+    applicati = []
+    righe = []
+    prossimo = 0
+
+    while True:
+        while prossimo < len(eventi) and eventi[prossimo].mese == mese:
+            evento = eventi[prossimo]
+            prossimo += 1
+            prima = debito
+            if debito <= 0:
+                applicati.append({"tipo": evento.tipo, "mese": mese, "applicato": False})
+                continue
+            if evento.tipo == "parziale":
+                versato = min(evento.importo, debito)
+                debito = round(debito - versato, 2)
+                extra += versato
+                if debito > 0 and evento.strategia == "riduci_rata":
+                    _controlla_rate_rimaste(evento, mese, mesi_restanti)
+                    rata = rata_per_mesi(debito, tan_corrente, mesi_restanti)
+            elif evento.tipo == "totale":
+                extra += debito
+                debito = 0.0
+            else:
+                tan_corrente = evento.tan
+                if evento.durata_mesi:
+                    mesi_restanti = evento.durata_mesi
+                _controlla_rate_rimaste(evento, mese, mesi_restanti)
+                rata = rata_per_mesi(debito, tan_corrente, mesi_restanti)
+            spese += evento.spese
+            applicati.append({
+                "tipo": evento.tipo,
+                "mese": mese,
+                "applicato": True,
+                "debito_prima": prima,
+                "debito_dopo": debito,
+                "rata_dopo": rata if debito > 0 else 0.0,
+                "tan_dopo": tan_corrente,
+                "mesi_restanti": mesi_restanti if debito > 0 else 0,
+            })
+
+        if debito <= 0 or mesi_restanti <= 0:
+            # Eventi successivi alla chiusura del mutuo
+            applicati.extend(
+                {"tipo": e.tipo, "mese": e.mese, "applicato": False} for e in eventi[prossimo:]
+            )
+            break
+
+        mese += 1
+        mesi_restanti -= 1
+        tasso_mensile = (tan_corrente / 100) / MESI_ANNO
+        quota_interessi = round(debito * tasso_mensile, 2)
+        if mesi_restanti == 0 or rata - quota_interessi >= debito:
+            quota_capitale = debito
+            pagato = round(debito + quota_interessi, 2)
+        else:
+            quota_capitale = round(rata - quota_interessi, 2)
+            pagato = rata
+        debito = max(round(debito - quota_capitale, 2), 0.0)
+        interessi.append(quota_interessi)
+        rate_versate.append(pagato)
+        if includi_piano:
+            righe.append({
+                "mese": mese,
+                "rata": pagato,
+                "quota_capitale": quota_capitale,
+                "quota_interessi": quota_interessi,
+                "debito_residuo": debito,
+            })
+
+    interessi = round(math.fsum(interessi), 2)
+    risultato = {
+        "mesi": mese,
+        "rata_finale": rata,
+        "totale_interessi": interessi,
+        "versamenti_extra": round(extra, 2),
+        "spese_eventi": round(spese, 2),
+        "totale_versato": round(math.fsum(rate_versate) + extra + spese, 2),
+        "interessi_risparmiati": round(interessi_base - interessi, 2),
+        "mesi_risparmiati": num_rate - mese,
+        "base": base_totali,
+        "eventi": applicati,
+    }
+    if includi_piano:
+        risultato["piano_da"] = primo + 1
+        risultato["piano"] = righe
+    return risultato
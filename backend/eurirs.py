@@ -0,0 +1,72 @@
+"""
+Eurirs 30Y: storico versionato dei valori e spread dei mutui a tasso fisso.
+
+Lo spread di un fisso \u00e8 max(0, TAN - Eurirs) arrotondato a due decimali.
+Ogni riga ricorda la versione di Eurirs con cui \u00e8 stato calcolato, cos\u00ec a
+ogni cambio si aggiornano solo i fissi rimasti indietro, con un solo UPDATE.
+"""
+
+CHIAVE_EURIRS = "eurirs_30y"
+
+_SQL_SPREAD = """
+    UPDATE mutui SET
+        spread_eurirs = CASE WHEN tipo_tasso = 'fisso' THEN MAX(0, ROUND(tan - :valore, 2)) END,
+        eurirs_versione = CASE WHEN tipo_tasso = 'fisso' THEN :versione END
+    WHERE {condizione}
+"""
+
+
+async def eurirs_corrente(db) -> dict | None:
+    """Ultima versione registrata: {"versione", "valore", "created_at"}."""
+    cursor = await db.execute(
+        "SELECT versione, valore, created_at FROM eurirs_storico ORDER BY versione DESC LIMIT 1"
+    )
+    row = await cursor.fetchone()
+    return dict(row) if row else None
+
+
+async def registra_eurirs(db, valore: float) -> int | None:
+    """
+    Registra un nuovo valore (storico + settings) senza fare commit.
+
+    Ritorna la nuova versione, o None se il valore \u00e8 uguale a quello corrente.
+    """
+    corrente = await eurirs_corrente(db)
+    if corrente is not None and corrente["valore"] == valore:
+        return None
+    cursor = await db.execute("INSERT INTO eurirs_storico (valore) VALUES (?)", (valore,))
+    await db.execute(
+        """INSERT INTO settings (key, value, updated_at)
+           VALUES (:key, :val, CURRENT_TIMESTAMP)
+           ON CONFLICT(key) DO UPDATE SET value=:val, updated_at=CURRENT_TIMESTAMP""",
+        {"key": CHIAVE_EURIRS, "val": str(valore)},
+    )
+    return cursor.lastrowid
+
+
+async def allinea_spread(db) -> int:
+    """Ricalcola lo spread dei soli fissi non ancora alla versione corrente."""
+    corrente = await eurirs_corrente(db)
+    if corrente is None:
+        return 0
+    cursor = await db.execute(
+        _SQL_SPREAD.format(
+            condizione="tipo_tasso = 'fisso' AND (eurirs_versione IS NULL OR eurirs_versione <> :versione)"
+        ),
+        corrente,
+    )
+    return cursor.rowcount
+
+
+async def aggiorna_spread(db, primo_id: int, ultimo_id: int | None = None) -> int:
+    """
+    Ricalcola lo spread dei mutui con id in [primo_id, ultimo_id] (senza limite
+    superiore se None), dopo inserimenti o modifiche. I non fissi restano senza spread.
+    """
+    corrente = await eurirs_corrente(db) or {"versione": None, "valore": None}
+    condizione = "id >= :primo_id" + (" AND id <= :ultimo_id" if ultimo_id is not None else "")
+    cursor = await db.execute(
+        _SQL_SPREAD.format(condizione=condizione),
+        {**corrente, "primo_id": primo_id, "ultimo_id": ultimo_id},
+    )
+    return cursor.rowcount
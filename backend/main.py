@@ -2,18 +2,31 @@ from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
 from contextlib import asynccontextmanager
-from database import init_db
+from database import init_db, apri_pool, chiudi_pool, get_pool, controllo_piani
 from routes.mutui import router as mutui_router
 from routes.confronto import router as confronto_router
 from routes.advisor import router as advisor_router
 from routes.settings import router as settings_router
+from routes.scenari import router as scenari_router
+from routes.simulazioni import router as simulazioni_router
+from routes.metriche import router as metriche_router
+from metriche import MiddlewareMetriche
+from ollama_advisor import avvia_client, chiudi_client, monitor_ollama
+from monte_carlo import chiudi_pool_processi
 import os
 
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     await init_db()
+    await apri_pool()
+    await avvia_client()
+    monitor_ollama.avvia()
     yield
+    await monitor_ollama.ferma()
+    await chiudi_client()
+    await chiudi_pool()
+    chiudi_pool_processi()
 
 
 app = FastAPI(
@@ -30,16 +43,26 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+# Aggiunto per ultimo, quindi il pi\u00f9 esterno: misura anche CORS
+app.add_middleware(MiddlewareMetriche)
 
 app.include_router(mutui_router)
 app.include_router(confronto_router)
 app.include_router(advisor_router)
 app.include_router(settings_router)
+app.include_router(scenari_router)
+app.include_router(simulazioni_router)
+app.include_router(metriche_router)
 
 
 @app.get("/api/health")
 async def health():
-    return {"status": "ok", "app": "BancaAdvisor"}
+    return {
+        "status": "ok",
+        "app": "BancaAdvisor",
+        "database": await get_pool().salute(),
+        "piani_query_ok": all(p["ok"] for p in controllo_piani.values()),
+    }
 
 
 # Serve frontend static files in production
@@ -0,0 +1,339 @@
+"""
+Metriche in formato di esposizione testuale Prometheus, senza dipendenze.
+
+Contatori e istogrammi vivono in memoria nel processo del server e si leggono
+da GET /api/metrics; i valori istantanei (cache, pool, coda, memoria) sono
+raccolti al momento della lettura. Nessun collector esterno \u00e8 necessario:
+qualunque scraper Prometheus, o un semplice curl, legge lo stesso testo.
+"""
+import math
+import os
+import time
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+PREFISSO = "bancadvisor"
+
+# Limiti superiori dei bucket (secondi)
+BUCKET_HTTP = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+BUCKET_SQLITE = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1)
+BUCKET_OLLAMA = (0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60, 120, 300)
+
+
+def _valore_etichetta(valore) -> str:
+    return str(valore).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _etichette(nomi: tuple[str, ...], valori: tuple, extra: str = "") -> str:
+    coppie = [f'{nome}="{_valore_etichetta(valore)}"' for nome, valore in zip(nomi, valori)]
+    if extra:
+        coppie.append(extra)
+    return "{" + ",".join(coppie) + "}" if coppie else ""
+
+
+def _numero(valore: float) -> str:
+    if math.isinf(valore):
+        return "+Inf" if valore > 0 else "-Inf"
+    return repr(float(valore)) if isinstance(valore, float) else str(valore)
+
+
+class Contatore:
+    """Valore che cresce soltanto, per combinazione di etichette."""
+
+    tipo = "counter"
+
+    def __init__(self, nome: str, descrizione: str, etichette: tuple[str, ...] = ()):
+        self.nome = f"{PREFISSO}_{nome}"
+        self.descrizione = descrizione
+        self.etichette = etichette
+        self._valori: dict[tuple, float] = {}
+
+    def incrementa(self, valore: float = 1, **etichette) -> None:
+        chiave = tuple(etichette[n] for n in self.etichette)
+        self._valori[chiave] = self._valori.get(chiave, 0) + valore
+
+    def righe(self) -> list[str]:
+        return [
+            f"{self.nome}{_etichette(self.etichette, chiave)} {_numero(valore)}"
+            for chiave, valore in sorted(self._valori.items())
+        ]
+
+
+class Istogramma:
+    """Distribuzione di osservazioni in bucket cumulativi, con somma e conteggio."""
+
+    tipo = "histogram"
+
+    def __init__(
+        self, nome: str, descrizione: str, etichette: tuple[str, ...] = (), bucket=BUCKET_HTTP
+    ):
+        self.nome = f"{PREFISSO}_{nome}"
+        self.descrizione = descrizione
+        self.etichette = etichette
+        self.bucket = tuple(sorted(bucket))
+        self._serie: dict[tuple, list] = {}
+
+    def osserva(self, valore: float, **etichette) -> None:
+        chiave = tuple(etichette[n] for n in self.etichette)
+        serie = self._serie.get(chiave)
+        if serie is None:
+            # conteggi per bucket (non cumulativi), somma, conteggio
+            serie = self._serie[chiave] = [[0] * len(self.bucket), 0.0, 0]
+        for i, limite in enumerate(self.bucket):
+            if valore <= limite:
+                serie[0][i] += 1
+                break
+        serie[1] += valore
+        serie[2] += 1
+
+    def righe(self) -> list[str]:
+        righe = []
+        for chiave, (conteggi, somma, totale) in sorted(self._serie.items()):
+            cumulato = 0
+            for limite, conteggio in zip(self.bucket, conteggi):
+                cumulato += conteggio
+                etichette = _etichette(self.etichette, chiave, f'le="{_numero(float(limite))}"')
+                righe.append(f"{self.nome}_bucket{etichette} {cumulato}")
+            etichette = _etichette(self.etichette, chiave, 'le="+Inf"')
+            righe.append(f"{self.nome}_bucket{etichette} {totale}")
+            righe.append(f"{self.nome}_sum{_etichette(self.etichette, chiave)} {_numero(somma)}")
+            righe.append(f"{self.nome}_count{_etichette(self.etichette, chiave)} {totale}")
+        return righe
+
+
+class Registro:
+    """Metriche del processo e raccoglitori dei valori istantanei."""
+
+    def __init__(self):
+        self._metriche: list = []
+        self._raccoglitori: list = []
+
+    def contatore(self, *args, **kwargs) -> Contatore:
+        metrica = Contatore(*args, **kwargs)
+        self._metriche.append(metrica)
+        return metrica
+
+    def istogramma(self, *args, **kwargs) -> Istogramma:
+        metrica = Istogramma(*args, **kwargs)
+        self._metriche.append(metrica)
+        return metrica
+
+    def raccoglitore(self, funzione):
+        """
+        Registra una funzione (anche come decoratore) chiamata a ogni lettura:
+        restituisce tuple (nome, tipo, descrizione, [(etichette, valore), ...]).
+        """
+        self._raccoglitori.append(funzione)
+        return funzione
+
+    def esponi(self) -> str:
+        blocchi = []
+        for metrica in self._metriche:
+            blocchi.append(f"# HELP {metrica.nome} {metrica.descrizione}")
+            blocchi.append(f"# TYPE {metrica.nome} {metrica.tipo}")
+            blocchi.extend(metrica.righe())
+        for raccogli in self._raccoglitori:
+            for nome, tipo, descrizione, campioni in raccogli():
+                nome = f"{PREFISSO}_{nome}"
+                blocchi.append(f"# HELP {nome} {descrizione}")
+                blocchi.append(f"# TYPE {nome} {tipo}")
+                for etichette, valore in campioni:
+                    if valore is None:
+                        continue
+                    nomi, valori = tuple(etichette), tuple(etichette.values())
+                    blocchi.append(f"{nome}{_etichette(nomi, valori)} {_numero(valore)}")
+        return "\n".join(blocchi) + "\n"
+
+
+registro = Registro()
+
+richieste_http = registro.istogramma(
+    "http_richiesta_secondi",
+    "Durata delle richieste HTTP per route, dall'arrivo all'ultimo byte della risposta",
+    ("metodo", "route", "stato"),
+    BUCKET_HTTP,
+)
+query_sqlite = registro.istogramma(
+    "sqlite_secondi",
+    "Durata delle operazioni SQLite sulle connessioni del pool",
+    ("connessione", "operazione", "istruzione"),
+    BUCKET_SQLITE,
+)
+ollama_durata = registro.istogramma(
+    "ollama_secondi",
+    "Durate riportate da Ollama per generazione (prefill del prompt, generazione, totale)",
+    ("fase",),
+    BUCKET_OLLAMA,
+)
+ollama_token = registro.contatore(
+    "ollama_token_total",
+    "Token elaborati da Ollama (prompt_eval_count e eval_count)",
+    ("tipo",),
+)
+ollama_generazioni = registro.contatore(
+    "ollama_generazioni_total", "Generazioni completate da Ollama"
+)
+consulenze_cache = registro.contatore(
+    "consulenze_cache_total",
+    "Ricerche nella cache delle consulenze (hit: risposta riusata, miss: da generare)",
+    ("esito",),
+)
+
+
+def registra_ollama(risultato: dict) -> None:
+    """Conteggi e durate (in ns) dell'ultimo messaggio di una generazione Ollama."""
+    ollama_generazioni.incrementa()
+    for chiave, tipo in (("prompt_eval_count", "prompt"), ("eval_count", "generati")):
+        if risultato.get(chiave):
+            ollama_token.incrementa(risultato[chiave], tipo=tipo)
+    for chiave, fase in (
+        ("prompt_eval_duration", "prefill"),
+        ("eval_duration", "generazione"),
+        ("total_duration", "totale"),
+    ):
+        if risultato.get(chiave):
+            ollama_durata.osserva(risultato[chiave] / 1e9, fase=fase)
+
+
+def _istruzione(sql: str) -> str:
+    parole = sql.split(None, 1)
+    return parole[0].upper() if parole else ""
+
+
+class CursoreMisurato:
+    """Cursore aiosqlite che misura anche il tempo di lettura delle righe."""
+
+    def __init__(self, cursore, connessione: str, istruzione: str):
+        self._cursore = cursore
+        self._connessione = connessione
+        self._istruzione = istruzione
+
+    def __getattr__(self, nome):
+        return getattr(self._cursore, nome)
+
+    def __aiter__(self):
+        return self._cursore.__aiter__()
+
+    async def _misura(self, metodo, *args):
+        inizio = time.perf_counter()
+        try:
+            return await metodo(*args)
+        finally:
+            query_sqlite.osserva(
+                time.perf_counter() - inizio,
+                connessione=self._connessione, operazione="fetch", istruzione=self._istruzione,
+            )
+
+    async def fetchone(self):
+        return await self._misura(self._cursore.fetchone)
+
+    async def fetchmany(self, *args):
+        return await self._misura(self._cursore.fetchmany, *args)
+
+    async def fetchall(self):
+        return await self._misura(self._cursore.fetchall)
+
+
+class ConnessioneMisurata:
+    """
+    Connessione aiosqlite del pool con i tempi di execute, executemany, fetch
+    e commit nell'istogramma SQLite. Tutto il resto passa alla connessione.
+    """
+
+    def __init__(self, db, connessione: str):
+        self._db = db
+        self._connessione = connessione
+
+    def __getattr__(self, nome):
+        return getattr(self._db, nome)
+
+    async def _misura(self, operazione: str, istruzione: str, metodo, *args):
+        inizio = time.perf_counter()
+        try:
+            return await metodo(*args)
+        finally:
+            query_sqlite.osserva(
+                time.perf_counter() - inizio,
+                connessione=self._connessione, operazione=operazione, istruzione=istruzione,
+            )
+
+    async def execute(self, sql: str, *args):
+        istruzione = _istruzione(sql)
+        cursore = await self._misura("execute", istruzione, self._db.execute, sql, *args)
+        return CursoreMisurato(cursore, self._connessione, istruzione)
+
+    async def executemany(self, sql: str, *args):
+        istruzione = _istruzione(sql)
+        cursore = await self._misura("executemany", istruzione, self._db.executemany, sql, *args)
+        return CursoreMisurato(cursore, self._connessione, istruzione)
+
+    async def commit(self):
+        return await self._misura("commit", "COMMIT", self._db.commit)
+
+    async def rollback(self):
+        return await self._misura("rollback", "ROLLBACK", self._db.rollback)
+
+
+class MiddlewareMetriche:
+    """
+    Middleware ASGI puro: misura ogni richiesta HTTP fino alla fine della
+    risposta (streaming compreso) e la registra con il percorso della route,
+    non con l'URL, cos\u00ec gli id non moltiplicano le serie.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        stato = 500
+        inizio = time.perf_counter()
+
+        async def send_misurato(messaggio):
+            nonlocal stato
+            if messaggio["type"] == "http.response.start":
+                stato = messaggio["status"]
+            await send(messaggio)
+
+        try:
+            await self.app(scope, receive, send_misurato)
+        finally:
+            route = getattr(scope.get("route"), "path", None)
+            if route is None:
+                route = "non_trovata" if stato == 404 else "altro"
+            richieste_http.osserva(
+                time.perf_counter() - inizio,
+                metodo=scope["method"], route=route, stato=str(stato),
+            )
+
+
+@registro.raccoglitore
+def _processo():
+    """Memoria e CPU del processo (se il sistema le espone)."""
+    metriche = []
+    try:
+        with open("/proc/self/statm") as f:
+            residente = int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+        metriche.append(
+            ("processo_memoria_residente_byte", "gauge", "Memoria residente (RSS)", [({}, residente)])
+        )
+    except (OSError, ValueError, AttributeError):
+        pass
+    if resource is not None:
+        uso = resource.getrusage(resource.RUSAGE_SELF)
+        # ru_maxrss \u00e8 in KiB su Linux, in byte su macOS
+        picco = uso.ru_maxrss if os.uname().sysname == "Darwin" else uso.ru_maxrss * 1024
+        metriche.append(
+            ("processo_memoria_picco_byte", "gauge", "Picco della memoria residente", [({}, picco)])
+        )
+        metriche.append((
+            "processo_cpu_secondi_total", "counter", "Tempo CPU (utente + sistema)",
+            [({}, uso.ru_utime + uso.ru_stime)],
+        ))
+    return metriche
@@ -1,5 +1,5 @@
 from pydantic import BaseModel, Field
-from typing import Optional
+from typing import Literal, Optional
 from enum import Enum
 
 
@@ -64,6 +64,9 @@ class MutuoResponse(BaseModel):
     costo_totale: Optional[float]
     totale_interessi: Optional[float]
     punteggio: Optional[float]
+    taeg_calcolato: Optional[float] = None
+    spread_eurirs: Optional[float] = None
+    eurirs_versione: Optional[int] = None
     verificato: bool = False
     created_at: str
     updated_at: str
@@ -77,6 +80,8 @@ class AdvisorRequest(BaseModel):
 class AdvisorResponse(BaseModel):
     risposta: str
     mutuo_ids: list[int]
+    da_cache: bool = False
+    metadati: Optional[dict] = None
 
 
 class AmortizationRow(BaseModel):
@@ -92,3 +97,61 @@ class ComparisonResult(BaseModel):
     classifica: list[dict]
     migliore_id: int
     analisi: str
+
+
+class IntervalloScenari(BaseModel):
+    """Valori da `da` ad `a` (inclusi) con passo `passo`."""
+    da: float
+    a: float
+    passo: float = Field(..., gt=0)
+
+
+class ScenariRequest(BaseModel):
+    importo: list[float] | IntervalloScenari
+    tan: list[float] | IntervalloScenari
+    durata_anni: list[int] | IntervalloScenari
+    spese: list[float] | IntervalloScenari = [0.0]
+    metriche: list[Literal["rata_mensile", "totale_interessi", "costo_totale"]] = Field(
+        default=["rata_mensile", "totale_interessi", "costo_totale"], min_length=1
+    )
+
+
+class ParametriEuribor(BaseModel):
+    """Processo dell'Euribor: valori in punti percentuali annui."""
+    iniziale: float = Field(2.0, ge=-1, le=20)
+    media: float = Field(2.5, ge=-1, le=20)
+    velocita: float = Field(0.3, ge=0, le=5)
+    volatilita: float = Field(0.8, ge=0, le=10)
+    floor_zero: bool = True
+
+
+class SimulazioneRequest(BaseModel):
+    mutuo_ids: list[int] = Field(..., min_length=1, max_length=20)
+    percorsi: int = Field(10000, ge=100, le=200000)
+    seed: Optional[int] = Field(None, ge=0)
+    euribor: ParametriEuribor = ParametriEuribor()
+    anni_fisso_misto: int = Field(5, ge=1, le=40)
+    revisione_mesi: int = Field(1, ge=1, le=12)
+
+
+class EventoPiano(BaseModel):
+    """Evento dopo la rata del mese `mese`: estinzione parziale, totale o surroga."""
+    tipo: Literal["parziale", "totale", "surroga"]
+    mese: int = Field(..., ge=1, le=480)
+    importo: Optional[float] = Field(None, gt=0)
+    strategia: Literal["riduci_durata", "riduci_rata"] = "riduci_durata"
+    tan: Optional[float] = Field(None, ge=0, le=100)
+    mutuo_id: Optional[int] = None
+    durata_mesi: Optional[int] = Field(None, ge=1, le=480)
+    spese: float = Field(0, ge=0)
+
+
+class ScenarioEstinzione(BaseModel):
+    mutuo_id: int
+    nome: Optional[str] = Field(None, max_length=200)
+    eventi: list[EventoPiano] = Field(default_factory=list, max_length=50)
+
+
+class EstinzioneRequest(BaseModel):
+    scenari: list[ScenarioEstinzione] = Field(..., min_length=1, max_length=1000)
+    includi_piano: bool = False
@@ -0,0 +1,279 @@
+"""
+Simulazione Monte Carlo dei mutui a tasso variabile e misto.
+
+L'Euribor segue un processo di Vasicek (ritorno alla media) discretizzato in
+modo esatto su base mensile; il tasso di ogni mese \u00e8 Euribor (con floor a 0
+se previsto) + spread. Per i misti il TAN resta quello dell'offerta per gli
+anni fissi iniziali. La rata si ricalcola a ogni revisione sul debito residuo
+e sulle rate rimaste, come nell'ammortamento alla francese.
+
+I percorsi sono generati a blocchi di dimensione fissa, ciascuno con un seme
+figlio di SeedSequence(seed): il risultato dipende solo da seed e numero di
+percorsi, non da quanti processi lo calcolano. Tutte le offerte di una
+simulazione sono valutate sugli stessi percorsi, cos\u00ec il confronto non
+risente del rumore di campionamento.
+"""
+import math
+import multiprocessing
+import os
+import secrets
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+
+import numpy as np
+
+from mortgage_engine import MESI_ANNO, SPESE_ACCESSORIE, calcola_totale_interessi
+
+# Percorsi per blocco: fa parte della definizione del seme, non cambiarlo
+# senza mettere in conto risultati diversi a parit\u00e0 di seed
+PERCORSI_PER_BLOCCO = 4096
+
+# Processi per i blocchi (0 = tutto nel processo corrente)
+MC_PROCESSI = int(os.environ.get("MC_PROCESSES", "0"))
+
+PERCENTILI = (5, 25, 50, 75, 95)
+
+
+@dataclass(frozen=True)
+class ModelloEuribor:
+    """Parametri del processo dell'Euribor (valori in punti percentuali annui)."""
+    iniziale: float = 2.0
+    media: float = 2.5
+    velocita: float = 0.3
+    volatilita: float = 0.8
+    floor_zero: bool = True
+
+
+@dataclass(frozen=True)
+class OffertaSimulata:
+    importo: float
+    num_rate: int
+    tan_iniziale: float
+    mesi_fissi: int
+    spread: float
+    revisione_mesi: int = 1
+    spese: float = 0.0
+
+
+def offerta_da_mutuo(
+    mutuo: dict, modello: ModelloEuribor, anni_fisso_misto: int = 5, revisione_mesi: int = 1
+) -> OffertaSimulata:
+    """
+    Traduce un mutuo salvato nei parametri della simulazione.
+
+    Senza spread dichiarato si usa TAN - Euribor iniziale (non negativo).
+    """
+    num_rate = mutuo["durata_anni"] * MESI_ANNO
+    if mutuo["tipo_tasso"] == "fisso":
+        mesi_fissi = num_rate
+    elif mutuo["tipo_tasso"] == "misto":
+        mesi_fissi = min(num_rate, anni_fisso_misto * MESI_ANNO)
+    else:
+        mesi_fissi = 0
+    spread = mutuo.get("spread")
+    if spread is None:
+        spread = max(0.0, mutuo["tan"] - modello.iniziale)
+    spese = sum(mutuo.get(nome) or 0 for nome in SPESE_ACCESSORIE)
+    return OffertaSimulata(
+        importo=mutuo["importo"],
+        num_rate=num_rate,
+        tan_iniziale=mutuo["tan"],
+        mesi_fissi=mesi_fissi,
+        spread=spread,
+        revisione_mesi=revisione_mesi,
+        spese=spese,
+    )
+
+
+def genera_euribor(
+    modello: ModelloEuribor, rng: np.random.Generator, percorsi: int, mesi: int
+) -> np.ndarray:
+    """Percorsi dell'Euribor, forma (percorsi, mesi): la colonna m vale per il mese m+1."""
+    decadimento = math.exp(-modello.velocita / MESI_ANNO)
+    if modello.velocita > 0:
+        deviazione = modello.volatilita * math.sqrt((1 - decadimento**2) / (2 * modello.velocita))
+    else:
+        deviazione = modello.volatilita * math.sqrt(1 / MESI_ANNO)
+    shock = rng.standard_normal((percorsi, mesi)) * deviazione
+
+    tassi = np.empty((percorsi, mesi))
+    corrente = np.full(percorsi, modello.iniziale)
+    for m in range(mesi):
+        tassi[:, m] = corrente
+        corrente = modello.media + (corrente - modello.media) * decadimento + shock[:, m]
+    return tassi
+
+
+def _valuta_offerta(offerta: OffertaSimulata, euribor: np.ndarray, floor_zero: bool) -> dict:
+    """
+    Ammortamento di un'offerta su tutti i percorsi insieme.
+
+    Ritorna per percorso: interessi totali, rata massima e rata del primo mese
+    di ogni anno.
+    """
+    n = offerta.num_rate
+    if offerta.mesi_fissi >= n:
+        # Fisso: tutti i percorsi sono uguali, basta calcolarne uno
+        euribor = euribor[:1]
+    indice = np.maximum(euribor[:, :n], 0) if floor_zero else euribor[:, :n]
+    tassi = (indice + offerta.spread) / 100 / MESI_ANNO
+    tassi[:, :offerta.mesi_fissi] = offerta.tan_iniziale / 100 / MESI_ANNO
+
+    percorsi = tassi.shape[0]
+    debito = np.full(percorsi, float(offerta.importo))
+    interessi = np.zeros(percorsi)
+    rata = np.zeros(percorsi)
+    rata_massima = np.zeros(percorsi)
+    rate_annue = np.empty((percorsi, math.ceil(n / MESI_ANNO)))
+    for m in range(n):
+        tasso = tassi[:, m]
+        revisione = m >= offerta.mesi_fissi and (m - offerta.mesi_fissi) % offerta.revisione_mesi == 0
+        if m == 0 or revisione:
+            restanti = n - m
+            with np.errstate(divide="ignore", invalid="ignore"):
+                rata = np.where(
+                    tasso > 0, debito * tasso / (1 - (1 + tasso) ** -restanti), debito / restanti
+                )
+            np.maximum(rata_massima, rata, out=rata_massima)
+        quota_interessi = debito * tasso
+        interessi += quota_interessi
+        debito = debito - (rata - quota_interessi)
+        if m % MESI_ANNO == 0:
+            rate_annue[:, m // MESI_ANNO] = rata
+
+    return {"interessi": interessi, "rata_massima": rata_massima, "rate_annue": rate_annue}
+
+
+def _simula_blocco(
+    seme: np.random.SeedSequence,
+    percorsi: int,
+    modello: ModelloEuribor,
+    offerte: list[OffertaSimulata],
+) -> tuple[np.ndarray, list[dict]]:
+    mesi = max(o.num_rate for o in offerte)
+    euribor = genera_euribor(modello, np.random.default_rng(seme), percorsi, mesi)
+    valutazioni = []
+    for offerta in offerte:
+        valutazione = _valuta_offerta(offerta, euribor, modello.floor_zero)
+        valutazioni.append(
+            {k: np.broadcast_to(v, (percorsi, *v.shape[1:])) for k, v in valutazione.items()}
+        )
+    return euribor[:, ::MESI_ANNO], valutazioni
+
+
+def _distribuzione(valori: np.ndarray) -> dict:
+    quantili = np.percentile(valori, PERCENTILI)
+    return {
+        "media": round(float(valori.mean()), 2),
+        "dev_std": round(float(valori.std()), 2),
+        **{f"p{p}": round(float(q), 2) for p, q in zip(PERCENTILI, quantili)},
+    }
+
+
+def _ventaglio(matrice: np.ndarray) -> list[dict]:
+    """Percentili colonna per colonna (una colonna per anno); riordina `matrice` sul posto."""
+    quantili = np.percentile(matrice, PERCENTILI, axis=0, overwrite_input=True)
+    return [
+        {"anno": anno, **{f"p{p}": round(float(q), 2) for p, q in zip(PERCENTILI, quantili[:, i])}}
+        for i, anno in enumerate(range(1, matrice.shape[1] + 1))
+    ]
+
+
+_pool_processi: ProcessPoolExecutor | None = None
+
+
+def pool_processi() -> ProcessPoolExecutor | None:
+    """Pool di processi condiviso, creato al primo uso; None se MC_PROCESSES=0."""
+    global _pool_processi
+    if MC_PROCESSI > 0 and _pool_processi is None:
+        # spawn: il fork di un processo con thread (asyncio, aiosqlite) non \u00e8 sicuro
+        _pool_processi = ProcessPoolExecutor(
+            MC_PROCESSI, mp_context=multiprocessing.get_context("spawn")
+        )
+    return _pool_processi
+
+
+def chiudi_pool_processi() -> None:
+    global _pool_processi
+    if _pool_processi is not None:
+        _pool_processi.shutdown(cancel_futures=True)
+        _pool_processi = None
+
+
+def nuovo_seed() -> int:
+    """Seme casuale che resta un intero esatto anche in JavaScript."""
+    return secrets.randbits(48)
+
+
+def simula(
+    offerte: list[OffertaSimulata],
+    modello: ModelloEuribor,
+    percorsi: int,
+    seed: int,
+    executor: ProcessPoolExecutor | None = None,
+) -> dict:
+    """
+    Simula `percorsi` scenari dell'Euribor e valuta ogni offerta su tutti.
+
+    Restituisce, per offerta, le distribuzioni di interessi totali, costo
+    totale e rata massima, il ventaglio annuale della rata e la probabilit\u00e0 di
+    pagare pi\u00f9 interessi che col TAN iniziale bloccato; in comune il ventaglio
+    dell'Euribor.
+    """
+    blocchi = [PERCORSI_PER_BLOCCO] * (percorsi // PERCORSI_PER_BLOCCO)
+    if percorsi % PERCORSI_PER_BLOCCO:
+        blocchi.append(percorsi % PERCORSI_PER_BLOCCO)
+    semi = np.random.SeedSequence(seed).spawn(len(blocchi))
+    argomenti = (semi, blocchi, [modello] * len(blocchi), [offerte] * len(blocchi))
+    esiti = executor.map(_simula_blocco, *argomenti) if executor else map(_simula_blocco, *argomenti)
+
+    # Ogni blocco si copia nelle matrici finali appena arriva e poi si scarta:
+    # mai i blocchi e il loro concatenato in memoria insieme
+    mesi = max(o.num_rate for o in offerte)
+    euribor = np.empty((percorsi, math.ceil(mesi / MESI_ANNO)))
+    raccolte = [
+        {
+            "interessi": np.empty(percorsi),
+            "rata_massima": np.empty(percorsi),
+            "rate_annue": np.empty((percorsi, math.ceil(o.num_rate / MESI_ANNO))),
+        }
+        for o in offerte
+    ]
+    inizio = 0
+    for euribor_blocco, valutazioni in esiti:
+        fine = inizio + len(euribor_blocco)
+        euribor[inizio:fine] = euribor_blocco
+        for raccolta, valutazione in zip(raccolte, valutazioni):
+            for chiave, matrice in raccolta.items():
+                matrice[inizio:fine] = valutazione[chiave]
+        inizio = fine
+
+    risultati = []
+    for offerta, raccolta in zip(offerte, raccolte):
+        interessi = raccolta["interessi"]
+        rata_massima = raccolta["rata_massima"]
+        rate_annue = raccolta["rate_annue"]
+        # Riferimento: lo stesso mutuo col TAN iniziale bloccato per tutta la durata
+        interessi_tan_iniziale = calcola_totale_interessi(
+            offerta.importo, offerta.tan_iniziale, offerta.num_rate // MESI_ANNO
+        )
+        risultati.append({
+            "spread": round(offerta.spread, 4),
+            "mesi_fissi": offerta.mesi_fissi,
+            "rata_iniziale": round(float(rate_annue[0, 0]), 2),
+            "totale_interessi": _distribuzione(interessi),
+            "costo_totale": _distribuzione(interessi + offerta.spese),
+            "rata_massima": _distribuzione(rata_massima),
+            "rata_per_anno": _ventaglio(rate_annue),
+            "interessi_tan_iniziale": interessi_tan_iniziale,
+            "probabilita_interessi_oltre_tan_iniziale": round(
+                float((interessi > interessi_tan_iniziale + 0.5).mean()), 4
+            ),
+        })
+    return {
+        "percorsi": percorsi,
+        "blocchi": len(blocchi),
+        "seed": seed,
+        "euribor_per_anno": _ventaglio(euribor),
+        "offerte": risultati,
+    }
@@ -1,50 +1,454 @@
+import math
+import os
+from dataclasses import dataclass
+from functools import lru_cache
+
+import numpy as np
+
 MESI_ANNO = 12
 
+# Capienza delle cache LRU di rata e totali (voci per funzione)
+CACHE_MAXSIZE = int(os.environ.get("ENGINE_CACHE_SIZE", "1024"))
+# I piani interi pesano fino a qualche decina di KB l'uno: cache a parte, pi\u00f9 piccola
+CACHE_PIANI_MAXSIZE = int(os.environ.get("ENGINE_PLAN_CACHE_SIZE", "32"))
 
-def calcola_rata_mensile(importo: float, tan: float, durata_anni: int) -> float:
-    """Calcola la rata mensile con formula francese (ammortamento alla francese)."""
-    if tan == 0:
-        return importo / (durata_anni * MESI_ANNO)
+# Scarto (punti percentuali) oltre il quale il TAEG dichiarato non \u00e8 credibile
+TAEG_TOLLERANZA = float(os.environ.get("TAEG_TOLERANCE", "0.5"))
+
+# Fattore di Veltkamp per spezzare un double in due met\u00e0 da 26 bit
+_SPLIT = 134217729.0
+
+
+def _arrotonda(valori: np.ndarray, cifre: int = 2) -> np.ndarray:
+    """
+    Arrotonda un array come farebbe round(x, cifre) sui singoli float.
+
+    np.round moltiplica per 10**cifre e arrotonda il prodotto gi\u00e0 approssimato,
+    quindi sui casi "a met\u00e0" pu\u00f2 differire dal round() di Python, che lavora sul
+    valore binario esatto. Qui l'errore del prodotto viene ricostruito (Dekker)
+    e usato solo per decidere i pareggi apparenti.
+    """
+    scala = float(10**cifre)
+    scalati = valori * scala
+    interi = np.rint(scalati)
+    pareggi = np.abs(scalati - interi) == 0.5
+    if pareggi.any():
+        base = np.floor(scalati)
+        t = _SPLIT * valori
+        alto = t - (t - valori)
+        basso = valori - alto
+        errore = (alto * scala - scalati) + basso * scala
+        interi = np.where(pareggi & (errore > 0), base + 1, interi)
+        interi = np.where(pareggi & (errore < 0), base, interi)
+    return interi / scala
+
+
+@dataclass(frozen=True)
+class PianiAmmortamento:
+    """
+    Piani di ammortamento di N mutui in forma colonnare.
+
+    Le matrici hanno forma (N, mesi_max); i mesi oltre la durata di ciascun
+    mutuo valgono 0.
+    """
+
+    rata: np.ndarray
+    num_rate: np.ndarray
+    quota_capitale: np.ndarray
+    quota_interessi: np.ndarray
+    debito_residuo: np.ndarray
+
+    def __len__(self) -> int:
+        return len(self.rata)
+
+    def piano(self, indice: int) -> list[dict]:
+        """Restituisce il piano dell'i-esimo mutuo nel formato di calcola_piano_ammortamento."""
+        n = int(self.num_rate[indice])
+        rata = float(self.rata[indice])
+        return [
+            {
+                "mese": mese,
+                "rata": rata,
+                "quota_capitale": capitale,
+                "quota_interessi": interessi,
+                "debito_residuo": residuo,
+            }
+            for mese, capitale, interessi, residuo in zip(
+                range(1, n + 1),
+                self.quota_capitale[indice, :n].tolist(),
+                self.quota_interessi[indice, :n].tolist(),
+                self.debito_residuo[indice, :n].tolist(),
+            )
+        ]
+
+
+def _parametri_batch(importi, tan, durate_anni) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    importi = np.atleast_1d(np.asarray(importi, dtype=np.float64))
+    tan = np.atleast_1d(np.asarray(tan, dtype=np.float64))
+    durate_anni = np.atleast_1d(np.asarray(durate_anni, dtype=np.int64))
+    return np.broadcast_arrays(importi, tan, durate_anni)
+
+
+def _fattori_capitalizzazione(tasso_mensile: np.ndarray, num_rate: np.ndarray) -> np.ndarray:
+    """(1 + tasso)^rate elemento per elemento, sulla forma comune dei due array."""
+    tasso_mensile, num_rate = np.broadcast_arrays(tasso_mensile, num_rate)
+    # La potenza resta scalare: np.power non garantisce lo stesso ultimo bit
+    # della pow() di libm e un ulp basta a spostare un arrotondamento al centesimo.
+    return np.array(
+        [pow(1 + t, n) for t, n in zip(tasso_mensile.ravel().tolist(), num_rate.ravel().tolist())],
+        dtype=np.float64,
+    ).reshape(tasso_mensile.shape)
+
+
+def calcola_rate_mensili(importi, tan, durate_anni) -> np.ndarray:
+    """
+    Calcola in blocco le rate mensili (formula francese) per array di mutui.
 
+    Gli argomenti si combinano per broadcasting; le potenze si calcolano sulla
+    sola forma comune di TAN e durata, quindi una griglia importi \u00d7 TAN \u00d7
+    durate costa T\u00d7D potenze, non I\u00d7T\u00d7D.
+    """
+    tan = np.atleast_1d(np.asarray(tan, dtype=np.float64))
+    durate_anni = np.atleast_1d(np.asarray(durate_anni, dtype=np.int64))
     tasso_mensile = (tan / 100) / MESI_ANNO
-    num_rate = durata_anni * MESI_ANNO
-    rata = (importo * tasso_mensile * pow(1 + tasso_mensile, num_rate)) / (
-        pow(1 + tasso_mensile, num_rate) - 1
+    num_rate = durate_anni * MESI_ANNO
+    fattore = _fattori_capitalizzazione(tasso_mensile, num_rate)
+    importi, tan, tasso_mensile, num_rate, fattore = np.broadcast_arrays(
+        np.atleast_1d(np.asarray(importi, dtype=np.float64)), tan, tasso_mensile, num_rate, fattore
     )
-    return round(rata, 2)
 
+    senza_interessi = tan == 0
+    with np.errstate(divide="ignore", invalid="ignore"):
+        rata = (importi * tasso_mensile * fattore) / (fattore - 1)
+    return np.where(senza_interessi, importi / num_rate, _arrotonda(rata))
 
-def calcola_piano_ammortamento(
-    importo: float, tan: float, durata_anni: int
-) -> list[dict]:
-    """Genera il piano di ammortamento completo."""
+
+def calcola_griglia_scenari(importi, tan, durate_anni, spese=(0.0,)) -> dict[str, np.ndarray]:
+    """
+    Valuta tutte le combinazioni importo \u00d7 TAN \u00d7 durata \u00d7 spese.
+
+    Restituisce rata_mensile e totale_interessi con forma (I, T, D) e
+    costo_totale con forma (I, T, D, S), arrotondati come le funzioni scalari.
+    """
+    importi = np.asarray(importi, dtype=np.float64)[:, None, None]
+    tan = np.asarray(tan, dtype=np.float64)[None, :, None]
+    durate_anni = np.asarray(durate_anni, dtype=np.int64)[None, None, :]
+    spese = np.asarray(spese, dtype=np.float64)
+
+    rata = calcola_rate_mensili(importi, tan, durate_anni)
+    totale_interessi = _arrotonda(rata * (durate_anni * MESI_ANNO) - importi)
+    costo_totale = _arrotonda(totale_interessi[..., None] + spese)
+    return {
+        "rata_mensile": rata,
+        "totale_interessi": totale_interessi,
+        "costo_totale": costo_totale,
+    }
+
+
+def calcola_piani_ammortamento(importi, tan, durate_anni) -> PianiAmmortamento:
+    """
+    Genera in un solo passaggio vettoriale i piani di ammortamento di N mutui.
+
+    Il ciclo scorre i mesi (al massimo 480), non i mutui: ogni passo aggiorna
+    tutti i debiti residui insieme con gli stessi arrotondamenti al centesimo
+    del calcolo riga per riga.
+    """
+    importi, tan, durate_anni = _parametri_batch(importi, tan, durate_anni)
     tasso_mensile = (tan / 100) / MESI_ANNO
-    num_rate = durata_anni * MESI_ANNO
-    rata = calcola_rata_mensile(importo, tan, durata_anni)
-    debito_residuo = importo
-    piano = []
+    num_rate = durate_anni * MESI_ANNO
+    rata = calcola_rate_mensili(importi, tan, durate_anni)
+
+    n = len(importi)
+    mesi_max = int(num_rate.max()) if n else 0
+    quota_capitale = np.zeros((n, mesi_max))
+    quota_interessi = np.zeros((n, mesi_max))
+    debito = np.zeros((n, mesi_max))
+
+    debito_residuo = importi.copy()
+    for mese in range(mesi_max):
+        interessi = _arrotonda(debito_residuo * tasso_mensile)
+        capitale = _arrotonda(rata - interessi)
+        debito_residuo = _arrotonda(debito_residuo - capitale)
+        debito_residuo[debito_residuo < 0] = 0
+
+        quota_interessi[:, mese] = interessi
+        quota_capitale[:, mese] = capitale
+        debito[:, mese] = debito_residuo
+
+    oltre_durata = np.arange(1, mesi_max + 1) > num_rate[:, None]
+    quota_capitale[oltre_durata] = 0
+    quota_interessi[oltre_durata] = 0
+    debito[oltre_durata] = 0
+
+    return PianiAmmortamento(
+        rata=rata,
+        num_rate=num_rate,
+        quota_capitale=quota_capitale,
+        quota_interessi=quota_interessi,
+        debito_residuo=debito,
+    )
+
+
+# TAN in decimillesimi di punto: la quota interessi in centesimi \u00e8 il rapporto
+# intero debito * tan / _DIVISORE_INTERESSI, senza passare dai float
+_SCALA_TAN = 10_000
+_DIVISORE_INTERESSI = 100 * _SCALA_TAN * MESI_ANNO
+
 
-    for mese in range(1, num_rate + 1):
-        quota_interessi = round(debito_residuo * tasso_mensile, 2)
-        quota_capitale = round(rata - quota_interessi, 2)
-        debito_residuo = round(debito_residuo - quota_capitale, 2)
+def in_centesimi(valori) -> np.ndarray:
+    """Importi in euro come centesimi int64, arrotondati come round(x, 2)."""
+    return np.rint(_arrotonda(np.asarray(valori, dtype=np.float64)) * 100).astype(np.int64)
 
-        if debito_residuo < 0:
-            debito_residuo = 0
 
-        piano.append(
+@dataclass(frozen=True)
+class PianiCentesimi:
+    """
+    Piani di ammortamento esatti di N mutui, in centesimi int64.
+
+    Le matrici hanno forma (N, mesi_max) come in PianiAmmortamento. Ogni quota
+    \u00e8 un numero intero di centesimi, quindi le quote capitale sommano
+    esattamente all'importo e l'ultima rata (rata_finale) chiude il debito.
+    """
+
+    rata: np.ndarray
+    rata_finale: np.ndarray
+    num_rate: np.ndarray
+    quota_capitale: np.ndarray
+    quota_interessi: np.ndarray
+    debito_residuo: np.ndarray
+
+    def __len__(self) -> int:
+        return len(self.rata)
+
+    def piano(self, indice: int) -> list[dict]:
+        """Piano dell'i-esimo mutuo in euro, nel formato di calcola_piano_ammortamento."""
+        n = int(self.num_rate[indice])
+        rate = self.quota_capitale[indice, :n] + self.quota_interessi[indice, :n]
+        return [
             {
                 "mese": mese,
-                "rata": rata,
-                "quota_capitale": quota_capitale,
-                "quota_interessi": quota_interessi,
-                "debito_residuo": debito_residuo,
+                "rata": rata / 100,
+                "quota_capitale": capitale / 100,
+                "quota_interessi": interessi / 100,
+                "debito_residuo": residuo / 100,
             }
+            for mese, rata, capitale, interessi, residuo in zip(
+                range(1, n + 1),
+                rate.tolist(),
+                self.quota_capitale[indice, :n].tolist(),
+                self.quota_interessi[indice, :n].tolist(),
+                self.debito_residuo[indice, :n].tolist(),
+            )
+        ]
+
+
+def calcola_piani_centesimi(importi, tan, durate_anni) -> PianiCentesimi:
+    """
+    Piani di ammortamento di N mutui in aritmetica intera sui centesimi.
+
+    La rata \u00e8 quella del calcolo in float (arrotondata al centesimo); la
+    quota interessi di ogni mese \u00e8 arrotondata al centesimo per eccesso da
+    mezzo centesimo in su, con divisione intera esatta. Nell'ultimo mese la
+    quota capitale \u00e8 il debito rimasto, che quindi si chiude a zero.
+
+    Il TAN deve avere al pi\u00f9 4 decimali (ValueError altrimenti): il calcolo
+    intero lo rappresenta in decimillesimi di punto e non lo arrotonda.
+    """
+    importi, tan, durate_anni = _parametri_batch(importi, tan, durate_anni)
+    num_rate = durate_anni * MESI_ANNO
+    tan_scalato = np.rint(tan * _SCALA_TAN)
+    # Tolleranza sull'errore di rappresentazione dei float (3.45 * 10000 = 34500.000000000004)
+    non_esatti = np.abs(tan * _SCALA_TAN - tan_scalato) > 1e-6
+    if non_esatti.any():
+        raise ValueError(
+            f"TAN {float(tan[non_esatti][0])}: il piano esatto accetta al massimo 4 decimali"
         )
+    tan_scalato = tan_scalato.astype(np.int64)
+    rata = in_centesimi(calcola_rate_mensili(importi, tan, durate_anni))
+
+    n = len(importi)
+    mesi_max = int(num_rate.max()) if n else 0
+    quota_capitale = np.zeros((n, mesi_max), dtype=np.int64)
+    quota_interessi = np.zeros((n, mesi_max), dtype=np.int64)
+    debito = np.zeros((n, mesi_max), dtype=np.int64)
+    rata_finale = rata.copy()
+
+    debito_residuo = in_centesimi(importi)
+    for mese in range(mesi_max):
+        interessi = (2 * debito_residuo * tan_scalato + _DIVISORE_INTERESSI) // (2 * _DIVISORE_INTERESSI)
+        chiude = (mese == num_rate - 1) | (rata - interessi >= debito_residuo)
+        capitale = np.where(chiude, debito_residuo, rata - interessi)
+        # Mutui gi\u00e0 chiusi (o oltre la durata): nessuna quota
+        aperti = debito_residuo > 0
+        capitale = np.where(aperti, capitale, 0)
+        interessi = np.where(aperti, interessi, 0)
+        rata_finale = np.where(aperti & chiude, capitale + interessi, rata_finale)
+        debito_residuo = debito_residuo - capitale
+
+        quota_interessi[:, mese] = interessi
+        quota_capitale[:, mese] = capitale
+        debito[:, mese] = debito_residuo
+
+    return PianiCentesimi(
+        rata=rata,
+        rata_finale=rata_finale,
+        num_rate=num_rate,
+        quota_capitale=quota_capitale,
+        quota_interessi=quota_interessi,
+        debito_residuo=debito,
+    )
+
+
+@lru_cache(maxsize=CACHE_MAXSIZE)
+def calcola_rata_mensile(importo: float, tan: float, durata_anni: int) -> float:
+    """Calcola la rata mensile con formula francese (ammortamento alla francese)."""
+    return float(calcola_rate_mensili(importo, tan, durata_anni)[0])
+
+
+# In cache restano le matrici numpy (circa 11 KB per 40 anni), non le righe
+# come dizionari, che per lo stesso piano occupano oltre dieci volte tanto
+@lru_cache(maxsize=CACHE_PIANI_MAXSIZE)
+def _piano_ammortamento(importo: float, tan: float, durata_anni: int) -> PianiAmmortamento:
+    return calcola_piani_ammortamento(importo, tan, durata_anni)
+
+
+@lru_cache(maxsize=CACHE_PIANI_MAXSIZE)
+def _piano_centesimi(importo: float, tan: float, durata_anni: int) -> PianiCentesimi:
+    return calcola_piani_centesimi(importo, tan, durata_anni)
+
+
+def calcola_piano_ammortamento(
+    importo: float, tan: float, durata_anni: int, esatto: bool = False
+) -> list[dict]:
+    """
+    Genera il piano di ammortamento completo.
+
+    Con `esatto` il piano \u00e8 calcolato in centesimi interi e l'ultima rata
+    chiude il debito (vedi calcola_piani_centesimi).
+    """
+    # Le righe sono nuove a ogni chiamata: le matrici in cache restano condivise
+    return (_piano_centesimi if esatto else _piano_ammortamento)(importo, tan, durata_anni).piano(0)
 
-    return piano
 
+def _rata_pagata(importo: float, tan: float, durata_anni: int) -> float:
+    """
+    Rata effettivamente versata ogni mese nel piano iterativo: quota capitale
+    pi\u00f9 quota interessi, entrambe al centesimo. Coincide con la rata tranne a
+    TAN 0, dove la rata (importo / mesi) non \u00e8 arrotondata.
+    """
+    return round(calcola_rata_mensile(importo, tan, durata_anni), 2)
+
+
+def _debito_residuo_chiuso(importo, tasso_mensile, rata, mesi, azzera: bool = True) -> np.ndarray:
+    """
+    Debito residuo dopo `mesi` rate in forma chiusa, con la rata gi\u00e0 arrotondata.
+
+    A TAN 0 il piano toglie ogni mese la stessa quota capitale al centesimo,
+    quindi il debito \u00e8 esatto in centesimi interi. Come nel piano, un debito
+    che scenderebbe sotto zero vale 0; con `azzera` False resta negativo (serve
+    per gli interessi, che il piano non corregge nel mese in cui il debito si chiude).
+    """
+    mesi = np.asarray(mesi, dtype=np.int64)
+    if tasso_mensile == 0:
+        debito = (in_centesimi(importo) - mesi * in_centesimi(rata)) / 100
+    else:
+        fattore = np.power(1 + tasso_mensile, mesi.astype(np.float64))
+        debito = _arrotonda(importo * fattore - rata * (fattore - 1) / tasso_mensile)
+    if azzera:
+        debito[debito < 0] = 0
+    return debito
+
+
+def _mesi_validi(durata_anni: int, mese: int) -> int:
+    return min(max(int(mese), 0), durata_anni * MESI_ANNO)
+
+
+def tolleranza_arrotondamento(tan: float, mese: int) -> float:
+    """
+    Scarto massimo tra le formule chiuse e il piano iterativo al mese indicato.
+
+    Il piano arrotonda la quota interessi al centesimo ogni mese; ogni
+    arrotondamento (al pi\u00f9 mezzo centesimo) si capitalizza sui mesi successivi.
+    A TAN 0 non ci sono interessi da arrotondare e le formule chiuse sono esatte.
+    """
+    tasso_mensile = (tan / 100) / MESI_ANNO
+    if tasso_mensile == 0 or mese <= 0:
+        return 0.0
+    return round(0.005 * (pow(1 + tasso_mensile, mese) - 1) / tasso_mensile, 2)
 
+
+def debito_residuo_al_mese(importo: float, tan: float, durata_anni: int, mese: int) -> float:
+    """
+    Debito residuo dopo il pagamento della rata `mese`, senza generare il piano.
+
+    Usa la rata arrotondata come il piano iterativo, quindi ne riproduce la
+    deriva dovuta all'arrotondamento della rata; lo scarto residuo \u00e8 entro
+    tolleranza_arrotondamento().
+    """
+    mese = _mesi_validi(durata_anni, mese)
+    rata = _rata_pagata(importo, tan, durata_anni)
+    tasso_mensile = (tan / 100) / MESI_ANNO
+    return float(_debito_residuo_chiuso(importo, tasso_mensile, rata, [mese])[0])
+
+
+def capitale_rimborsato_al_mese(importo: float, tan: float, durata_anni: int, mese: int) -> float:
+    """
+    Capitale rimborsato fino al mese indicato (incluso): importo meno debito
+    residuo, quindi mai oltre l'importo anche nel mese in cui il debito si chiude.
+    """
+    return round(importo - debito_residuo_al_mese(importo, tan, durata_anni, mese), 2)
+
+
+def interessi_cumulati_al_mese(importo: float, tan: float, durata_anni: int, mese: int) -> float:
+    """
+    Interessi cumulati fino al mese indicato (incluso).
+
+    Ogni rata \u00e8 quota capitale + quota interessi, quindi gli interessi pagati sono
+    le rate versate meno il capitale rimborsato. Il capitale \u00e8 quello prima
+    dell'azzeramento del debito nell'ultima rata: il piano non riduce la quota
+    capitale di quel mese, e nemmeno gli interessi.
+    """
+    mese = _mesi_validi(durata_anni, mese)
+    rata = _rata_pagata(importo, tan, durata_anni)
+    tasso_mensile = (tan / 100) / MESI_ANNO
+    debito = float(_debito_residuo_chiuso(importo, tasso_mensile, rata, [mese], azzera=False)[0])
+    return round(rata * mese - (importo - debito), 2)
+
+
+def riepilogo_annuale(importo: float, tan: float, durata_anni: int) -> list[dict]:
+    """
+    Ripartizione anno per anno di capitale e interessi, in O(anni).
+
+    Calcola il debito residuo solo a fine anno invece di generare i mesi.
+    """
+    rata = _rata_pagata(importo, tan, durata_anni)
+    tasso_mensile = (tan / 100) / MESI_ANNO
+    fine_anno = np.arange(0, durata_anni + 1) * MESI_ANNO
+    debito = _debito_residuo_chiuso(importo, tasso_mensile, rata, fine_anno, azzera=False)
+    debito[0] = importo
+
+    # Interessi dal debito prima dell'azzeramento, come in interessi_cumulati_al_mese
+    interessi = _arrotonda(rata * MESI_ANNO - (debito[:-1] - debito[1:]))
+    debito[debito < 0] = 0
+    capitale = _arrotonda(debito[:-1] - debito[1:])
+    return [
+        {
+            "anno": anno,
+            "rate_pagate": round(rata * MESI_ANNO, 2),
+            "quota_capitale": quota_capitale,
+            "quota_interessi": quota_interessi,
+            "debito_residuo": residuo,
+        }
+        for anno, quota_capitale, quota_interessi, residuo in zip(
+            range(1, durata_anni + 1),
+            capitale.tolist(),
+            interessi.tolist(),
+            debito[1:].tolist(),
+        )
+    ]
+
+
+@lru_cache(maxsize=CACHE_MAXSIZE)
 def calcola_totale_interessi(importo: float, tan: float, durata_anni: int) -> float:
     """Calcola il totale interessi pagati sull'intera durata del mutuo."""
     rata = calcola_rata_mensile(importo, tan, durata_anni)
@@ -52,6 +456,7 @@ def calcola_totale_interessi(importo: float, tan: float, durata_anni: int) -> fl
     return round(rata * num_rate - importo, 2)
 
 
+@lru_cache(maxsize=CACHE_MAXSIZE)
 def calcola_costo_totale(
     importo: float,
     tan: float,
@@ -74,6 +479,37 @@ def calcola_costo_totale(
     return round(totale_interessi + spese_totali, 2)
 
 
+_FUNZIONI_IN_CACHE = {
+    "rata_mensile": calcola_rata_mensile,
+    "piano_ammortamento": _piano_ammortamento,
+    "piano_centesimi": _piano_centesimi,
+    "totale_interessi": calcola_totale_interessi,
+    "costo_totale": calcola_costo_totale,
+}
+
+
+def statistiche_cache() -> dict:
+    """Hit, miss e occupazione delle cache LRU del motore."""
+    statistiche = {}
+    for nome, funzione in _FUNZIONI_IN_CACHE.items():
+        info = funzione.cache_info()
+        richieste = info.hits + info.misses
+        statistiche[nome] = {
+            "hits": info.hits,
+            "misses": info.misses,
+            "hit_ratio": round(info.hits / richieste, 4) if richieste else 0.0,
+            "dimensione": info.currsize,
+            "capacita": info.maxsize,
+        }
+    return statistiche
+
+
+def svuota_cache() -> None:
+    """Invalida tutte le cache del motore (es. dopo un cambio delle formule)."""
+    for funzione in _FUNZIONI_IN_CACHE.values():
+        funzione.cache_clear()
+
+
 def calcola_ltv(importo: float, valore_immobile: float) -> float:
     """Calcola il Loan-to-Value ratio in percentuale."""
     if valore_immobile <= 0:
@@ -81,6 +517,97 @@ def calcola_ltv(importo: float, valore_immobile: float) -> float:
     return round((importo / valore_immobile) * 100, 2)
 
 
+def _valore_attuale_rate(tasso: np.ndarray, num_rate: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    """Valore attuale di una rata unitaria per `num_rate` mesi al tasso mensile, e sua derivata."""
+    piccolo = np.abs(tasso) < 1e-9
+    t = np.where(piccolo, 1.0, tasso)
+    sconto = (1 + t) ** -num_rate
+    # Vicino a 0 la formula chiusa perde cifre: si usa lo sviluppo al primo ordine
+    valore = np.where(piccolo, num_rate - num_rate * (num_rate + 1) / 2 * tasso, (1 - sconto) / t)
+    derivata = np.where(
+        piccolo, -num_rate * (num_rate + 1) / 2, (num_rate * sconto / (1 + t) - valore) / t
+    )
+    return valore, derivata
+
+
+def calcola_taeg(importi, rate, num_rate, spese, iterazioni: int = 60) -> np.ndarray:
+    """
+    TAEG (% annuo, 2 decimali) di N offerte dai flussi di cassa.
+
+    \u00c8 il tasso annuo effettivo (1 + r)^12 - 1, con r il tasso mensile per cui
+    il valore attuale delle rate eguaglia il netto erogato (importo - spese).
+    La radice si cerca per tutte le offerte insieme con Newton, protetto da un
+    intervallo che la contiene: i passi che ne escono diventano bisezioni.
+    NaN dove i dati non ammettono un tasso (netto o rata non positivi).
+    """
+    importi, rate, num_rate, spese = np.broadcast_arrays(
+        *(np.atleast_1d(np.asarray(v, dtype=np.float64)) for v in (importi, rate, num_rate, spese))
+    )
+    netto = importi - spese
+    validi = (netto > 0) & (rate > 0) & (num_rate > 0)
+    netto = np.where(validi, netto, 1.0)
+    rate = np.where(validi, rate, 1.0)
+    num_rate = np.where(validi, num_rate, 1.0)
+
+    # rate * VA(r) - netto decresce in r: radice tra basso (f > 0) e alto (f < 0)
+    basso = np.full(netto.shape, -0.5)
+    alto = np.full(netto.shape, 1.0)
+    with np.errstate(over="ignore", invalid="ignore", divide="ignore"):
+        va_basso, _ = _valore_attuale_rate(basso, num_rate)
+        va_alto, _ = _valore_attuale_rate(alto, num_rate)
+        validi &= (rate * va_basso > netto) & (rate * va_alto < netto)
+
+        tasso = np.clip(rate / netto - 1 / num_rate, basso, alto)
+        passo_precedente = alto - basso
+        attivi = validi.copy()
+        for _ in range(iterazioni):
+            valore, derivata = _valore_attuale_rate(tasso, num_rate)
+            f = rate * valore - netto
+            basso = np.where(f > 0, tasso, basso)
+            alto = np.where(f > 0, alto, tasso)
+            passo = f / (rate * derivata)
+            nuovo = tasso - passo
+            # Bisezione se Newton esce dall'intervallo o non dimezza il passo
+            lento = ~((nuovo >= basso) & (nuovo <= alto)) | (np.abs(passo) * 2 > passo_precedente)
+            nuovo = np.where(lento, (basso + alto) / 2, nuovo)
+            passo_precedente = np.abs(nuovo - tasso)
+            attivi &= passo_precedente > 1e-13
+            tasso = nuovo
+            if not attivi.any():
+                break
+
+    taeg = _arrotonda(((1 + tasso) ** MESI_ANNO - 1) * 100)
+    return np.where(validi, taeg, np.nan)
+
+
+def calcola_taeg_mutuo(importo: float, rata: float, durata_anni: int, spese: float) -> float | None:
+    """TAEG di un singolo mutuo (None se non calcolabile)."""
+    taeg = float(calcola_taeg(importo, rata, durata_anni * MESI_ANNO, spese)[0])
+    return None if math.isnan(taeg) else taeg
+
+
+def taeg_discordante(taeg, taeg_calcolato, tolleranza: float = TAEG_TOLLERANZA) -> bool:
+    """Vero se il TAEG dichiarato si discosta da quello calcolato oltre la tolleranza."""
+    if taeg_calcolato is None or not taeg:
+        return False
+    return abs(taeg - taeg_calcolato) > tolleranza
+
+
+def _taeg_di_riferimento(taeg, taeg_calcolato):
+    """
+    TAEG per il punteggio: il dichiarato, alzato al calcolato se \u00e8 pi\u00f9 basso.
+
+    Il calcolato serve solo a non premiare un dichiarato troppo basso. Senza
+    dichiarato non lo sostituisce: include istruttoria, perizia e le altre
+    spese, che il punteggio penalizza gi\u00e0 con il rapporto spese/importo, e
+    l'offerta le pagherebbe due volte. La discordanza si segnala a parte
+    (taeg_discordante, /api/mutui/taeg/discordanze).
+    """
+    if not taeg or taeg_calcolato is None:
+        return taeg
+    return max(taeg, taeg_calcolato)
+
+
 def calcola_punteggio(mutuo: dict) -> float:
     """
     Calcola un punteggio di convenienza per il mutuo (0-100, pi\u00f9 alto = pi\u00f9 conveniente).
@@ -105,8 +632,9 @@ def calcola_punteggio(mutuo: dict) -> float:
     tan = mutuo.get("tan", 0)
     punteggio -= tan * 5
 
-    # Penalit\u00e0 TAEG (solo la parte che eccede il TAN)
-    taeg = mutuo.get("taeg") or tan
+    # Penalit\u00e0 TAEG (solo la parte che eccede il TAN), sul dichiarato non
+    # inferiore a quello calcolato dai flussi
+    taeg = _taeg_di_riferimento(mutuo.get("taeg"), mutuo.get("taeg_calcolato")) or tan
     if taeg > tan:
         punteggio -= (taeg - tan) * 4
 
@@ -129,42 +657,143 @@ def calcola_punteggio(mutuo: dict) -> float:
     return round(max(0, min(100, punteggio)), 1)
 
 
-def confronta_mutui(mutui: list[dict]) -> dict:
+SPESE_ACCESSORIE = (
+    "spese_istruttoria",
+    "spese_perizia",
+    "costo_assicurazione",
+    "spese_notarili",
+    "altre_spese",
+)
+
+
+def _colonna(colonne: dict, nome: str, default: float = np.nan) -> np.ndarray:
+    valori = colonne.get(nome)
+    if valori is None:
+        return np.full(len(colonne["importo"]), default, dtype=np.float64)
+    return np.asarray(valori, dtype=np.float64)
+
+
+def calcola_punteggi(colonne: dict) -> np.ndarray:
     """
-    Confronta una lista di mutui e genera classifica e analisi.
+    Versione colonnare di calcola_punteggio: stessi criteri, stesse operazioni
+    nello stesso ordine, quindi lo stesso risultato arrotondato.
 
-    Returns:
-        dict con classifica, migliore_id e analisi testuale
+    `colonne` mappa i nomi dei campi a sequenze di pari lunghezza; i valori
+    mancanti (None/NaN) hanno lo stesso default del calcolo su dict.
     """
-    if not mutui:
-        return {"classifica": [], "migliore_id": 0, "analisi": "Nessun mutuo da confrontare."}
+    importo = _colonna(colonne, "importo")
+    tan = np.nan_to_num(_colonna(colonne, "tan"))
+    totale_interessi = np.nan_to_num(_colonna(colonne, "totale_interessi"))
+    taeg = _colonna(colonne, "taeg")
+    ltv = _colonna(colonne, "ltv", 80)
+    spese = np.nan_to_num(_colonna(colonne, SPESE_ACCESSORIE[0], 0))
+    for nome in SPESE_ACCESSORIE[1:]:
+        spese = spese + np.nan_to_num(_colonna(colonne, nome, 0))
+
+    positivo = importo > 0
+    with np.errstate(divide="ignore", invalid="ignore"):
+        rapporto_interessi = np.where(positivo, (totale_interessi / importo) * 100, 0)
+        rapporto_spese = np.where(positivo, (spese / importo) * 100, 0)
+
+    punteggio = 100.0 - rapporto_interessi * 0.5
+    punteggio = punteggio - tan * 5
+    taeg_calcolato = _colonna(colonne, "taeg_calcolato")
+    # fmax ignora i NaN: senza TAEG calcolato resta il dichiarato
+    taeg = np.where(taeg > 0, np.fmax(taeg, taeg_calcolato), np.nan)
+    taeg = np.where(np.isnan(taeg) | (taeg == 0), tan, taeg)
+    punteggio = np.where(taeg > tan, punteggio - (taeg - tan) * 4, punteggio)
+    punteggio = np.where(ltv > 80, punteggio - (ltv - 80) * 1.0, punteggio)
+    punteggio = punteggio - rapporto_spese * 2
+
+    return _arrotonda(np.clip(punteggio, 0, 100), 1)
+
+
+def calcola_metriche(colonne: dict) -> dict[str, np.ndarray]:
+    """
+    Calcola in blocco i campi derivati di N mutui.
 
-    classifica = []
-    for m in mutui:
-        punteggio = calcola_punteggio(m)
-        classifica.append(
-            {
-                "id": m["id"],
-                "banca": m["banca"],
-                "punteggio": punteggio,
-                "rata_mensile": m.get("rata_mensile", 0),
-                "costo_totale": m.get("costo_totale", 0),
-                "tan": m.get("tan", 0),
-                "taeg": m.get("taeg"),
-            }
-        )
+    Restituisce rata_mensile, ltv, totale_interessi, costo_totale,
+    taeg_calcolato (NaN se non calcolabile) e punteggio come array, con gli stessi arrotondamenti delle funzioni scalari.
+    """
+    importo = _colonna(colonne, "importo")
+    tan = _colonna(colonne, "tan")
+    durata_anni = np.asarray(colonne["durata_anni"], dtype=np.int64)
+    valore_immobile = _colonna(colonne, "valore_immobile")
+
+    rata = calcola_rate_mensili(importo, tan, durata_anni)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        ltv = np.where(valore_immobile > 0, _arrotonda((importo / valore_immobile) * 100), 0)
+    totale_interessi = _arrotonda(rata * (durata_anni * MESI_ANNO) - importo)
+
+    spese = np.nan_to_num(_colonna(colonne, SPESE_ACCESSORIE[0], 0))
+    for nome in SPESE_ACCESSORIE[1:]:
+        spese = spese + np.nan_to_num(_colonna(colonne, nome, 0))
+    costo_totale = _arrotonda(totale_interessi + spese)
+    taeg_calcolato = calcola_taeg(importo, rata, durata_anni * MESI_ANNO, spese)
+
+    metriche = {
+        "rata_mensile": rata,
+        "ltv": ltv,
+        "totale_interessi": totale_interessi,
+        "costo_totale": costo_totale,
+        "taeg_calcolato": taeg_calcolato,
+    }
+    metriche["punteggio"] = calcola_punteggi({**colonne, **metriche})
+    return metriche
 
-    classifica.sort(key=lambda x: x["punteggio"], reverse=True)
-    migliore = classifica[0]
 
-    analisi_parts = [f"Analisi comparativa di {len(mutui)} mutui:\n"]
-    for i, c in enumerate(classifica, 1):
-        analisi_parts.append(
-            f"{i}. {c['banca']} \u2014 Punteggio: {c['punteggio']}/100 | "
-            f"Rata: \u20ac{c['rata_mensile']:,.2f} | "
-            f"Costo totale: \u20ac{c['costo_totale']:,.2f} | "
-            f"TAN: {c['tan']}%"
-        )
+# Campi letti dal calcolo colonnare del punteggio
+COLONNE_PUNTEGGIO = (
+    "importo", "tan", "taeg", "taeg_calcolato", "ltv", "totale_interessi", *SPESE_ACCESSORIE,
+)
+
+
+def indici_migliori(punteggi, k: int) -> np.ndarray:
+    """
+    Indici dei `k` punteggi pi\u00f9 alti, dal migliore.
+
+    Con k < N la soglia del k-esimo si trova con argpartition (O(N)) e si
+    ordinano solo i candidati. A pari punteggio vince l'indice pi\u00f9 basso,
+    come nell'ordinamento stabile della classifica.
+    """
+    punteggi = np.asarray(punteggi, dtype=np.float64)
+    n = punteggi.size
+    k = min(k, n)
+    if k <= 0:
+        return np.empty(0, dtype=np.int64)
+    if k < n:
+        soglia = punteggi[np.argpartition(punteggi, n - k)[n - k]]
+        sopra = np.flatnonzero(punteggi > soglia)
+        pari = np.flatnonzero(punteggi == soglia)[: k - sopra.size]
+        candidati = np.concatenate([sopra, pari])
+    else:
+        candidati = np.arange(n)
+    return candidati[np.lexsort((candidati, -punteggi[candidati]))]
+
+
+def _voce_classifica(m: dict, punteggio: float) -> dict:
+    return {
+        "id": m["id"],
+        "banca": m["banca"],
+        "punteggio": punteggio,
+        "rata_mensile": m.get("rata_mensile", 0),
+        "costo_totale": m.get("costo_totale", 0),
+        "tan": m.get("tan", 0),
+        "taeg": m.get("taeg"),
+        "taeg_calcolato": m.get("taeg_calcolato"),
+    }
+
+
+def _analisi(classifica: list[dict], totale: int) -> str:
+    migliore = classifica[0]
+    analisi_parts = [f"Analisi comparativa di {totale} mutui:\n"]
+    analisi_parts.extend(
+        f"{i}. {c['banca']} \u2014 Punteggio: {c['punteggio']}/100 | "
+        f"Rata: \u20ac{c['rata_mensile']:,.2f} | "
+        f"Costo totale: \u20ac{c['costo_totale']:,.2f} | "
+        f"TAN: {c['tan']}%"
+        for i, c in enumerate(classifica, 1)
+    )
 
     analisi_parts.append(
         f"\n\u2192 Il mutuo pi\u00f9 conveniente \u00e8 quello di {migliore['banca']} "
@@ -179,9 +808,29 @@ def confronta_mutui(mutui: list[dict]) -> dict:
             f"Rispetto a {peggiore['banca']}, risparmi \u20ac{diff_rata:,.2f}/mese "
             f"e \u20ac{diff_totale:,.2f} sul totale."
         )
+    return "\n".join(analisi_parts)
+
+
+def confronta_mutui(mutui: list[dict], k: int | None = None) -> dict:
+    """
+    Confronta una lista di mutui e genera classifica e analisi.
+
+    I punteggi sono calcolati in forma colonnare; con `k` la classifica
+    (e l'analisi) si ferma ai primi k.
+
+    Returns:
+        dict con classifica, migliore_id e analisi testuale
+    """
+    if not mutui:
+        return {"classifica": [], "migliore_id": 0, "analisi": "Nessun mutuo da confrontare."}
+
+    colonne = {nome: [m.get(nome) for m in mutui] for nome in COLONNE_PUNTEGGIO}
+    punteggi = calcola_punteggi(colonne).tolist()
+    indici = indici_migliori(punteggi, len(mutui) if k is None else k)
+    classifica = [_voce_classifica(mutui[i], punteggi[i]) for i in indici.tolist()]
 
     return {
         "classifica": classifica,
-        "migliore_id": migliore["id"],
-        "analisi": "\n".join(analisi_parts),
+        "migliore_id": classifica[0]["id"],
+        "analisi": _analisi(classifica, len(mutui)),
     }
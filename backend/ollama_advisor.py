@@ -1,17 +1,194 @@
+import asyncio
+import hashlib
 import httpx
 import json
+import os
+import time
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager
+from metriche import registra_ollama
 
-OLLAMA_BASE_URL = "http://localhost:11434"
+OLLAMA_BASE_URL = os.environ.get("OLLAMA_BASE_URL", "http://localhost:11434")
 MODEL_NAME = "gemma3:12b"
 
+# Generazioni contemporanee verso Ollama e richieste ammesse in attesa
+OLLAMA_CONCORRENZA = int(os.environ.get("OLLAMA_CONCURRENCY", "1"))
+OLLAMA_CODA_MAX = int(os.environ.get("OLLAMA_QUEUE_MAX", "8"))
 
-async def chiedi_consulenza(mutui_data: list[dict], domanda: str | None = None) -> str:
+
+OLLAMA_NUM_CTX = int(os.environ.get("OLLAMA_NUM_CTX", "8192"))
+
+OPZIONI_GENERAZIONE = {
+    "temperature": 0.4,
+    "top_p": 0.9,
+    "num_predict": 4096,
+    "num_ctx": OLLAMA_NUM_CTX,
+}
+
+# Token stimati concessi al prompt: il resto del contesto resta per la risposta
+OLLAMA_PROMPT_BUDGET = int(
+    os.environ.get("OLLAMA_PROMPT_BUDGET", str(OLLAMA_NUM_CTX - OPZIONI_GENERAZIONE["num_predict"]))
+)
+
+# Le risposte di errore iniziano cos\u00ec e non vanno mai messe in cache
+PREFISSO_ERRORE = "\u26a0\ufe0f"
+
+MESSAGGIO_OLLAMA_OFFLINE = (
+    f"{PREFISSO_ERRORE} Impossibile connettersi a Ollama. "
+    "Assicurati che Ollama sia in esecuzione (ollama serve) "
+    "e che il modello gemma3:12b sia installato (ollama pull gemma3:12b)."
+)
+
+
+class CodaPiena(Exception):
+    """Troppe consulenze gi\u00e0 in attesa."""
+
+
+class Prenotazione:
+    """Posto nella coda di Ollama: in attesa finch\u00e9 non diventa attiva."""
+
+    def __init__(self, coda: "CodaOllama"):
+        self._coda = coda
+        self._pronta = asyncio.Event()
+        self.attiva = False
+
+    @property
+    def posizione(self) -> int:
+        """0 se la generazione pu\u00f2 partire, altrimenti la posizione in coda (da 1)."""
+        if self.attiva:
+            return 0
+        try:
+            return self._coda._attesa.index(self) + 1
+        except ValueError:
+            return 0
+
+    async def attendi(self, timeout: float | None = None) -> bool:
+        """Attende il turno; False se scade `timeout` prima."""
+        try:
+            await asyncio.wait_for(self._pronta.wait(), timeout)
+        except asyncio.TimeoutError:
+            return False
+        return True
+
+    def rilascia(self) -> None:
+        self._coda._rilascia(self)
+
+
+class CodaOllama:
     """
-    Chiede a Gemma 2B una consulenza finanziaria sui mutui forniti.
+    Coda FIFO davanti a Ollama con concorrenza limitata.
+
+    Con un solo modello caricato, pi\u00f9 generazioni parallele si contendono il
+    contesto e rallentano tutte; qui passano `concorrenza` alla volta e le
+    altre aspettano in ordine, fino a `max_attesa`.
     """
-    # Ordina mutui per costo totale (il pi\u00f9 conveniente prima)
-    mutui_sorted = sorted(mutui_data, key=lambda m: m.get('costo_totale', 0) or 0)
 
+    def __init__(self, concorrenza: int = OLLAMA_CONCORRENZA, max_attesa: int = OLLAMA_CODA_MAX):
+        self.concorrenza = max(1, concorrenza)
+        self.max_attesa = max_attesa
+        self._attivi = 0
+        self._attesa: deque[Prenotazione] = deque()
+        self.servite = 0
+        self.rifiutate = 0
+
+    @property
+    def piena(self) -> bool:
+        return self._attivi >= self.concorrenza and len(self._attesa) >= self.max_attesa
+
+    def prenota(self) -> Prenotazione:
+        """Prende un posto; solleva CodaPiena se l'attesa \u00e8 gi\u00e0 al limite."""
+        prenotazione = Prenotazione(self)
+        if self._attivi < self.concorrenza and not self._attesa:
+            self._attiva(prenotazione)
+        elif len(self._attesa) >= self.max_attesa:
+            self.rifiutate += 1
+            raise CodaPiena()
+        else:
+            self._attesa.append(prenotazione)
+        return prenotazione
+
+    @asynccontextmanager
+    async def slot(self):
+        """Attende il turno e lo libera all'uscita, anche se la richiesta viene annullata."""
+        prenotazione = self.prenota()
+        try:
+            await prenotazione.attendi()
+            yield prenotazione
+        finally:
+            prenotazione.rilascia()
+
+    def _attiva(self, prenotazione: Prenotazione) -> None:
+        prenotazione.attiva = True
+        self._attivi += 1
+        self.servite += 1
+        prenotazione._pronta.set()
+
+    def _rilascia(self, prenotazione: Prenotazione) -> None:
+        if prenotazione.attiva:
+            prenotazione.attiva = False
+            self._attivi -= 1
+        elif prenotazione in self._attesa:
+            self._attesa.remove(prenotazione)
+        while self._attivi < self.concorrenza and self._attesa:
+            self._attiva(self._attesa.popleft())
+
+    def stato(self) -> dict:
+        return {
+            "concorrenza": self.concorrenza,
+            "attive": self._attivi,
+            "in_attesa": len(self._attesa),
+            "max_attesa": self.max_attesa,
+            "servite": self.servite,
+            "rifiutate": self.rifiutate,
+        }
+
+
+coda_ollama = CodaOllama()
+
+_client: httpx.AsyncClient | None = None
+
+
+async def avvia_client() -> None:
+    """Crea il client HTTP condiviso verso Ollama (connessioni keep-alive)."""
+    global _client
+    if _client is None:
+        _client = httpx.AsyncClient(
+            timeout=httpx.Timeout(120.0, connect=10.0),
+            limits=httpx.Limits(max_keepalive_connections=4, keepalive_expiry=300),
+        )
+
+
+async def chiudi_client() -> None:
+    global _client
+    if _client is not None:
+        await _client.aclose()
+        _client = None
+
+
+async def _get_client() -> httpx.AsyncClient:
+    if _client is None:
+        await avvia_client()
+    return _client
+
+
+CARATTERI_PER_TOKEN = 3.2
+
+
+def stima_token(testo: str) -> int:
+    """
+    Stima prudente dei token di un testo per Gemma.
+
+    Italiano e numeri formattati stanno in media sopra i 3,5 caratteri per
+    token: 3,2 sovrastima un po', che per un budget \u00e8 il lato giusto.
+    """
+    return int(len(testo) / CARATTERI_PER_TOKEN) + 1
+
+
+def _spese_iniziali(m: dict) -> float:
+    return (m.get('spese_istruttoria', 0) or 0) + (m.get('spese_perizia', 0) or 0) + (m.get('spese_notarili', 0) or 0)
+
+
+def _blocco_esteso(mutui_sorted: list[dict]) -> str:
     mutui_desc = []
     for i, m in enumerate(mutui_sorted, 1):
         lines = [
@@ -53,7 +230,93 @@ async def chiedi_consulenza(mutui_data: list[dict], domanda: str | None = None)
             lines.append(f"  Note: {note_short}")
         mutui_desc.append("\n".join(lines))
 
-    mutui_block = "\n\n".join(mutui_desc)
+    return "\n\n".join(mutui_desc)
+
+
+def _blocco_compatto(mutui_sorted: list[dict]) -> str:
+    """Una riga per mutuo: stessi numeri del formato esteso, senza le note."""
+    righe = [
+        "OFFERTE (# | banca | tipo | TAN% | TAEG% | durata | rata \u20ac | interessi \u20ac | COSTO TOTALE \u20ac | LTV% | spese iniziali \u20ac | altre spese \u20ac):"
+    ]
+    for i, m in enumerate(mutui_sorted, 1):
+        altre = (m.get('costo_assicurazione', 0) or 0) + (m.get('altre_spese', 0) or 0)
+        righe.append(
+            f"{i} | {m['banca']} | {m['tipo_tasso']} | {m['tan']} | {m.get('taeg') or '-'} | "
+            f"{m['durata_anni']}a | {m.get('rata_mensile', 0):,.2f} | {m.get('totale_interessi', 0):,.0f} | "
+            f"{m.get('costo_totale', 0):,.0f} | {m.get('ltv', 0):.1f} | {_spese_iniziali(m):,.0f} | {altre:,.0f}"
+        )
+    return "\n".join(righe)
+
+
+def mutui_dominati(mutui_data: list[dict]) -> set[int]:
+    """
+    Id dei mutui dominati: un'altra offerta costa meno o uguale in totale,
+    ha rata e spese iniziali non superiori ed \u00e8 strettamente migliore in
+    almeno uno dei tre. Non possono essere la scelta giusta in nessuno scenario.
+    """
+    criteri = [
+        (m["id"], (m.get('costo_totale', 0) or 0, m.get('rata_mensile', 0) or 0, _spese_iniziali(m)))
+        for m in mutui_data
+    ]
+    dominati = set()
+    for mutuo_id, valori in criteri:
+        for altro_id, altri in criteri:
+            if altro_id != mutuo_id and all(a <= v for a, v in zip(altri, valori)) and altri != valori:
+                dominati.add(mutuo_id)
+                break
+    return dominati
+
+
+# Parte fissa del prompt: non cambia tra una consulenza e l'altra, cos\u00ec Ollama
+# riusa la cache KV del prefisso invece di rifare il prefill a ogni richiesta
+ISTRUZIONI_SISTEMA = "\n".join([
+    "Sei un consulente finanziario italiano esperto di mutui.",
+    "Il cliente ti fornisce le offerte che sta valutando, con i dati gi\u00e0 calcolati e verificati,",
+    "la classifica per costo totale e gli scenari precalcolati.",
+    "",
+    "REGOLE:",
+    "- Il COSTO TOTALE \u00e8 il dato pi\u00f9 importante: include interessi + spese.",
+    "- Usa SOLO i numeri forniti. NON inventare dati. NON dire 'competitivo' senza spiegare rispetto a chi.",
+    "- Per ogni pro/contro, cita il numero esatto e la differenza rispetto agli altri.",
+    "",
+    "STRUTTURA la prima risposta cos\u00ec:",
+    "",
+    "## 1. Classifica",
+    "Ordina i mutui dal migliore al peggiore per costo totale. Per ognuno indica la differenza in \u20ac rispetto al primo.",
+    "",
+    "## 2. Quale scegliere in base alla tua situazione",
+    "- **Vuoi spendere meno in assoluto?** \u2192 l'offerta col costo totale pi\u00f9 basso. Spiega perch\u00e9 con i numeri.",
+    "- **Hai bisogno della rata pi\u00f9 bassa?** \u2192 l'offerta con la rata pi\u00f9 bassa. Spiega la differenza di rata e quanto costa in pi\u00f9 nel totale.",
+    "- **Hai poca liquidit\u00e0 iniziale?** \u2192 l'offerta con le spese iniziali pi\u00f9 basse. Spiega quanto risparmi sulle spese iniziali.",
+    "- **Vuoi la massima sicurezza?** \u2192 Consiglia il fisso pi\u00f9 basso e spiega perch\u00e9.",
+    "",
+    "## 3. Da evitare",
+    "Quali mutui sono chiaramente peggiori e perch\u00e9 (cita i numeri).",
+    "",
+    "## 4. Consigli pratici",
+    "Suggerimenti concreti per negoziare con le banche (es. chiedere riduzione spese istruttoria, ecc.)",
+    "",
+    "Alle domande successive rispondi in modo mirato usando le stesse offerte, senza ripetere tutta l'analisi.",
+    "Rispondi in italiano. Cita sempre i numeri esatti e le differenze in euro.",
+])
+
+
+def _componi_prompt(
+    mutui_sorted: list[dict],
+    domanda: str | None,
+    formato: str,
+    totale_offerte: int,
+    esclusi: list[dict],
+) -> str:
+    """Primo messaggio del cliente: tutto ci\u00f2 che dipende dalle offerte scelte."""
+    mutui_block = _blocco_esteso(mutui_sorted) if formato == "esteso" else _blocco_compatto(mutui_sorted)
+    nota_esclusi = []
+    if esclusi:
+        nota_esclusi = [
+            f"Offerte non riportate (peggiori di un'altra su costo totale, rata e spese iniziali, o tra le pi\u00f9 care): "
+            f"{', '.join(m['banca'] for m in esclusi)}.",
+            "",
+        ]
 
     # Calcola classifica esplicita per il modello
     migliore = mutui_sorted[0]
@@ -65,102 +328,349 @@ async def chiedi_consulenza(mutui_data: list[dict], domanda: str | None = None)
 
     # Trova il mutuo con rata pi\u00f9 bassa e con spese iniziali pi\u00f9 basse
     min_rata = min(mutui_sorted, key=lambda m: m.get('rata_mensile', 0) or 0)
-    spese_iniziali = lambda m: (m.get('spese_istruttoria', 0) + m.get('spese_perizia', 0) + m.get('spese_notarili', 0))
-    min_spese = min(mutui_sorted, key=spese_iniziali)
+    min_spese = min(mutui_sorted, key=_spese_iniziali)
 
     scenari_text = (
         f"\nSCENARI PRECALCOLATI:\n"
         f"- Se vuoi SPENDERE MENO in assoluto nel tempo \u2192 {migliore['banca']} (costo totale \u20ac{migliore.get('costo_totale', 0):,.0f})\n"
         f"- Se vuoi la RATA MENSILE PI\u00d9 BASSA \u2192 {min_rata['banca']} (rata \u20ac{min_rata.get('rata_mensile', 0):,.2f}/mese)\n"
-        f"- Se hai POCA LIQUIDIT\u00c0 INIZIALE (spese da anticipare basse) \u2192 {min_spese['banca']} (spese iniziali \u20ac{spese_iniziali(min_spese):,.0f})\n"
+        f"- Se hai POCA LIQUIDIT\u00c0 INIZIALE (spese da anticipare basse) \u2192 {min_spese['banca']} (spese iniziali \u20ac{_spese_iniziali(min_spese):,.0f})\n"
     )
 
     prompt_parts = [
-        "Sei un consulente finanziario italiano esperto di mutui.",
-        f"Il cliente valuta {len(mutui_data)} offerte. I dati sono gi\u00e0 calcolati e verificati.",
+        f"Valuto {totale_offerte} offerte di mutuo.",
         "",
         mutui_block,
         "",
+        *nota_esclusi,
         classifica_text,
         scenari_text,
-        "",
-        "REGOLE:",
-        f"- Il mutuo col COSTO TOTALE pi\u00f9 basso \u00e8 {migliore['banca']} (\u20ac{migliore.get('costo_totale', 0):,.0f}).",
-        "- Il COSTO TOTALE \u00e8 il dato pi\u00f9 importante: include interessi + spese.",
-        "- Usa SOLO i numeri forniti. NON inventare dati. NON dire 'competitivo' senza spiegare rispetto a chi.",
-        "- Per ogni pro/contro, cita il numero esatto e la differenza rispetto agli altri.",
-        "",
-        "STRUTTURA la risposta cos\u00ec:",
-        "",
-        "## 1. Classifica",
-        "Ordina i mutui dal migliore al peggiore per costo totale. Per ognuno indica la differenza in \u20ac rispetto al primo.",
-        "",
-        "## 2. Quale scegliere in base alla tua situazione",
-        f"- **Vuoi spendere meno in assoluto?** \u2192 {migliore['banca']}. Spiega perch\u00e9 con i numeri.",
-        f"- **Hai bisogno della rata pi\u00f9 bassa?** \u2192 {min_rata['banca']}. Spiega la differenza di rata e quanto costa in pi\u00f9 nel totale.",
-        f"- **Hai poca liquidit\u00e0 iniziale?** \u2192 {min_spese['banca']}. Spiega quanto risparmi sulle spese iniziali.",
-        "- **Vuoi la massima sicurezza?** \u2192 Consiglia il fisso pi\u00f9 basso e spiega perch\u00e9.",
-        "",
-        "## 3. Da evitare",
-        "Quali mutui sono chiaramente peggiori e perch\u00e9 (cita i numeri).",
-        "",
-        "## 4. Consigli pratici",
-        "Suggerimenti concreti per negoziare con le banche (es. chiedere riduzione spese istruttoria, ecc.)",
+        f"Il mutuo col COSTO TOTALE pi\u00f9 basso \u00e8 {migliore['banca']} (\u20ac{migliore.get('costo_totale', 0):,.0f}).",
     ]
 
     if domanda:
         prompt_parts.extend(["", f"## Domanda specifica del cliente:\n{domanda}\nRispondi a questa domanda in modo dettagliato."])
 
-    prompt_parts.append("\nRispondi in italiano. Cita sempre i numeri esatti e le differenze in euro.")
+    return "\n".join(prompt_parts)
+
+
+def prepara_prompt(
+    mutui_data: list[dict],
+    domanda: str | None = None,
+    budget: int | None = None,
+) -> tuple[str, dict]:
+    """
+    Costruisce il messaggio con le offerte restando entro `budget` token stimati.
+
+    In ordine: formato esteso; tabella compatta; tabella senza le offerte
+    dominate; infine si tolgono le offerte pi\u00f9 care finch\u00e9 il prompt entra
+    (restano almeno le due migliori). Ritorna il prompt e le scelte fatte.
+    """
+    budget = budget or OLLAMA_PROMPT_BUDGET
+    # Ordina mutui per costo totale (il pi\u00f9 conveniente prima)
+    mutui_sorted = sorted(mutui_data, key=lambda m: m.get('costo_totale', 0) or 0)
+    dominati = mutui_dominati(mutui_sorted)
+    non_dominati = [m for m in mutui_sorted if m["id"] not in dominati]
+
+    tentativi = [("esteso", mutui_sorted), ("compatto", mutui_sorted)]
+    if dominati:
+        tentativi.append(("compatto", non_dominati))
+
+    def componi(formato: str, inclusi: list[dict]) -> tuple[str, list[dict]]:
+        ids = {m["id"] for m in inclusi}
+        esclusi = [m for m in mutui_sorted if m["id"] not in ids]
+        return _componi_prompt(inclusi, domanda, formato, len(mutui_data), esclusi), esclusi
+
+    for formato, inclusi in tentativi:
+        prompt, esclusi = componi(formato, inclusi)
+        if stima_token(prompt) <= budget:
+            break
+    else:
+        while len(inclusi) > 2 and stima_token(prompt) > budget:
+            inclusi = inclusi[:-1]
+            prompt, esclusi = componi(formato, inclusi)
+
+    return prompt, {
+        "formato": formato,
+        "offerte_incluse": len(inclusi),
+        "offerte_escluse": [m["id"] for m in esclusi],
+        "token_prompt_stimati": stima_token(prompt),
+        "budget_token": budget,
+    }
+
+
+def costruisci_prompt(mutui_data: list[dict], domanda: str | None = None) -> str:
+    """Costruisce il prompt di consulenza (istruzioni + offerte) per i mutui forniti."""
+    return "\n\n".join(m["content"] for m in prepara_messaggi(mutui_data, domanda)[0])
+
+
+# Conversazioni recenti, per continuare con domande successive sulle stesse offerte
+OLLAMA_KEEP_ALIVE = os.environ.get("OLLAMA_KEEP_ALIVE", "30m")
+SESSIONI_MAX = int(os.environ.get("ADVISOR_SESSIONS_MAX", "64"))
+SESSIONE_TTL = float(os.environ.get("ADVISOR_SESSION_TTL", "1800"))
+
+
+class SessioniConsulenza:
+    """
+    Ultime conversazioni in memoria, una per insieme di offerte (id + updated_at).
+
+    I messaggi gi\u00e0 scambiati vengono rimandati identici: Ollama ritrova lo
+    stesso prefisso nella cache KV e fa il prefill solo della nuova domanda.
+    Se un'offerta cambia, cambia la chiave e la conversazione riparte da capo.
+    """
+
+    def __init__(self, massimo: int = SESSIONI_MAX, ttl: float = SESSIONE_TTL):
+        self.massimo = massimo
+        self.ttl = ttl
+        self._sessioni: OrderedDict[str, tuple[float, list[dict]]] = OrderedDict()
+
+    @staticmethod
+    def chiave(mutui_data: list[dict]) -> str:
+        mutui = sorted((m["id"], m.get("updated_at")) for m in mutui_data)
+        return hashlib.sha256(json.dumps(mutui).encode()).hexdigest()
+
+    def leggi(self, chiave: str) -> list[dict] | None:
+        voce = self._sessioni.get(chiave)
+        if voce is None:
+            return None
+        if time.monotonic() - voce[0] > self.ttl:
+            del self._sessioni[chiave]
+            return None
+        self._sessioni.move_to_end(chiave)
+        return voce[1]
+
+    def salva(self, chiave: str, messaggi: list[dict]) -> None:
+        self._sessioni[chiave] = (time.monotonic(), messaggi)
+        self._sessioni.move_to_end(chiave)
+        while len(self._sessioni) > self.massimo:
+            self._sessioni.popitem(last=False)
+
+    def svuota(self) -> None:
+        self._sessioni.clear()
+
+    def stato(self) -> dict:
+        return {"sessioni": len(self._sessioni), "massimo": self.massimo, "ttl_s": self.ttl}
+
+
+sessioni_consulenza = SessioniConsulenza()
+
+
+def _stima_token_messaggi(messaggi: list[dict]) -> int:
+    return sum(stima_token(m["content"]) for m in messaggi)
+
+
+def _messaggi_iniziali(
+    mutui_data: list[dict], domanda: str | None = None
+) -> tuple[list[dict], dict]:
+    """Primo turno di una conversazione: istruzioni di sistema e offerte, senza storico."""
+    sistema = {"role": "system", "content": ISTRUZIONI_SISTEMA}
+    budget = OLLAMA_PROMPT_BUDGET
+    contenuto, info = prepara_prompt(mutui_data, domanda, budget - stima_token(ISTRUZIONI_SISTEMA))
+    messaggi = [sistema, {"role": "user", "content": contenuto}]
+    token = _stima_token_messaggi(messaggi)
+    return messaggi, {
+        **info,
+        "sessione": "nuova",
+        "turno": 1,
+        "token_prompt_stimati": token,
+        "token_nuovi_stimati": stima_token(contenuto),
+        "budget_token": budget,
+    }
+
+
+def prepara_messaggi(
+    mutui_data: list[dict], domanda: str | None = None
+) -> tuple[list[dict], dict]:
+    """
+    Messaggi per /api/chat: istruzioni di sistema fisse, poi le offerte.
+
+    Una domanda sulle stesse offerte di una conversazione recente la continua
+    (le offerte non vengono rimandate da capo) finch\u00e9 tutto entra nel budget;
+    senza domanda si riparte sempre con l'analisi completa.
+    """
+    sistema = {"role": "system", "content": ISTRUZIONI_SISTEMA}
+    budget = OLLAMA_PROMPT_BUDGET
+    storico = sessioni_consulenza.leggi(SessioniConsulenza.chiave(mutui_data)) if domanda else None
+    if storico:
+        seguito = {
+            "role": "user",
+            "content": f"Domanda successiva del cliente:\n{domanda}\nRispondi usando le offerte gi\u00e0 fornite.",
+        }
+        messaggi = [sistema, *storico, seguito]
+        token = _stima_token_messaggi(messaggi)
+        if token <= budget:
+            return messaggi, {
+                "sessione": "continuata",
+                "turno": len(storico) // 2 + 1,
+                "token_prompt_stimati": token,
+                "token_nuovi_stimati": stima_token(seguito["content"]),
+                "budget_token": budget,
+            }
+
+    return _messaggi_iniziali(mutui_data, domanda)
 
-    prompt = "\n".join(prompt_parts)
+
+def _registra_turno(mutui_data: list[dict], messaggi: list[dict], risposta: str) -> None:
+    if risposta_valida(risposta):
+        storico = [*messaggi[1:], {"role": "assistant", "content": risposta}]
+        sessioni_consulenza.salva(SessioniConsulenza.chiave(mutui_data), storico)
+
+
+def ricorda_risposta(mutui_data: list[dict], domanda: str | None, risposta: str) -> None:
+    """Aggiunge alla conversazione una risposta ottenuta senza Ollama (es. dalla cache)."""
+    _registra_turno(mutui_data, prepara_messaggi(mutui_data, domanda)[0], risposta)
+
+
+def impronta_consulenza(mutui_data: list[dict], domanda: str | None = None) -> str:
+    """
+    Impronta (SHA-256) di una consulenza: messaggi del primo turno, modello,
+    opzioni di generazione e updated_at dei mutui coinvolti. Se cambia uno
+    qualunque di questi la risposta in cache non vale pi\u00f9.
+
+    La conversazione in memoria resta fuori: la stessa domanda sulle stesse
+    offerte ha sempre la stessa impronta, anche ripetuta dentro una sessione,
+    e va cercata in cache prima di continuare la conversazione con Ollama.
+    """
+    chiave = {
+        "messaggi": _messaggi_iniziali(mutui_data, domanda)[0],
+        "modello": MODEL_NAME,
+        "opzioni": OPZIONI_GENERAZIONE,
+        "mutui": sorted((m["id"], m.get("updated_at")) for m in mutui_data),
+    }
+    return hashlib.sha256(json.dumps(chiave, sort_keys=True).encode()).hexdigest()
+
+
+def risposta_valida(risposta: str) -> bool:
+    return bool(risposta) and not risposta.startswith((PREFISSO_ERRORE, "Errore:"))
+
+
+def _payload_chat(messaggi: list[dict], stream: bool) -> dict:
+    return {
+        "model": MODEL_NAME,
+        "messages": messaggi,
+        "stream": stream,
+        "options": OPZIONI_GENERAZIONE,
+        # Il modello (e la sua cache KV) resta caricato tra una domanda e l'altra
+        "keep_alive": OLLAMA_KEEP_ALIVE,
+    }
+
+
+def _metriche_ollama(risultato: dict) -> dict:
+    """Conteggi e durate (ns) che Ollama riporta a fine generazione, in ms."""
+    metriche = {}
+    for chiave in ("prompt_eval_count", "eval_count"):
+        if chiave in risultato:
+            metriche[chiave] = risultato[chiave]
+    for chiave, nome in (
+        ("prompt_eval_duration", "prefill_ms"),
+        ("eval_duration", "generazione_ms"),
+        ("total_duration", "totale_ms"),
+    ):
+        if chiave in risultato:
+            metriche[nome] = round(risultato[chiave] / 1e6, 1)
+    if risultato.get("eval_count") and risultato.get("eval_duration"):
+        metriche["token_al_secondo"] = round(risultato["eval_count"] / (risultato["eval_duration"] / 1e9), 1)
+    return metriche
+
+
+async def chiedi_consulenza(
+    mutui_data: list[dict], domanda: str | None = None, metadati: dict | None = None
+) -> str:
+    """
+    Chiede a Gemma una consulenza finanziaria sui mutui forniti.
+
+    Se passato, `metadati` viene riempito con le scelte del prompt builder
+    (formato, offerte escluse, token stimati, sessione) e le metriche di Ollama.
+    """
+    messaggi, info_prompt = prepara_messaggi(mutui_data, domanda)
+    if metadati is not None:
+        metadati.update(info_prompt)
 
     try:
-        async with httpx.AsyncClient(timeout=120.0) as client:
-            response = await client.post(
-                f"{OLLAMA_BASE_URL}/api/generate",
-                json={
-                    "model": MODEL_NAME,
-                    "prompt": prompt,
-                    "stream": False,
-                    "options": {
-                        "temperature": 0.4,
-                        "top_p": 0.9,
-                        "num_predict": 4096,
-                        "num_ctx": 8192,
-                    },
-                },
-            )
+        client = await _get_client()
+        response = await client.post(
+            f"{OLLAMA_BASE_URL}/api/chat",
+            json=_payload_chat(messaggi, stream=False),
+        )
+        response.raise_for_status()
+        result = response.json()
+        registra_ollama(result)
+        if metadati is not None:
+            metadati.update(_metriche_ollama(result))
+        risposta = result.get("message", {}).get("content") or "Errore: nessuna risposta dal modello."
+        _registra_turno(mutui_data, messaggi, risposta)
+        return risposta
+    except httpx.ConnectError:
+        return MESSAGGIO_OLLAMA_OFFLINE
+    except httpx.HTTPStatusError as e:
+        return f"{PREFISSO_ERRORE} Errore dal server Ollama: {e.response.status_code}"
+    except Exception as e:
+        return f"{PREFISSO_ERRORE} Errore imprevisto: {str(e)}"
+
+
+async def chiedi_consulenza_stream(
+    mutui_data: list[dict], domanda: str | None = None, metadati: dict | None = None
+):
+    """
+    Come chiedi_consulenza, ma produce la risposta un frammento alla volta
+    man mano che Ollama genera i token. Gli errori arrivano come ultimo frammento.
+    La risposta entra nella conversazione solo se arriva completa: in quel caso,
+    e solo in quello, `metadati["completa"]` vale True.
+    """
+    messaggi, info_prompt = prepara_messaggi(mutui_data, domanda)
+    if metadati is not None:
+        metadati.update(info_prompt)
+
+    try:
+        client = await _get_client()
+        parti = []
+        # Il timeout di lettura vale tra un token e l'altro, non sull'intera risposta
+        async with client.stream(
+            "POST",
+            f"{OLLAMA_BASE_URL}/api/chat",
+            json=_payload_chat(messaggi, stream=True),
+        ) as response:
             response.raise_for_status()
-            result = response.json()
-            return result.get("response", "Errore: nessuna risposta dal modello.")
+            async for riga in response.aiter_lines():
+                if not riga:
+                    continue
+                parte = json.loads(riga)
+                if parte.get("error"):
+                    yield f"{PREFISSO_ERRORE} Errore dal server Ollama: {parte['error']}"
+                    return
+                token = parte.get("message", {}).get("content")
+                if token:
+                    parti.append(token)
+                    yield token
+                if parte.get("done"):
+                    registra_ollama(parte)
+                    if metadati is not None:
+                        metadati.update(_metriche_ollama(parte), completa=True)
+                    _registra_turno(mutui_data, messaggi, "".join(parti))
+                    return
     except httpx.ConnectError:
-        return (
-            "\u26a0\ufe0f Impossibile connettersi a Ollama. "
-            "Assicurati che Ollama sia in esecuzione (ollama serve) "
-            "e che il modello gemma3:12b sia installato (ollama pull gemma3:12b)."
-        )
+        yield MESSAGGIO_OLLAMA_OFFLINE
     except httpx.HTTPStatusError as e:
-        return f"\u26a0\ufe0f Errore dal server Ollama: {e.response.status_code}"
+        yield f"{PREFISSO_ERRORE} Errore dal server Ollama: {e.response.status_code}"
     except Exception as e:
-        return f"\u26a0\ufe0f Errore imprevisto: {str(e)}"
+        yield f"{PREFISSO_ERRORE} Errore imprevisto: {str(e)}"
 
 
-async def verifica_ollama() -> dict:
-    """Verifica che Ollama sia raggiungibile e il modello disponibile."""
+async def _sonda_ollama() -> dict:
+    """Interroga /api/tags: raggiungibilit\u00e0 di Ollama e modelli installati."""
     try:
-        async with httpx.AsyncClient(timeout=10.0) as client:
-            resp = await client.get(f"{OLLAMA_BASE_URL}/api/tags")
-            resp.raise_for_status()
-            models = resp.json().get("models", [])
-            model_names = [m["name"] for m in models]
-            gemma_available = any(MODEL_NAME in name for name in model_names)
-            return {
-                "ollama_online": True,
-                "modello_disponibile": gemma_available,
-                "modello": MODEL_NAME,
-                "modelli_installati": model_names,
-            }
+        client = await _get_client()
+        resp = await client.get(f"{OLLAMA_BASE_URL}/api/tags", timeout=10.0)
+        resp.raise_for_status()
+        models = resp.json().get("models", [])
+        model_names = [m["name"] for m in models]
+        gemma_available = any(MODEL_NAME in name for name in model_names)
+        return {
+            "ollama_online": True,
+            "modello_disponibile": gemma_available,
+            "modello": MODEL_NAME,
+            "modelli_installati": model_names,
+        }
     except Exception:
         return {
             "ollama_online": False,
@@ -168,3 +678,124 @@ async def verifica_ollama() -> dict:
             "modello": MODEL_NAME,
             "modelli_installati": [],
         }
+
+
+# Frequenza del controllo in background e validit\u00e0 dell'ultimo esito (secondi)
+OLLAMA_STATUS_INTERVALLO = float(os.environ.get("OLLAMA_STATUS_INTERVAL", "15"))
+OLLAMA_STATUS_TTL = float(os.environ.get("OLLAMA_STATUS_TTL", "45"))
+
+
+class MonitorOllama:
+    """
+    Controlla Ollama in background e tiene l'ultimo esito in memoria.
+
+    L'endpoint di stato legge lo snapshot invece di aspettare una sonda (fino
+    a 10 s quando Ollama non risponde); lo storico delle sonde recenti fornisce
+    disponibilit\u00e0 e latenza media.
+    """
+
+    def __init__(
+        self,
+        intervallo: float = OLLAMA_STATUS_INTERVALLO,
+        ttl: float = OLLAMA_STATUS_TTL,
+        storico: int = 240,
+    ):
+        self.intervallo = intervallo
+        self.ttl = ttl
+        self.snapshot: dict | None = None
+        self._aggiornato = 0.0
+        self._storico: deque[tuple[float, bool, float]] = deque(maxlen=storico)
+        self._ultimi_modelli: list[str] = []
+        self._online_dal: float | None = None
+        self._task: asyncio.Task | None = None
+        self._sonda_in_corso: asyncio.Task | None = None
+
+    async def sonda(self) -> dict:
+        inizio = time.perf_counter()
+        esito = await _sonda_ollama()
+        latenza_ms = (time.perf_counter() - inizio) * 1000
+        adesso = time.time()
+
+        online = esito["ollama_online"]
+        self._storico.append((adesso, online, latenza_ms))
+        if online:
+            self._ultimi_modelli = esito["modelli_installati"]
+            if self._online_dal is None:
+                self._online_dal = adesso
+        else:
+            self._online_dal = None
+
+        self.snapshot = {
+            **esito,
+            "ultimi_modelli_visti": self._ultimi_modelli,
+            "controllato_alle": adesso,
+            "latenza_ms": round(latenza_ms, 1),
+        }
+        self._aggiornato = time.monotonic()
+        return self.snapshot
+
+    async def _ciclo(self) -> None:
+        while True:
+            await self.sonda()
+            await asyncio.sleep(self.intervallo)
+
+    def avvia(self) -> None:
+        if self._task is None:
+            self._task = asyncio.create_task(self._ciclo())
+
+    async def ferma(self) -> None:
+        for task in (self._task, self._sonda_in_corso):
+            if task is not None and not task.done():
+                task.cancel()
+                try:
+                    await task
+                except asyncio.CancelledError:
+                    pass
+        self._task = None
+        self._sonda_in_corso = None
+
+    async def stato(self) -> dict:
+        """
+        Ultimo esito noto, senza mai aspettare Ollama. Finch\u00e9 il ciclo in
+        background non pubblica il primo esito lo stato \u00e8 sconosciuto
+        (in_verifica=True); se \u00e8 scaduto si restituisce comunque (con
+        aggiornato=False) e la sonda riparte in background.
+        """
+        in_attesa = self.snapshot is None and self._task is not None and not self._task.done()
+        fresco = self.snapshot is not None and time.monotonic() - self._aggiornato <= self.ttl
+        if not fresco and not in_attesa and (self._sonda_in_corso is None or self._sonda_in_corso.done()):
+            self._sonda_in_corso = asyncio.create_task(self.sonda())
+        if self.snapshot is None:
+            return {
+                "ollama_online": False,
+                "modello_disponibile": False,
+                "modello": MODEL_NAME,
+                "modelli_installati": [],
+                "ultimi_modelli_visti": [],
+                "controllato_alle": None,
+                "latenza_ms": None,
+                "aggiornato": False,
+                "in_verifica": True,
+            }
+        return {**self.snapshot, "aggiornato": fresco, "in_verifica": False}
+
+    def statistiche(self) -> dict:
+        sonde = list(self._storico)
+        online = [s for s in sonde if s[1]]
+        return {
+            "sonde": len(sonde),
+            "disponibilita": round(len(online) / len(sonde), 4) if sonde else None,
+            "latenza_media_ms": round(sum(s[2] for s in sonde) / len(sonde), 1) if sonde else None,
+            "latenza_max_ms": round(max(s[2] for s in sonde), 1) if sonde else None,
+            "online_da_s": round(time.time() - self._online_dal, 1) if self._online_dal else 0.0,
+            "ultimo_online": max((s[0] for s in online), default=None),
+            "intervallo_s": self.intervallo,
+        }
+
+
+monitor_ollama = MonitorOllama()
+
+
+async def verifica_ollama() -> dict:
+    """Verifica che Ollama sia raggiungibile e il modello disponibile (dallo snapshot del monitor)."""
+    return await monitor_ollama.stato()
@@ -1,42 +1,186 @@
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Request
+from fastapi.responses import StreamingResponse
+import asyncio
 import json
-from database import get_db
+from database import get_db_lettura, get_pool
+from metriche import consulenze_cache
 from models import AdvisorRequest, AdvisorResponse
-from ollama_advisor import chiedi_consulenza, verifica_ollama
+from ollama_advisor import (
+    MODEL_NAME,
+    CodaPiena,
+    coda_ollama,
+    monitor_ollama,
+    chiedi_consulenza,
+    chiedi_consulenza_stream,
+    impronta_consulenza,
+    ricorda_risposta,
+    risposta_valida,
+    sessioni_consulenza,
+    verifica_ollama,
+)
 
 router = APIRouter(prefix="/api/advisor", tags=["advisor"])
 
 
 @router.get("/status")
 async def stato_advisor():
-    return await verifica_ollama()
+    return {
+        **await verifica_ollama(),
+        "coda": coda_ollama.stato(),
+        "monitor": monitor_ollama.statistiche(),
+        "sessioni": sessioni_consulenza.stato(),
+    }
+
+
+def _coda_piena() -> HTTPException:
+    return HTTPException(
+        status_code=503, detail="Il consulente \u00e8 occupato: troppe richieste in coda, riprova tra poco"
+    )
+
+
+async def _finche_connesso(http_request: Request, coro):
+    """Esegue `coro` ma lo annulla se il client chiude la connessione prima della fine."""
+    task = asyncio.ensure_future(coro)
+    try:
+        while True:
+            done, _ = await asyncio.wait({task}, timeout=0.5)
+            if done:
+                return task.result()
+            if await http_request.is_disconnected():
+                task.cancel()
+                raise HTTPException(status_code=499, detail="Richiesta annullata dal client")
+    finally:
+        if not task.done():
+            task.cancel()
 
 
 @router.post("/consulenza", response_model=AdvisorResponse)
-async def richiedi_consulenza(request: AdvisorRequest, db=Depends(get_db)):
-    placeholders = ",".join("?" for _ in request.mutuo_ids)
-    cursor = await db.execute(
-        f"SELECT * FROM mutui WHERE id IN ({placeholders})", request.mutuo_ids
+async def richiedi_consulenza(request: AdvisorRequest, http_request: Request):
+    mutui = await _carica_mutui(request.mutuo_ids)
+    impronta = impronta_consulenza(mutui, request.domanda)
+    in_cache = await _consulenza_in_cache(impronta)
+    if in_cache:
+        ricorda_risposta(mutui, request.domanda, in_cache[1])
+        return AdvisorResponse(risposta=in_cache[1], mutuo_ids=request.mutuo_ids, da_cache=True)
+
+    metadati = {}
+
+    async def genera():
+        async with coda_ollama.slot():
+            return await chiedi_consulenza(mutui, request.domanda, metadati)
+
+    try:
+        risposta = await _finche_connesso(http_request, genera())
+    except CodaPiena:
+        raise _coda_piena()
+    await _salva_consulenza(request, risposta, impronta)
+    return AdvisorResponse(risposta=risposta, mutuo_ids=request.mutuo_ids, metadati=metadati)
+
+
+@router.post("/consulenza/stream")
+async def richiedi_consulenza_stream(request: AdvisorRequest):
+    """
+    Consulenza in streaming (Server-Sent Events).
+
+    Ogni evento `data` contiene {"token": "..."} appena generato; a fine
+    risposta l'evento `fine` riporta l'id della consulenza salvata e i metadati. Mentre la
+    richiesta \u00e8 in coda arrivano eventi `coda` con la posizione. Se il client
+    si disconnette la generazione viene interrotta e non viene salvata. Una
+    risposta interrotta da un errore di Ollama finisce nello storico ma non
+    nella cache: si riusano solo le risposte arrivate fino al messaggio `done`.
+    """
+    mutui = await _carica_mutui(request.mutuo_ids)
+    impronta = impronta_consulenza(mutui, request.domanda)
+    in_cache = await _consulenza_in_cache(impronta)
+    if not in_cache and coda_ollama.piena:
+        raise _coda_piena()
+
+    async def eventi():
+        if in_cache:
+            consulenza_id, risposta = in_cache
+            ricorda_risposta(mutui, request.domanda, risposta)
+            yield f"data: {json.dumps({'token': risposta})}\n\n"
+            yield f"event: fine\ndata: {json.dumps({'id': consulenza_id, 'da_cache': True})}\n\n"
+            return
+        try:
+            prenotazione = coda_ollama.prenota()
+        except CodaPiena:
+            yield f"event: errore\ndata: {json.dumps({'detail': _coda_piena().detail})}\n\n"
+            return
+        parti = []
+        metadati = {}
+        try:
+            posizione = None
+            while not prenotazione.attiva:
+                if prenotazione.posizione != posizione:
+                    posizione = prenotazione.posizione
+                    yield f"event: coda\ndata: {json.dumps({'posizione': posizione})}\n\n"
+                await prenotazione.attendi(timeout=1.0)
+            async for token in chiedi_consulenza_stream(mutui, request.domanda, metadati):
+                parti.append(token)
+                yield f"data: {json.dumps({'token': token})}\n\n"
+        finally:
+            prenotazione.rilascia()
+        consulenza_id = await _salva_consulenza(
+            request, "".join(parti), impronta if metadati.get("completa") else None
+        )
+        fine = {'id': consulenza_id, 'da_cache': False, 'metadati': metadati}
+        yield f"event: fine\ndata: {json.dumps(fine)}\n\n"
+
+    return StreamingResponse(
+        eventi(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
     )
-    rows = await cursor.fetchall()
+
+
+async def _carica_mutui(mutuo_ids: list[int]) -> list[dict]:
+    # Le connessioni si prendono solo attorno alle query: la generazione pu\u00f2
+    # durare minuti e non deve tenere occupato il pool
+    async with get_pool().lettore() as db:
+        placeholders = ",".join("?" for _ in mutuo_ids)
+        cursor = await db.execute(
+            f"SELECT * FROM mutui WHERE id IN ({placeholders})", mutuo_ids
+        )
+        rows = await cursor.fetchall()
 
     if not rows:
         raise HTTPException(status_code=404, detail="Nessun mutuo trovato")
+    return [dict(r) for r in rows]
 
-    mutui = [dict(r) for r in rows]
-    risposta = await chiedi_consulenza(mutui, request.domanda)
 
-    await db.execute(
-        "INSERT INTO consulenze (mutuo_ids, domanda, risposta) VALUES (?, ?, ?)",
-        (json.dumps(request.mutuo_ids), request.domanda or "", risposta),
-    )
-    await db.commit()
+async def _consulenza_in_cache(impronta: str) -> tuple[int, str] | None:
+    """Ultima risposta salvata con la stessa impronta, se esiste."""
+    async with get_pool().lettore() as db:
+        cursor = await db.execute(
+            "SELECT id, risposta FROM consulenze WHERE fingerprint = ? ORDER BY id DESC LIMIT 1",
+            (impronta,),
+        )
+        row = await cursor.fetchone()
+    consulenze_cache.incrementa(esito="hit" if row else "miss")
+    return (row["id"], row["risposta"]) if row else None
+
 
-    return AdvisorResponse(risposta=risposta, mutuo_ids=request.mutuo_ids)
+async def _salva_consulenza(request: AdvisorRequest, risposta: str, impronta: str | None) -> int:
+    # Gli errori finiscono nello storico ma senza impronta, cos\u00ec non vengono riusati
+    async with get_pool().scrittore() as db:
+        cursor = await db.execute(
+            """INSERT INTO consulenze (mutuo_ids, domanda, risposta, fingerprint, modello)
+               VALUES (?, ?, ?, ?, ?)""",
+            (
+                json.dumps(request.mutuo_ids),
+                request.domanda or "",
+                risposta,
+                impronta if risposta_valida(risposta) else None,
+                MODEL_NAME,
+            ),
+        )
+        await db.commit()
+        return cursor.lastrowid
 
 
 @router.get("/storico")
-async def storico_consulenze(db=Depends(get_db)):
+async def storico_consulenze(db=Depends(get_db_lettura)):
     cursor = await db.execute(
         "SELECT * FROM consulenze ORDER BY created_at DESC LIMIT 50"
     )
@@ -1,13 +1,18 @@
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Query
 import aiosqlite
-from database import get_db
-from mortgage_engine import confronta_mutui
+import numpy as np
+from database import get_db_lettura
+from models import TipoTasso
+from mortgage_engine import COLONNE_PUNTEGGIO, calcola_punteggi, confronta_mutui, indici_migliori
 
 router = APIRouter(prefix="/api/confronto", tags=["confronto"])
 
+# Righe lette e valutate per volta dalla classifica sull'intera tabella
+TOP_BLOCCO = 5000
+
 
 @router.post("/")
-async def confronta(mutuo_ids: list[int], db=Depends(get_db)):
+async def confronta(mutuo_ids: list[int], db=Depends(get_db_lettura)):
     if len(mutuo_ids) < 2:
         raise HTTPException(status_code=400, detail="Servono almeno 2 mutui per il confronto")
 
@@ -24,3 +29,68 @@ async def confronta(mutuo_ids: list[int], db=Depends(get_db)):
     risultato = confronta_mutui(mutui)
     risultato["mutui"] = mutui
     return risultato
+
+
+@router.get("/top")
+async def classifica_top(
+    k: int = Query(10, ge=1, le=1000),
+    banca: str | None = None,
+    tipo_tasso: TipoTasso | None = None,
+    verificato: bool | None = None,
+    db=Depends(get_db_lettura),
+):
+    """
+    I migliori `k` mutui di tutta la tabella (o di quelli che passano i filtri).
+
+    I punteggi sono ricalcolati a blocchi in forma colonnare dai dati di ogni
+    riga, quindi non dipendono dal punteggio salvato; dopo ogni blocco restano
+    in memoria solo i k migliori. A pari punteggio vince l'id pi\u00f9 basso.
+    """
+    filtri, params = [], []
+    for condizione, valore in (
+        ("banca = ?", banca),
+        ("tipo_tasso = ?", tipo_tasso.value if tipo_tasso else None),
+        ("verificato = ?", None if verificato is None else int(verificato)),
+    ):
+        if valore is not None:
+            filtri.append(condizione)
+            params.append(valore)
+
+    colonne = ("id", *COLONNE_PUNTEGGIO)
+    query = (
+        f"SELECT {', '.join(colonne)} FROM mutui WHERE "
+        + " AND ".join(filtri + ["id > ?"])
+        + " ORDER BY id LIMIT ?"
+    )
+    migliori_id = np.empty(0, dtype=np.int64)
+    migliori_punteggi = np.empty(0)
+    totale = 0
+    ultimo_id = 0
+    while True:
+        cursor = await db.execute(query, (*params, ultimo_id, TOP_BLOCCO))
+        rows = await cursor.fetchall()
+        if not rows:
+            break
+        blocco = {nome: [r[nome] for r in rows] for nome in colonne}
+        # I migliori finora precedono il blocco e hanno id minori: l'ordine
+        # degli indici conserva lo spareggio per id
+        ids = np.concatenate([migliori_id, np.asarray(blocco["id"], dtype=np.int64)])
+        punteggi = np.concatenate([migliori_punteggi, calcola_punteggi(blocco)])
+        scelti = indici_migliori(punteggi, k)
+        migliori_id, migliori_punteggi = ids[scelti], punteggi[scelti]
+        totale += len(rows)
+        ultimo_id = blocco["id"][-1]
+
+    if not totale:
+        return {**confronta_mutui([]), "totale": 0, "mutui": []}
+
+    ordine = migliori_id.tolist()
+    placeholders = ",".join("?" for _ in ordine)
+    cursor = await db.execute(f"SELECT * FROM mutui WHERE id IN ({placeholders})", ordine)
+    per_id = {r["id"]: dict(r) for r in await cursor.fetchall()}
+    mutui = [per_id[i] for i in ordine]
+
+    risultato = confronta_mutui(mutui)
+    risultato["totale"] = totale
+    risultato["mutui"] = mutui
+    return risultato
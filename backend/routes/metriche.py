@@ -0,0 +1,80 @@
+from fastapi import APIRouter
+from fastapi.responses import PlainTextResponse
+from database import get_pool
+from metriche import registro
+from mortgage_engine import statistiche_cache
+from ollama_advisor import coda_ollama, monitor_ollama, sessioni_consulenza
+
+router = APIRouter(prefix="/api/metrics", tags=["metriche"])
+
+TIPO_CONTENUTO = "text/plain; version=0.0.4; charset=utf-8"
+
+
+@registro.raccoglitore
+def _cache_motore():
+    statistiche = statistiche_cache()
+    return [
+        (f"motore_cache_{nome}_total", "counter", descrizione, [
+            ({"funzione": funzione}, s[chiave]) for funzione, s in statistiche.items()
+        ])
+        for nome, chiave, descrizione in (
+            ("hits", "hits", "Chiamate servite dalla cache LRU del motore"),
+            ("misses", "misses", "Chiamate calcolate (non in cache) dal motore"),
+        )
+    ] + [
+        ("motore_cache_voci", "gauge", "Voci presenti nella cache LRU del motore", [
+            ({"funzione": funzione}, s["dimensione"]) for funzione, s in statistiche.items()
+        ]),
+    ]
+
+
+@registro.raccoglitore
+def _pool_database():
+    try:
+        stato = get_pool().stato()
+    except RuntimeError:
+        return []
+    return [
+        ("db_lettori_liberi", "gauge", "Connessioni di lettura libere nel pool", [
+            ({}, stato["lettori_liberi"]),
+        ]),
+        ("db_acquisizioni_total", "counter", "Connessioni prese dal pool", [
+            ({"tipo": "lettura"}, stato["acquisizioni_lettura"]),
+            ({"tipo": "scrittura"}, stato["acquisizioni_scrittura"]),
+        ]),
+        ("db_attesa_secondi_total", "counter", "Tempo totale di attesa di una connessione", [
+            ({"tipo": "lettura"}, stato["attesa_lettura_s"]),
+            ({"tipo": "scrittura"}, stato["attesa_scrittura_s"]),
+        ]),
+        ("db_rollback_total", "counter", "Transazioni annullate al rilascio dello scrittore", [
+            ({}, stato["rollback"]),
+        ]),
+    ]
+
+
+@registro.raccoglitore
+def _consulente():
+    coda = coda_ollama.stato()
+    monitor = monitor_ollama.statistiche()
+    return [
+        ("ollama_coda", "gauge", "Consulenze in generazione e in attesa", [
+            ({"stato": "attive"}, coda["attive"]),
+            ({"stato": "in_attesa"}, coda["in_attesa"]),
+        ]),
+        ("ollama_coda_total", "counter", "Consulenze servite o rifiutate dalla coda", [
+            ({"esito": "servite"}, coda["servite"]),
+            ({"esito": "rifiutate"}, coda["rifiutate"]),
+        ]),
+        ("ollama_disponibilita", "gauge", "Quota delle sonde recenti con Ollama raggiungibile", [
+            ({}, monitor["disponibilita"]),
+        ]),
+        ("consulenze_sessioni", "gauge", "Conversazioni ricordate per le domande successive", [
+            ({}, sessioni_consulenza.stato()["sessioni"]),
+        ]),
+    ]
+
+
+@router.get("", response_class=PlainTextResponse)
+async def metriche():
+    """Metriche del server in formato testuale Prometheus."""
+    return PlainTextResponse(registro.esponi(), media_type=TIPO_CONTENUTO)
@@ -1,19 +1,38 @@
-from fastapi import APIRouter, Depends, HTTPException
-from fastapi.responses import JSONResponse
+from fastapi import APIRouter, Depends, HTTPException, Query, Request
+from fastapi.responses import StreamingResponse
 import aiosqlite
+import base64
+from pydantic import ValidationError
 import json
-from models import MutuoCreate, MutuoUpdate, MutuoResponse
-from database import get_db
+import logging
+import time
+import zlib
+from models import MutuoCreate, MutuoUpdate, MutuoResponse, TipoTasso
+from database import PoolConnessioni, get_db, get_db_lettura, get_pool
+from ammortamento import leggi_piano, salva_piani, spacchetta_piano
+from eurirs import CHIAVE_EURIRS, aggiorna_spread, allinea_spread, registra_eurirs
 from mortgage_engine import (
     calcola_rata_mensile,
     calcola_totale_interessi,
     calcola_costo_totale,
     calcola_ltv,
     calcola_punteggio,
+    riepilogo_annuale,
+    debito_residuo_al_mese,
+    capitale_rimborsato_al_mese,
+    interessi_cumulati_al_mese,
+    tolleranza_arrotondamento,
+    statistiche_cache,
+    svuota_cache,
+    calcola_metriche,
     calcola_piano_ammortamento,
+    calcola_taeg_mutuo,
+    SPESE_ACCESSORIE,
+    TAEG_TOLLERANZA,
 )
 
 router = APIRouter(prefix="/api/mutui", tags=["mutui"])
+logger = logging.getLogger(__name__)
 
 
 def _row_to_dict(row: aiosqlite.Row) -> dict:
@@ -36,6 +55,9 @@ async def crea_mutuo(mutuo: MutuoCreate, db=Depends(get_db)):
     data["ltv"] = ltv
     data["totale_interessi"] = totale_interessi
     data["costo_totale"] = costo_totale
+    data["taeg_calcolato"] = calcola_taeg_mutuo(
+        mutuo.importo, rata, mutuo.durata_anni, sum(data[nome] for nome in SPESE_ACCESSORIE)
+    )
     data["punteggio"] = calcola_punteggio(data)
 
     cursor = await db.execute(
@@ -43,17 +65,19 @@ async def crea_mutuo(mutuo: MutuoCreate, db=Depends(get_db)):
             banca, tipo_tasso, tan, taeg, spread, importo, valore_immobile,
             durata_anni, rata_mensile, spese_istruttoria, spese_perizia,
             costo_assicurazione, spese_notarili, altre_spese, note,
-            ltv, costo_totale, totale_interessi, punteggio
+            ltv, costo_totale, totale_interessi, taeg_calcolato, punteggio
         ) VALUES (
             :banca, :tipo_tasso, :tan, :taeg, :spread, :importo, :valore_immobile,
             :durata_anni, :rata_mensile, :spese_istruttoria, :spese_perizia,
             :costo_assicurazione, :spese_notarili, :altre_spese, :note,
-            :ltv, :costo_totale, :totale_interessi, :punteggio
+            :ltv, :costo_totale, :totale_interessi, :taeg_calcolato, :punteggio
         )""",
         data,
     )
-    await db.commit()
     mutuo_id = cursor.lastrowid
+    await aggiorna_spread(db, mutuo_id, mutuo_id)
+    await salva_piani(db, [(mutuo_id, mutuo.importo, mutuo.tan, mutuo.durata_anni)])
+    await db.commit()
 
     row = await db.execute("SELECT * FROM mutui WHERE id = ?", (mutuo_id,))
     result = await row.fetchone()
@@ -61,78 +85,577 @@ async def crea_mutuo(mutuo: MutuoCreate, db=Depends(get_db)):
 
 
 @router.get("/", response_model=list[MutuoResponse])
-async def lista_mutui(db=Depends(get_db)):
+async def lista_mutui(db=Depends(get_db_lettura)):
     cursor = await db.execute("SELECT * FROM mutui ORDER BY punteggio DESC")
     rows = await cursor.fetchall()
     return [dict(r) for r in rows]
 
 
+# Dimensione massima di una pagina della lista
+LISTA_LIMITE_MAX = 500
+
+_CAMPI_MUTUO = tuple(MutuoResponse.model_fields)
+
+
+def _codifica_cursore(punteggio: float | None, mutuo_id: int) -> str:
+    return base64.urlsafe_b64encode(json.dumps([punteggio, mutuo_id]).encode()).decode()
+
+
+def _decodifica_cursore(cursore: str) -> tuple[float | None, int]:
+    try:
+        punteggio, mutuo_id = json.loads(base64.urlsafe_b64decode(cursore.encode()))
+        return (None if punteggio is None else float(punteggio)), int(mutuo_id)
+    except (ValueError, TypeError):
+        raise HTTPException(status_code=422, detail="Cursore non valido")
+
+
+@router.get("/pagina")
+async def pagina_mutui(
+    limite: int = Query(50, ge=1, le=LISTA_LIMITE_MAX),
+    cursore: str | None = None,
+    banca: str | None = None,
+    tipo_tasso: TipoTasso | None = None,
+    tan_min: float | None = None,
+    tan_max: float | None = None,
+    durata_min: int | None = None,
+    durata_max: int | None = None,
+    verificato: bool | None = None,
+    campi: str | None = None,
+    db=Depends(get_db_lettura),
+):
+    """
+    Lista paginata dei mutui per punteggio decrescente (keyset su punteggio, id).
+
+    `cursore` \u00e8 quello restituito dalla pagina precedente; `campi` limita le
+    colonne restituite (id e punteggio sono sempre inclusi). I mutui senza
+    punteggio seguono tutti gli altri. La prima pagina (senza cursore) porta
+    anche il `riepilogo` dei mutui filtrati: quanti sono, rata e TAN minimi.
+
+    banca, tipo_tasso e verificato hanno un indice composto con punteggio; i
+    filtri a intervallo su TAN e durata no: un indice (tan, punteggio) non
+    darebbe l'ordine per punteggio su un intervallo di TAN. Vengono applicati
+    scorrendo l'indice su punteggio, quindi un intervallo che esclude quasi
+    tutti i mutui legge gran parte dell'indice prima di riempire la pagina.
+    """
+    if campi:
+        scelti = [c.strip() for c in campi.split(",") if c.strip()]
+        sconosciuti = [c for c in scelti if c not in _CAMPI_MUTUO]
+        if sconosciuti:
+            raise HTTPException(status_code=422, detail=f"Campi sconosciuti: {', '.join(sconosciuti)}")
+        colonne = ["id", "punteggio"] + [c for c in scelti if c not in ("id", "punteggio")]
+    else:
+        colonne = list(_CAMPI_MUTUO)
+
+    filtri, params = [], []
+    for condizione, valore in (
+        ("banca = ?", banca),
+        ("tipo_tasso = ?", tipo_tasso.value if tipo_tasso else None),
+        ("tan >= ?", tan_min),
+        ("tan <= ?", tan_max),
+        ("durata_anni >= ?", durata_min),
+        ("durata_anni <= ?", durata_max),
+        ("verificato = ?", None if verificato is None else int(verificato)),
+    ):
+        if valore is not None:
+            filtri.append(condizione)
+            params.append(valore)
+
+    ultimo = _decodifica_cursore(cursore) if cursore else None
+    select = f"SELECT {', '.join(colonne)} FROM mutui WHERE "
+    rows = []
+
+    # Prima i mutui con punteggio, poi (se la pagina non \u00e8 piena) quelli senza:
+    # due range separati, cos\u00ec entrambi scorrono l'indice su punteggio
+    if ultimo is None or ultimo[0] is not None:
+        condizioni = filtri + ["punteggio IS NOT NULL"]
+        valori = list(params)
+        if ultimo is not None:
+            condizioni.append("punteggio <= ? AND (punteggio < ? OR id < ?)")
+            valori += [ultimo[0], ultimo[0], ultimo[1]]
+        cursor = await db.execute(
+            select + " AND ".join(condizioni) + " ORDER BY punteggio DESC, id DESC LIMIT ?",
+            valori + [limite + 1],
+        )
+        rows = list(await cursor.fetchall())
+    if len(rows) <= limite:
+        condizioni = filtri + ["punteggio IS NULL"]
+        valori = list(params)
+        if ultimo is not None and ultimo[0] is None:
+            condizioni.append("id < ?")
+            valori.append(ultimo[1])
+        cursor = await db.execute(
+            select + " AND ".join(condizioni) + " ORDER BY id DESC LIMIT ?",
+            valori + [limite + 1 - len(rows)],
+        )
+        rows += await cursor.fetchall()
+
+    mutui = [dict(r) for r in rows[:limite]]
+    for m in mutui:
+        if "verificato" in m:
+            m["verificato"] = bool(m["verificato"])
+    prossimo = None
+    if len(rows) > limite:
+        prossimo = _codifica_cursore(mutui[-1]["punteggio"], mutui[-1]["id"])
+    pagina = {"mutui": mutui, "cursore": prossimo}
+    if ultimo is None:
+        cursor = await db.execute(
+            "SELECT COUNT(*) AS totale, MIN(rata_mensile) AS rata_min, MIN(tan) AS tan_min "
+            f"FROM mutui{' WHERE ' + ' AND '.join(filtri) if filtri else ''}",
+            params,
+        )
+        pagina["riepilogo"] = dict(await cursor.fetchone())
+    return pagina
+
+
+# Righe lette per pagina durante l'esportazione in streaming
+EXPORT_BLOCCO = 500
+
+
+async def _pagine_mutui(pool: PoolConnessioni, blocco: int = EXPORT_BLOCCO):
+    """
+    Scorre la tabella mutui a pagine per id, senza tenerla tutta in memoria.
+
+    Il lettore del pool si prende per una pagina alla volta e si rilascia
+    prima di consegnarla: un client lento a scaricare non tiene occupata una
+    connessione. Si riparte dall'ultimo id, quindi ogni mutuo esce una volta
+    sola anche se la tabella cambia durante l'esportazione.
+    """
+    ultimo_id = 0
+    while True:
+        async with pool.lettore() as db:
+            cursor = await db.execute(
+                "SELECT * FROM mutui WHERE id > ? ORDER BY id LIMIT ?", (ultimo_id, blocco)
+            )
+            rows = [dict(r) for r in await cursor.fetchall()]
+        if not rows:
+            return
+        yield rows
+        ultimo_id = rows[-1]["id"]
+
+
+async def _leggi_settings(pool: PoolConnessioni) -> dict:
+    async with pool.lettore() as db:
+        cursor = await db.execute("SELECT * FROM settings")
+        return {r["key"]: r["value"] for r in await cursor.fetchall()}
+
+
+async def _esporta_json():
+    pool = get_pool()
+    settings = await _leggi_settings(pool)
+    yield '{"mutui": ['
+    separatore = ""
+    async for pagina in _pagine_mutui(pool):
+        yield separatore + ", ".join(json.dumps(m) for m in pagina)
+        separatore = ", "
+    yield '], "settings": ' + json.dumps(settings) + "}"
+
+
+async def _esporta_ndjson():
+    pool = get_pool()
+    settings = await _leggi_settings(pool)
+    yield json.dumps({"tipo": "settings", "dati": settings}) + "\n"
+    async for pagina in _pagine_mutui(pool):
+        yield "".join(json.dumps({"tipo": "mutuo", "dati": m}) + "\n" for m in pagina)
+
+
+async def _comprimi_gzip(parti):
+    compressore = zlib.compressobj(6, zlib.DEFLATED, 31)
+    async for parte in parti:
+        dati = compressore.compress(parte.encode())
+        if dati:
+            yield dati
+    yield compressore.flush()
+
+
 @router.get("/export/all")
-async def esporta_dati(db=Depends(get_db)):
-    """Esporta tutti i mutui e le impostazioni come JSON."""
-    cursor = await db.execute("SELECT * FROM mutui ORDER BY id")
-    mutui = [dict(r) for r in await cursor.fetchall()]
-    cursor = await db.execute("SELECT * FROM settings")
-    settings = {r["key"]: r["value"] for r in await cursor.fetchall()}
-    return JSONResponse({"mutui": mutui, "settings": settings})
+async def esporta_dati(
+    formato: str = Query("json", pattern="^(json|ndjson)$"),
+    gzip: bool = False,
+):
+    """
+    Esporta tutti i mutui e le impostazioni.
+
+    L'esportazione \u00e8 in streaming: `json` produce lo stesso documento
+    {"mutui": [...], "settings": {...}} di sempre, `ndjson` un record per riga
+    ({"tipo": "settings"|"mutuo", "dati": ...}). Con `gzip=true` lo stream
+    viene compresso al volo.
+    """
+    if formato == "ndjson":
+        parti, media_type, estensione = _esporta_ndjson(), "application/x-ndjson", "ndjson"
+    else:
+        parti, media_type, estensione = _esporta_json(), "application/json", "json"
+
+    if not gzip:
+        return StreamingResponse(parti, media_type=media_type)
+    return StreamingResponse(
+        _comprimi_gzip(parti),
+        media_type="application/gzip",
+        headers={
+            "Content-Disposition": f'attachment; filename="bancadvisor.{estensione}.gz"'
+        },
+    )
+
+
+# Righe validate e inserite per transazione durante l'importazione
+IMPORT_BLOCCO = 5000
+# Errori riportati in dettaglio (gli altri vengono solo contati)
+IMPORT_MAX_ERRORI = 1000
+
+_COLONNE_IMPORT = tuple(MutuoCreate.model_fields) + (
+    "rata_mensile", "ltv", "totale_interessi", "costo_totale", "taeg_calcolato", "punteggio",
+    "verificato",
+)
+
+
+class _Importatore:
+    """
+    Valida, calcola e inserisce mutui a blocchi.
+
+    Ogni riga passa da MutuoCreate; quelle valide si accumulano finch\u00e9 il blocco
+    \u00e8 pieno, poi i campi derivati sono calcolati in forma vettoriale e il blocco
+    \u00e8 inserito con un executemany in una transazione. La connessione di
+    scrittura si prende dal pool solo per scrivere il blocco: mentre il client
+    invia il resto del corpo le altre scritture non aspettano.
+    """
+
+    def __init__(self, pool: PoolConnessioni, blocco: int = IMPORT_BLOCCO):
+        self.pool = pool
+        self.blocco = blocco
+        self.righe: list[dict] = []
+        self.importati = 0
+        self.scartati = 0
+        self.errori: list[dict] = []
+        self.inizio = time.perf_counter()
+
+    async def aggiungi(self, numero: int, dati) -> None:
+        try:
+            mutuo = MutuoCreate.model_validate(dati)
+        except ValidationError as e:
+            self.segnala_errore(numero, [
+                f"{'.'.join(str(p) for p in err['loc'])}: {err['msg']}" if err["loc"] else err["msg"]
+                for err in e.errors()
+            ])
+            return
+        riga = mutuo.model_dump(mode="json")
+        riga["verificato"] = 1 if isinstance(dati, dict) and dati.get("verificato") else 0
+        self.righe.append(riga)
+        if len(self.righe) >= self.blocco:
+            await self.scrivi()
+
+    def segnala_errore(self, numero: int, messaggi: list[str]) -> None:
+        self.scartati += 1
+        if len(self.errori) < IMPORT_MAX_ERRORI:
+            self.errori.append({"riga": numero, "errori": messaggi})
+
+    async def scrivi(self) -> None:
+        if not self.righe:
+            return
+        colonne = _colonne(self.righe, MutuoCreate.model_fields)
+        metriche = calcola_metriche(colonne)
+        for nome, valori in metriche.items():
+            colonne[nome] = valori.tolist()
+        colonne["verificato"] = [r["verificato"] for r in self.righe]
+        async with self.pool.scrittore() as db:
+            cursor = await db.execute("SELECT COALESCE(MAX(id), 0) FROM mutui")
+            ultimo_id = (await cursor.fetchone())[0]
+            await db.executemany(
+                f"INSERT INTO mutui ({', '.join(_COLONNE_IMPORT)}) "
+                f"VALUES ({', '.join('?' for _ in _COLONNE_IMPORT)})",
+                zip(*(colonne[nome] for nome in _COLONNE_IMPORT)),
+            )
+            await aggiorna_spread(db, ultimo_id + 1)
+            await db.commit()
+        self.importati += len(self.righe)
+        logger.info("Importazione: %d mutui inseriti", self.importati)
+        self.righe = []
+
+    async def salva_settings(self, settings: dict) -> None:
+        settings = dict(settings)
+        eurirs = settings.pop(CHIAVE_EURIRS, None)
+        async with self.pool.scrittore() as db:
+            if eurirs is not None:
+                try:
+                    valore = float(eurirs)
+                except (TypeError, ValueError):
+                    self.segnala_errore(0, [f"{CHIAVE_EURIRS}: non \u00e8 un numero"])
+                else:
+                    await registra_eurirs(db, valore)
+                    await allinea_spread(db)
+            await db.executemany(
+                """INSERT INTO settings (key, value, updated_at)
+                   VALUES (:key, :val, CURRENT_TIMESTAMP)
+                   ON CONFLICT(key) DO UPDATE SET value=:val, updated_at=CURRENT_TIMESTAMP""",
+                [{"key": key, "val": str(value)} for key, value in settings.items()],
+            )
+            await db.commit()
+
+    def riepilogo(self) -> dict:
+        secondi = time.perf_counter() - self.inizio
+        return {
+            "importati": self.importati,
+            "scartati": self.scartati,
+            "errori": self.errori,
+            "secondi": round(secondi, 3),
+            "righe_al_secondo": round(self.importati / secondi, 1) if secondi > 0 else 0.0,
+        }
+
+
+async def _importa_documento(importatore: _Importatore, data) -> None:
+    """
+    Importa un documento JSON: l'export {"mutui", "settings"} o una lista di mutui.
+
+    La struttura si controlla prima di scrivere qualunque cosa: `mutui` deve
+    essere una lista di oggetti e `settings` un oggetto, altrimenti 422 con il
+    percorso dell'elemento sbagliato.
+    """
+    if isinstance(data, list):
+        mutui, settings, percorso = data, {}, ""
+    elif isinstance(data, dict):
+        mutui, settings, percorso = data.get("mutui", []), data.get("settings", {}), "mutui"
+    else:
+        raise HTTPException(status_code=422, detail="Formato di importazione non valido")
+    if not isinstance(mutui, list):
+        raise HTTPException(status_code=422, detail=f"{percorso or 'documento'}: serve una lista di mutui")
+    for indice, m in enumerate(mutui):
+        if not isinstance(m, dict):
+            raise HTTPException(status_code=422, detail=f"{percorso}[{indice}]: serve un oggetto")
+    if not isinstance(settings, dict):
+        raise HTTPException(status_code=422, detail="settings: serve un oggetto")
+    for numero, m in enumerate(mutui, 1):
+        await importatore.aggiungi(numero, m)
+    await importatore.scrivi()
+    if settings:
+        await importatore.salva_settings(settings)
+
+
+async def _decomprimi_gzip(chunks):
+    decompressore = zlib.decompressobj(47)
+    async for chunk in chunks:
+        dati = decompressore.decompress(chunk)
+        if dati:
+            yield dati
+    yield decompressore.flush()
+
+
+async def _righe_ndjson(chunks):
+    resto = b""
+    async for chunk in chunks:
+        resto += chunk
+        *righe, resto = resto.split(b"\n")
+        for riga in righe:
+            yield riga
+    if resto:
+        yield resto
+
+
+async def _importa_ndjson(importatore: _Importatore, chunks) -> None:
+    """Importa righe NDJSON: record {"tipo", "dati"} come da export, oppure mutui semplici."""
+    numero = 0
+    async for riga in _righe_ndjson(chunks):
+        numero += 1
+        if not riga.strip():
+            continue
+        try:
+            record = json.loads(riga)
+        except ValueError:
+            importatore.segnala_errore(numero, ["JSON non valido"])
+            continue
+        if isinstance(record, dict) and record.get("tipo") == "settings":
+            if isinstance(record.get("dati") or {}, dict):
+                await importatore.salva_settings(record.get("dati") or {})
+            else:
+                importatore.segnala_errore(numero, ["dati: serve un oggetto"])
+        elif isinstance(record, dict) and record.get("tipo") == "mutuo":
+            await importatore.aggiungi(numero, record.get("dati"))
+        else:
+            await importatore.aggiungi(numero, record)
+    await importatore.scrivi()
 
 
 @router.post("/import/all")
-async def importa_dati(data: dict, db=Depends(get_db)):
+async def importa_dati(data: dict):
     """Importa mutui e impostazioni da JSON esportato."""
-    mutui = data.get("mutui", [])
-    settings = data.get("settings", {})
+    importatore = _Importatore(get_pool())
+    await _importa_documento(importatore, data)
+    return importatore.riepilogo()
+
+
+@router.post("/import/bulk")
+async def importa_bulk(
+    request: Request,
+    blocco: int = Query(IMPORT_BLOCCO, ge=1, le=50000),
+):
+    """
+    Importazione massiva in streaming.
+
+    Accetta NDJSON (application/x-ndjson, anche l'export con formato=ndjson) o
+    JSON, eventualmente compressi gzip. Le righe non valide vengono scartate e
+    riportate con il loro numero.
+    """
+    chunks = request.stream()
+    if request.headers.get("content-encoding") == "gzip":
+        chunks = _decomprimi_gzip(chunks)
+
+    importatore = _Importatore(get_pool(), blocco)
+    content_type = request.headers.get("content-type", "")
+    try:
+        if "ndjson" in content_type or "jsonl" in content_type:
+            await _importa_ndjson(importatore, chunks)
+        else:
+            corpo = b"".join([chunk async for chunk in chunks])
+            try:
+                data = json.loads(corpo)
+            except ValueError:
+                raise HTTPException(status_code=422, detail="JSON non valido")
+            await _importa_documento(importatore, data)
+    except zlib.error:
+        raise HTTPException(status_code=422, detail="Contenuto gzip non valido")
+    return importatore.riepilogo()
+
+
+# Righe lette, ricalcolate e riscritte per transazione
+RICALCOLA_BLOCCO = 2000
+
+_COLONNE_CALCOLO = (
+    "id", "importo", "tan", "taeg", "durata_anni", "valore_immobile",
+    "spese_istruttoria", "spese_perizia", "costo_assicurazione",
+    "spese_notarili", "altre_spese",
+)
+
+_stato_ricalcolo: dict = {"in_corso": False}
+
+
+def _colonne(rows, nomi) -> dict[str, list]:
+    return {nome: [r[nome] for r in rows] for nome in nomi}
+
+
+async def _ricalcola_blocchi(pool: PoolConnessioni, blocco: int) -> dict:
+    """
+    Ricalcola i campi derivati di tutti i mutui a blocchi di `blocco` righe.
+
+    Ogni blocco \u00e8 letto per id crescente, calcolato in forma vettoriale e
+    riscritto con un solo executemany in una transazione propria. La
+    connessione di scrittura si prende dal pool per un blocco alla volta: tra
+    un blocco e l'altro passano le altre scritture, e un mutuo modificato nel
+    frattempo viene comunque ricalcolato dai valori salvati.
+
+    Un solo ricalcolo alla volta: se ce n'\u00e8 gi\u00e0 uno in corso risponde 409.
+    """
+    # Controllo e prenotazione senza await in mezzo: nessun'altra richiesta
+    # pu\u00f2 passare tra i due
+    if _stato_ricalcolo["in_corso"]:
+        raise HTTPException(status_code=409, detail="Ricalcolo gi\u00e0 in corso")
+    _stato_ricalcolo.update(in_corso=True, totale=None, ricalcolati=0, righe_al_secondo=0.0)
+    inizio = time.perf_counter()
+
+    ultimo_id = 0
     count = 0
-    for m in mutui:
-        m.pop("id", None)
-        m.pop("created_at", None)
-        m.pop("updated_at", None)
-        cols = [k for k in m.keys()]
-        placeholders = ", ".join(f":{k}" for k in cols)
-        col_names = ", ".join(cols)
-        await db.execute(f"INSERT INTO mutui ({col_names}) VALUES ({placeholders})", m)
-        count += 1
-    for key, value in settings.items():
-        await db.execute(
-            """INSERT INTO settings (key, value, updated_at)
-               VALUES (:key, :val, CURRENT_TIMESTAMP)
-               ON CONFLICT(key) DO UPDATE SET value=:val, updated_at=CURRENT_TIMESTAMP""",
-            {"key": key, "val": value},
-        )
-    await db.commit()
-    return {"importati": count}
+    blocchi = 0
+    try:
+        async with pool.lettore() as db:
+            cursor = await db.execute("SELECT COUNT(*) FROM mutui")
+            totale = (await cursor.fetchone())[0]
+        _stato_ricalcolo["totale"] = totale
+        while True:
+            # Lettura e scrittura dello stesso blocco sotto lo stesso lock: nessuna
+            # modifica pu\u00f2 inserirsi tra i valori letti e quelli riscritti
+            async with pool.scrittore() as db:
+                cursor = await db.execute(
+                    f"SELECT {', '.join(_COLONNE_CALCOLO)} FROM mutui WHERE id > ? ORDER BY id LIMIT ?",
+                    (ultimo_id, blocco),
+                )
+                rows = await cursor.fetchall()
+                if not rows:
+                    break
+
+                colonne = _colonne(rows, _COLONNE_CALCOLO)
+                metriche = calcola_metriche(colonne)
+                await db.executemany(
+                    """UPDATE mutui SET rata_mensile=?, ltv=?, totale_interessi=?,
+                       costo_totale=?, taeg_calcolato=?, punteggio=? WHERE id=?""",
+                    zip(
+                        metriche["rata_mensile"].tolist(),
+                        metriche["ltv"].tolist(),
+                        metriche["totale_interessi"].tolist(),
+                        metriche["costo_totale"].tolist(),
+                        # NaN (TAEG non calcolabile) diventa NULL in SQLite
+                        metriche["taeg_calcolato"].tolist(),
+                        metriche["punteggio"].tolist(),
+                        colonne["id"],
+                    ),
+                )
+                await db.commit()
+
+            count += len(rows)
+            blocchi += 1
+            ultimo_id = colonne["id"][-1]
+            secondi = time.perf_counter() - inizio
+            velocita = count / secondi if secondi > 0 else 0.0
+            _stato_ricalcolo.update(ricalcolati=count, righe_al_secondo=round(velocita, 1))
+            logger.info("Ricalcolo: %d/%d mutui (%.0f righe/s)", count, totale, velocita)
+        async with pool.scrittore() as db:
+            await aggiorna_spread(db, 0)
+            await db.commit()
+    finally:
+        _stato_ricalcolo["in_corso"] = False
+
+    secondi = time.perf_counter() - inizio
+    return {
+        "ricalcolati": count,
+        "blocchi": blocchi,
+        "secondi": round(secondi, 3),
+        "righe_al_secondo": round(count / secondi, 1) if secondi > 0 else 0.0,
+    }
 
 
 @router.post("/ricalcola", status_code=200)
-async def ricalcola_punteggi(db=Depends(get_db)):
-    """Ricalcola rata, interessi, costo totale e punteggio per tutti i mutui."""
-    cursor = await db.execute("SELECT * FROM mutui")
-    rows = await cursor.fetchall()
-    count = 0
-    for row in rows:
-        m = dict(row)
-        m["rata_mensile"] = calcola_rata_mensile(m["importo"], m["tan"], m["durata_anni"])
-        m["ltv"] = calcola_ltv(m["importo"], m["valore_immobile"])
-        m["totale_interessi"] = calcola_totale_interessi(m["importo"], m["tan"], m["durata_anni"])
-        m["costo_totale"] = calcola_costo_totale(
-            m["importo"], m["tan"], m["durata_anni"],
-            m["spese_istruttoria"], m["spese_perizia"],
-            m["costo_assicurazione"], m["spese_notarili"], m["altre_spese"],
-        )
-        m["punteggio"] = calcola_punteggio(m)
-        await db.execute(
-            """UPDATE mutui SET rata_mensile=:rata_mensile, ltv=:ltv,
-               totale_interessi=:totale_interessi, costo_totale=:costo_totale,
-               punteggio=:punteggio WHERE id=:id""",
-            m,
-        )
-        count += 1
-    await db.commit()
-    return {"ricalcolati": count}
+async def ricalcola_punteggi(blocco: int = Query(RICALCOLA_BLOCCO, ge=1, le=50000)):
+    """
+    Ricalcola rata, interessi, costo totale, TAEG, punteggio e spread Eurirs per
+    tutti i mutui. 409 se un ricalcolo \u00e8 gi\u00e0 in corso (avanzamento in
+    /ricalcola/stato).
+    """
+    return await _ricalcola_blocchi(get_pool(), blocco)
+
+
+@router.get("/ricalcola/stato")
+async def stato_ricalcolo():
+    """Avanzamento dell'ultimo ricalcolo (righe elaborate e velocit\u00e0)."""
+    return _stato_ricalcolo
+
+
+@router.get("/taeg/discordanze")
+async def discordanze_taeg(
+    tolleranza: float = Query(TAEG_TOLLERANZA, ge=0, le=100), db=Depends(get_db_lettura)
+):
+    """
+    Mutui il cui TAEG dichiarato si discosta da quello calcolato dai flussi
+    di cassa di oltre `tolleranza` punti, dal pi\u00f9 discordante.
+    """
+    cursor = await db.execute(
+        """SELECT id, banca, tan, taeg, taeg_calcolato, ROUND(taeg - taeg_calcolato, 2) AS scarto
+           FROM mutui
+           WHERE taeg > 0 AND taeg_calcolato IS NOT NULL AND ABS(taeg - taeg_calcolato) > ?
+           ORDER BY ABS(taeg - taeg_calcolato) DESC, id""",
+        (tolleranza,),
+    )
+    return [dict(r) for r in await cursor.fetchall()]
+
+
+@router.get("/cache")
+async def stato_cache():
+    """Statistiche delle cache del motore di calcolo."""
+    return statistiche_cache()
+
+
+@router.delete("/cache", status_code=204)
+async def invalida_cache():
+    """Svuota le cache del motore di calcolo."""
+    svuota_cache()
 
 
 @router.get("/{mutuo_id}", response_model=MutuoResponse)
-async def dettaglio_mutuo(mutuo_id: int, db=Depends(get_db)):
+async def dettaglio_mutuo(mutuo_id: int, db=Depends(get_db_lettura)):
     cursor = await db.execute("SELECT * FROM mutui WHERE id = ?", (mutuo_id,))
     row = await cursor.fetchone()
     if not row:
@@ -165,6 +688,10 @@ async def aggiorna_mutuo(mutuo_id: int, update: MutuoUpdate, db=Depends(get_db))
         existing_dict["costo_assicurazione"], existing_dict["spese_notarili"],
         existing_dict["altre_spese"],
     )
+    existing_dict["taeg_calcolato"] = calcola_taeg_mutuo(
+        existing_dict["importo"], existing_dict["rata_mensile"], existing_dict["durata_anni"],
+        sum(existing_dict[nome] for nome in SPESE_ACCESSORIE),
+    )
     existing_dict["punteggio"] = calcola_punteggio(existing_dict)
 
     await db.execute(
@@ -175,10 +702,14 @@ async def aggiorna_mutuo(mutuo_id: int, update: MutuoUpdate, db=Depends(get_db))
             spese_perizia=:spese_perizia, costo_assicurazione=:costo_assicurazione,
             spese_notarili=:spese_notarili, altre_spese=:altre_spese, note=:note,
             ltv=:ltv, costo_totale=:costo_totale, totale_interessi=:totale_interessi,
-            punteggio=:punteggio, updated_at=CURRENT_TIMESTAMP
+            taeg_calcolato=:taeg_calcolato, punteggio=:punteggio, updated_at=CURRENT_TIMESTAMP
         WHERE id=:id""",
         existing_dict,
     )
+    await aggiorna_spread(db, mutuo_id, mutuo_id)
+    await salva_piani(db, [(
+        mutuo_id, existing_dict["importo"], existing_dict["tan"], existing_dict["durata_anni"]
+    )])
     await db.commit()
 
     cursor = await db.execute("SELECT * FROM mutui WHERE id = ?", (mutuo_id,))
@@ -207,36 +738,62 @@ async def toggle_verificato(mutuo_id: int, db=Depends(get_db)):
     return {"id": mutuo_id, "verificato": bool(new_val)}
 
 
-@router.post("/ricalcola", status_code=200)
-async def ricalcola_punteggi(db=Depends(get_db)):
-    """Ricalcola rata, interessi, costo totale e punteggio per tutti i mutui."""
-    cursor = await db.execute("SELECT * FROM mutui")
-    rows = await cursor.fetchall()
-    count = 0
-    for row in rows:
-        m = dict(row)
-        m["rata_mensile"] = calcola_rata_mensile(m["importo"], m["tan"], m["durata_anni"])
-        m["ltv"] = calcola_ltv(m["importo"], m["valore_immobile"])
-        m["totale_interessi"] = calcola_totale_interessi(m["importo"], m["tan"], m["durata_anni"])
-        m["costo_totale"] = calcola_costo_totale(
-            m["importo"], m["tan"], m["durata_anni"],
-            m["spese_istruttoria"], m["spese_perizia"],
-            m["costo_assicurazione"], m["spese_notarili"], m["altre_spese"],
-        )
-        m["punteggio"] = calcola_punteggio(m)
-        await db.execute(
-            """UPDATE mutui SET rata_mensile=:rata_mensile, ltv=:ltv,
-               totale_interessi=:totale_interessi, costo_totale=:costo_totale,
-               punteggio=:punteggio WHERE id=:id""",
-            m,
-        )
-        count += 1
-    await db.commit()
-    return {"ricalcolati": count}
-
-
 @router.get("/{mutuo_id}/ammortamento")
-async def piano_ammortamento(mutuo_id: int, db=Depends(get_db)):
+async def piano_ammortamento(
+    mutuo_id: int,
+    da: int | None = Query(None, ge=1),
+    a: int | None = Query(None, ge=1),
+    esatto: bool = False,
+    db=Depends(get_db_lettura),
+):
+    """
+    Piano di ammortamento, tutto o solo i mesi da `da` ad `a` (inclusi).
+
+    Il piano \u00e8 salvato alla creazione/modifica del mutuo: qui basta una
+    lettura per chiave. Se manca (es. mutui importati) o non corrisponde pi\u00f9
+    ai parametri viene generato e salvato ora. Con `esatto` il piano \u00e8
+    calcolato in centesimi interi, con l'ultima rata che chiude il debito.
+    """
+    if da is not None and a is not None and a < da:
+        raise HTTPException(status_code=422, detail="'a' deve essere >= 'da'")
+    if esatto:
+        cursor = await db.execute(
+            "SELECT importo, tan, durata_anni FROM mutui WHERE id = ?", (mutuo_id,)
+        )
+        row = await cursor.fetchone()
+        if not row:
+            raise HTTPException(status_code=404, detail="Mutuo non trovato")
+        if da is not None and da > row["durata_anni"] * 12:
+            raise HTTPException(status_code=422, detail="Mese fuori dalla durata del mutuo")
+        try:
+            piano = calcola_piano_ammortamento(
+                row["importo"], row["tan"], row["durata_anni"], esatto=True
+            )
+        except ValueError as e:
+            raise HTTPException(status_code=422, detail=str(e))
+        return {"mutuo_id": mutuo_id, "piano": piano[(da or 1) - 1:a]}
+    salvato = await leggi_piano(db, mutuo_id, da, a)
+    if salvato is None:
+        raise HTTPException(status_code=404, detail="Mutuo non trovato")
+    num_rate = salvato["durata_anni"] * 12
+    if da is not None and da > num_rate:
+        raise HTTPException(status_code=422, detail="Mese fuori dalla durata del mutuo")
+
+    if salvato["dati"] is None:
+        async with get_pool().scrittore() as scrittore:
+            await salva_piani(scrittore, [
+                (mutuo_id, salvato["importo"], salvato["tan"], salvato["durata_anni"])
+            ])
+            await scrittore.commit()
+            salvato = await leggi_piano(scrittore, mutuo_id, da, a)
+        if salvato is None:
+            raise HTTPException(status_code=404, detail="Mutuo non trovato")
+    return {"mutuo_id": mutuo_id, "piano": spacchetta_piano(salvato["dati"], da or 1)}
+
+
+@router.get("/{mutuo_id}/ammortamento/riepilogo")
+async def riepilogo_ammortamento(mutuo_id: int, mese: int | None = None, db=Depends(get_db_lettura)):
+    """Riepilogo annuale del piano (e situazione a un mese) senza generare tutte le rate."""
     cursor = await db.execute(
         "SELECT importo, tan, durata_anni FROM mutui WHERE id = ?", (mutuo_id,)
     )
@@ -244,5 +801,19 @@ async def piano_ammortamento(mutuo_id: int, db=Depends(get_db)):
     if not row:
         raise HTTPException(status_code=404, detail="Mutuo non trovato")
     data = dict(row)
-    piano = calcola_piano_ammortamento(data["importo"], data["tan"], data["durata_anni"])
-    return {"mutuo_id": mutuo_id, "piano": piano}
+    importo, tan, durata_anni = data["importo"], data["tan"], data["durata_anni"]
+    risultato = {
+        "mutuo_id": mutuo_id,
+        "anni": riepilogo_annuale(importo, tan, durata_anni),
+    }
+    if mese is not None:
+        if not 0 <= mese <= durata_anni * 12:
+            raise HTTPException(status_code=422, detail="Mese fuori dalla durata del mutuo")
+        risultato["al_mese"] = {
+            "mese": mese,
+            "debito_residuo": debito_residuo_al_mese(importo, tan, durata_anni, mese),
+            "capitale_rimborsato": capitale_rimborsato_al_mese(importo, tan, durata_anni, mese),
+            "interessi_pagati": interessi_cumulati_al_mese(importo, tan, durata_anni, mese),
+            "tolleranza": tolleranza_arrotondamento(tan, mese),
+        }
+    return risultato
@@ -0,0 +1,99 @@
+from fastapi import APIRouter, HTTPException
+from fastapi.responses import Response
+import json
+import math
+import os
+import time
+import numpy as np
+from models import IntervalloScenari, ScenariRequest
+from mortgage_engine import calcola_griglia_scenari
+
+router = APIRouter(prefix="/api/scenari", tags=["scenari"])
+
+# Celle massime (importi x tan x durate x spese) per richiesta
+SCENARI_CELLE_MAX = int(os.environ.get("SCENARI_MAX_CELLS", "2000000"))
+
+# Cifre decimali tenute sui valori degli intervalli, per non portarsi dietro
+# l'errore accumulato da da + k * passo (2.5 + 3 * 0.1 = 2.8000000000000003)
+_CIFRE_ASSE = 10
+
+
+def _valori_asse(nome: str, asse: list | IntervalloScenari) -> np.ndarray:
+    if isinstance(asse, IntervalloScenari):
+        if not all(math.isfinite(v) for v in (asse.da, asse.a, asse.passo)):
+            raise HTTPException(status_code=422, detail=f"{nome}: estremi e passo devono essere finiti")
+        if asse.a < asse.da:
+            raise HTTPException(status_code=422, detail=f"{nome}: 'a' deve essere >= 'da'")
+        # Il conteggio si controlla prima di floor(): con un passo minuscolo
+        # il rapporto pu\u00f2 valere inf (OverflowError) o un intero enorme
+        rapporto = (asse.a - asse.da) / asse.passo + 1e-9
+        if not rapporto < SCENARI_CELLE_MAX:
+            raise HTTPException(status_code=422, detail=f"{nome}: troppi valori (massimo {SCENARI_CELLE_MAX})")
+        quanti = math.floor(rapporto) + 1
+        valori = np.round(asse.da + asse.passo * np.arange(quanti), _CIFRE_ASSE)
+    else:
+        valori = np.asarray(asse, dtype=np.float64)
+    if valori.size == 0:
+        raise HTTPException(status_code=422, detail=f"{nome}: serve almeno un valore")
+    return valori
+
+
+def _controlla(nome: str, valori: np.ndarray, minimo: float, massimo: float = math.inf, escluso: bool = False):
+    fuori = (valori <= minimo if escluso else valori < minimo) | (valori > massimo) | ~np.isfinite(valori)
+    if fuori.any():
+        raise HTTPException(
+            status_code=422, detail=f"{nome}: valore non ammesso ({valori[fuori][0]})"
+        )
+
+
+@router.post("/")
+def griglia_scenari(richiesta: ScenariRequest):
+    """
+    Rata, interessi e costo totale per tutte le combinazioni di importo, TAN,
+    durata e spese, calcolati in un solo passaggio vettoriale.
+
+    Le matrici sono dense e annidate nell'ordine degli assi: rata_mensile e
+    totale_interessi hanno forma [importo][tan][durata], costo_totale
+    [importo][tan][durata][spese]. Con un solo importo e una sola spesa,
+    rata_mensile[0] \u00e8 direttamente la heatmap TAN x durata. Conviene chiedere
+    in `metriche` solo le matrici che servono: su griglie grandi il tempo va
+    quasi tutto nella serializzazione.
+    """
+    inizio = time.perf_counter()
+    importi = _valori_asse("importo", richiesta.importo)
+    tan = _valori_asse("tan", richiesta.tan)
+    durate = _valori_asse("durata_anni", richiesta.durata_anni)
+    spese = _valori_asse("spese", richiesta.spese)
+
+    _controlla("importo", importi, 0, escluso=True)
+    _controlla("tan", tan, 0, 100)
+    _controlla("durata_anni", durate, 1, 40)
+    if (durate != np.round(durate)).any():
+        raise HTTPException(status_code=422, detail="durata_anni: servono anni interi")
+    _controlla("spese", spese, 0)
+
+    celle = importi.size * tan.size * durate.size * spese.size
+    if celle > SCENARI_CELLE_MAX:
+        raise HTTPException(
+            status_code=422,
+            detail=f"Griglia troppo grande: {celle} celle (massimo {SCENARI_CELLE_MAX})",
+        )
+
+    griglia = calcola_griglia_scenari(importi, tan, durate.astype(np.int64), spese)
+    calcolo_s = time.perf_counter() - inizio
+
+    # Risposta serializzata a mano: la validazione di FastAPI su milioni di
+    # float annidati costerebbe pi\u00f9 del calcolo
+    corpo = {
+        "assi": {
+            "importo": importi.tolist(),
+            "tan": tan.tolist(),
+            "durata_anni": durate.astype(np.int64).tolist(),
+            "spese": spese.tolist(),
+        },
+        "forma": {nome: list(griglia[nome].shape) for nome in richiesta.metriche},
+        "celle": celle,
+        **{nome: griglia[nome].tolist() for nome in richiesta.metriche},
+        "secondi_calcolo": round(calcolo_s, 4),
+    }
+    return Response(content=json.dumps(corpo), media_type="application/json")
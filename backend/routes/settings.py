@@ -1,29 +1,46 @@
-from fastapi import APIRouter, Depends
-from database import get_db
+from fastapi import APIRouter, Depends, HTTPException, Query
+from database import get_db, get_db_lettura
+from eurirs import CHIAVE_EURIRS, allinea_spread, eurirs_corrente, registra_eurirs
 
 router = APIRouter(prefix="/api/settings", tags=["settings"])
 
 
 @router.get("/eurirs")
-async def get_eurirs(db=Depends(get_db)):
-    cursor = await db.execute("SELECT value FROM settings WHERE key = 'eurirs_30y'")
-    row = await cursor.fetchone()
-    if row:
-        return {"eurirs_30y": float(row["value"])}
-    return {"eurirs_30y": None}
+async def get_eurirs(db=Depends(get_db_lettura)):
+    corrente = await eurirs_corrente(db)
+    if corrente:
+        return {
+            "eurirs_30y": corrente["valore"],
+            "versione": corrente["versione"],
+            "aggiornato_il": corrente["created_at"],
+        }
+    return {"eurirs_30y": None, "versione": None, "aggiornato_il": None}
 
 
 @router.put("/eurirs")
 async def set_eurirs(data: dict, db=Depends(get_db)):
-    value = data.get("eurirs_30y")
-    if value is None or not isinstance(value, (int, float)):
-        from fastapi import HTTPException
+    """
+    Registra un nuovo Eurirs 30Y e aggiorna lo spread dei soli mutui a tasso
+    fisso, nella stessa transazione.
+    """
+    value = data.get(CHIAVE_EURIRS)
+    if value is None or isinstance(value, bool) or not isinstance(value, (int, float)):
         raise HTTPException(status_code=422, detail="eurirs_30y deve essere un numero")
-    await db.execute(
-        """INSERT INTO settings (key, value, updated_at)
-           VALUES ('eurirs_30y', :val, CURRENT_TIMESTAMP)
-           ON CONFLICT(key) DO UPDATE SET value=:val, updated_at=CURRENT_TIMESTAMP""",
-        {"val": str(value)},
-    )
+    versione = await registra_eurirs(db, float(value))
+    aggiornati = await allinea_spread(db)
     await db.commit()
-    return {"eurirs_30y": value}
+    if versione is None:
+        versione = (await eurirs_corrente(db))["versione"]
+    return {"eurirs_30y": value, "versione": versione, "mutui_aggiornati": aggiornati}
+
+
+@router.get("/eurirs/storico")
+async def storico_eurirs(
+    limite: int = Query(50, ge=1, le=1000), db=Depends(get_db_lettura)
+):
+    """Valori Eurirs registrati, dal pi\u00f9 recente."""
+    cursor = await db.execute(
+        "SELECT versione, valore, created_at FROM eurirs_storico ORDER BY versione DESC LIMIT ?",
+        (limite,),
+    )
+    return [dict(r) for r in await cursor.fetchall()]
@@ -0,0 +1,128 @@
+from fastapi import APIRouter, HTTPException
+import asyncio
+import os
+import time
+from ammortamento import carica_piani
+from database import get_pool
+from estinzione import Evento, EventoNonValido, simula_eventi
+from models import EstinzioneRequest, SimulazioneRequest
+from monte_carlo import ModelloEuribor, nuovo_seed, offerta_da_mutuo, pool_processi, simula
+
+router = APIRouter(prefix="/api/simulazioni", tags=["simulazioni"])
+
+# Percorsi per offerta sommati su tutte le offerte: la memoria cresce con
+# il prodotto (una matrice percorsi x anni per offerta), non con i singoli valori
+MC_PERCORSI_TOTALI_MAX = int(os.environ.get("MC_MAX_TOTAL_PATHS", "200000"))
+
+
+@router.post("/")
+async def simula_mutui(richiesta: SimulazioneRequest):
+    """
+    Simulazione Monte Carlo dell'Euribor sui mutui indicati.
+
+    Variabili e misti ricevono distribuzioni di interessi, costo totale e rata;
+    i fissi compaiono come riferimento (distribuzione degenere). Lo stesso seed
+    con gli stessi parametri restituisce sempre lo stesso risultato.
+    Mutui per percorsi non pu\u00f2 superare MC_MAX_TOTAL_PATHS.
+    """
+    totale = len(set(richiesta.mutuo_ids)) * richiesta.percorsi
+    if totale > MC_PERCORSI_TOTALI_MAX:
+        raise HTTPException(
+            status_code=422,
+            detail=(
+                f"Simulazione troppo grande: {totale} percorsi in totale tra tutti i mutui "
+                f"(massimo {MC_PERCORSI_TOTALI_MAX})"
+            ),
+        )
+    async with get_pool().lettore() as db:
+        placeholders = ",".join("?" for _ in richiesta.mutuo_ids)
+        cursor = await db.execute(
+            f"SELECT * FROM mutui WHERE id IN ({placeholders})", richiesta.mutuo_ids
+        )
+        mutui = [dict(r) for r in await cursor.fetchall()]
+    if len(mutui) != len(set(richiesta.mutuo_ids)):
+        raise HTTPException(status_code=404, detail="Uno o pi\u00f9 mutui non trovati")
+
+    modello = ModelloEuribor(**richiesta.euribor.model_dump())
+    offerte = [
+        offerta_da_mutuo(m, modello, richiesta.anni_fisso_misto, richiesta.revisione_mesi)
+        for m in mutui
+    ]
+    seed = richiesta.seed if richiesta.seed is not None else nuovo_seed()
+
+    inizio = time.perf_counter()
+    # Calcolo fuori dall'event loop; con MC_PROCESSES > 0 i blocchi vanno al pool di processi
+    risultato = await asyncio.to_thread(
+        simula, offerte, modello, richiesta.percorsi, seed, pool_processi()
+    )
+    for mutuo, offerta in zip(mutui, risultato["offerte"]):
+        offerta.update(
+            id=mutuo["id"],
+            banca=mutuo["banca"],
+            tipo_tasso=mutuo["tipo_tasso"],
+            rata_mensile=mutuo["rata_mensile"],
+            costo_totale_tan_iniziale=mutuo["costo_totale"],
+        )
+    return {
+        **risultato,
+        "parametri": {
+            "euribor": richiesta.euribor.model_dump(),
+            "anni_fisso_misto": richiesta.anni_fisso_misto,
+            "revisione_mesi": richiesta.revisione_mesi,
+        },
+        "secondi": round(time.perf_counter() - inizio, 3),
+    }
+
+
+@router.post("/estinzione")
+async def simula_estinzioni(richiesta: EstinzioneRequest):
+    """
+    Estinzioni anticipate (parziali o totali) e surroghe, a scenari in blocco.
+
+    Ogni scenario riparte dal piano salvato del suo mutuo al mese del primo
+    evento. Una surroga pu\u00f2 indicare il TAN o il mutuo_id di un'offerta
+    salvata; senza durata_mesi mantiene le rate rimaste. Gli scenari con
+    eventi non validi riportano l'errore senza fermare gli altri.
+    """
+    ids = {s.mutuo_id for s in richiesta.scenari}
+    ids |= {e.mutuo_id for s in richiesta.scenari for e in s.eventi if e.mutuo_id is not None}
+    async with get_pool().lettore() as db:
+        mutui = await carica_piani(db, ids)
+    mancanti = sorted(ids - mutui.keys())
+    if mancanti:
+        raise HTTPException(
+            status_code=404, detail=f"Mutui non trovati: {', '.join(map(str, mancanti))}"
+        )
+
+    def calcola() -> list[dict]:
+        risultati = []
+        for indice, scenario in enumerate(richiesta.scenari):
+            mutuo = mutui[scenario.mutuo_id]
+            eventi = [
+                Evento(
+                    tipo=e.tipo,
+                    mese=e.mese,
+                    importo=e.importo,
+                    strategia=e.strategia,
+                    tan=mutui[e.mutuo_id]["tan"] if e.tan is None and e.mutuo_id is not None else e.tan,
+                    durata_mesi=e.durata_mesi,
+                    spese=e.spese,
+                )
+                for e in scenario.eventi
+            ]
+            try:
+                esito = simula_eventi(mutuo["piano"], mutuo["tan"], eventi, richiesta.includi_piano)
+            except EventoNonValido as e:
+                esito = {"errore": str(e)}
+            risultati.append({
+                "indice": indice,
+                "nome": scenario.nome,
+                "mutuo_id": scenario.mutuo_id,
+                "banca": mutuo["banca"],
+                **esito,
+            })
+        return risultati
+
+    inizio = time.perf_counter()
+    risultati = await asyncio.to_thread(calcola)
+    return {"scenari": risultati, "secondi": round(time.perf_counter() - inizio, 3)}
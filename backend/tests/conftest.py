@@ -0,0 +1,19 @@
+import sys
+from pathlib import Path
+
+import pytest
+
+# I moduli del backend si importano dalla cartella backend/, come fa il server
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+
+@pytest.fixture
+def api(tmp_path, monkeypatch):
+    """Client dell'app su un database vuoto in una cartella temporanea."""
+    import database
+    from fastapi.testclient import TestClient
+    from main import app
+
+    monkeypatch.setattr(database, "DB_PATH", tmp_path / "bancadvisor.db")
+    with TestClient(app) as client:
+        yield client
@@ -0,0 +1,88 @@
+"""
+Rigenera i piani di riferimento in golden/ per test_golden.py.
+
+    python tests/genera_golden.py
+
+I piani sono AUTOGENERATI, non forniti da una banca: rata e piano sono
+calcolati qui in Decimal (formula francese, ROUND_HALF_UP al centesimo),
+senza usare il motore che test_golden.py verifica. Controllano quindi che
+il piano in centesimi interi coincida con un'implementazione indipendente
+della stessa convenzione, non con i conti di una banca. Un piano reale si
+aggiunge nello stesso formato con "origine" che ne indica la fonte; questo
+script riscrive solo i file di CASI.
+"""
+import json
+from decimal import ROUND_HALF_UP, Decimal, localcontext
+from pathlib import Path
+
+CARTELLA = Path(__file__).resolve().parent / "golden"
+CENTESIMO = Decimal("0.01")
+ORIGINE = "autogenerato: Decimal ROUND_HALF_UP (tests/genera_golden.py)"
+
+# nome: (importo, tan, durata_anni)
+CASI = {
+    "fisso_200k_3.50_30": (200000, 3.5, 30),
+    "fisso_150k_2.95_25": (150000, 2.95, 25),
+    "fisso_100k_4.10_20": (100000, 4.1, 20),
+    "fisso_87654.32_1.25_15": (87654.32, 1.25, 15),
+    "fisso_300000.50_5.875_40": (300000.5, 5.875, 40),
+    "tasso_zero_250k_10": (250000, 0, 10),
+}
+
+
+def _euro(valore) -> Decimal:
+    return Decimal(str(valore)).quantize(CENTESIMO, ROUND_HALF_UP)
+
+
+def rata_decimal(importo, tan, durata_anni) -> Decimal:
+    """Rata alla francese in Decimal, arrotondata al centesimo."""
+    with localcontext() as contesto:
+        contesto.prec = 50
+        capitale = _euro(importo)
+        num_rate = durata_anni * 12
+        tasso = Decimal(str(tan)) / 1200
+        if tasso == 0:
+            return (capitale / num_rate).quantize(CENTESIMO, ROUND_HALF_UP)
+        fattore = (1 + tasso) ** num_rate
+        return (capitale * tasso * fattore / (fattore - 1)).quantize(CENTESIMO, ROUND_HALF_UP)
+
+
+def piano_decimal(importo, tan, durata_anni, rata: Decimal) -> list[list]:
+    """Piano di riferimento in Decimal: [mese, rata, capitale, interessi, debito]."""
+    debito = _euro(importo)
+    tasso = Decimal(str(tan)) / 100 / 12
+    num_rate = durata_anni * 12
+    righe = []
+    for mese in range(1, num_rate + 1):
+        interessi = (debito * tasso).quantize(CENTESIMO, ROUND_HALF_UP)
+        capitale = debito if mese == num_rate or rata - interessi >= debito else rata - interessi
+        debito -= capitale
+        righe.append([mese, str(capitale + interessi), str(capitale), str(interessi), str(debito)])
+        if debito == 0:
+            break
+    return righe
+
+
+def rigenera() -> None:
+    CARTELLA.mkdir(exist_ok=True)
+    for nome, (importo, tan, durata_anni) in CASI.items():
+        rata = rata_decimal(importo, tan, durata_anni)
+        piano = piano_decimal(importo, tan, durata_anni, rata)
+        documento = {
+            "origine": ORIGINE,
+            "importo": importo,
+            "tan": tan,
+            "durata_anni": durata_anni,
+            "rata": str(rata),
+            "totale_interessi": str(sum(Decimal(r[3]) for r in piano)),
+            "piano": piano,
+        }
+        # Una rata per riga, per diff leggibili
+        testo = json.dumps(documento, indent=1).split('\n "piano"')[0]
+        righe = ",\n  ".join(json.dumps(r) for r in piano)
+        (CARTELLA / f"{nome}.json").write_text(f'{testo}\n "piano": [\n  {righe}\n ]\n}}\n')
+        print(f"{nome}: {len(piano)} rate")
+
+
+if __name__ == "__main__":
+    rigenera()
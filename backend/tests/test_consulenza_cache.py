@@ -0,0 +1,53 @@
+import json
+
+import httpx
+import pytest
+
+import ollama_advisor
+
+MUTUO = {
+    "banca": "Banca Test", "tipo_tasso": "fisso", "tan": 3.2,
+    "importo": 200000, "valore_immobile": 300000, "durata_anni": 25,
+}
+
+
+@pytest.fixture
+def chiamate_ollama(monkeypatch):
+    """Ollama finto: conta le chiamate a /api/chat e risponde sempre allo stesso modo."""
+    chiamate = []
+
+    def rispondi(request: httpx.Request) -> httpx.Response:
+        if request.url.path == "/api/tags":
+            return httpx.Response(200, json={"models": [{"name": ollama_advisor.MODEL_NAME}]})
+        chiamate.append(json.loads(request.content))
+        return httpx.Response(200, json={"message": {"content": "Conviene Banca Test."}, "done": True})
+
+    client = httpx.AsyncClient(transport=httpx.MockTransport(rispondi))
+    monkeypatch.setattr(ollama_advisor, "_client", client)
+    ollama_advisor.sessioni_consulenza.svuota()
+    yield chiamate
+    ollama_advisor.sessioni_consulenza.svuota()
+
+
+@pytest.mark.parametrize("domanda", [None, "Meglio il fisso o il variabile?"])
+def test_richiesta_ripetuta_servita_dalla_cache(api, chiamate_ollama, domanda):
+    mutuo_id = api.post("/api/mutui/", json=MUTUO).json()["id"]
+    richiesta = {"mutuo_ids": [mutuo_id], "domanda": domanda}
+
+    risposte = [api.post("/api/advisor/consulenza", json=richiesta).json() for _ in range(3)]
+
+    assert [r["da_cache"] for r in risposte] == [False, True, True]
+    assert {r["risposta"] for r in risposte} == {"Conviene Banca Test."}
+    assert len(chiamate_ollama) == 1
+
+
+def test_domanda_nuova_continua_la_conversazione(api, chiamate_ollama):
+    mutuo_id = api.post("/api/mutui/", json=MUTUO).json()["id"]
+    api.post("/api/advisor/consulenza", json={"mutuo_ids": [mutuo_id]})
+    seguito = api.post(
+        "/api/advisor/consulenza", json={"mutuo_ids": [mutuo_id], "domanda": "E con 30 anni?"}
+    ).json()
+
+    assert seguito["da_cache"] is False
+    assert seguito["metadati"]["sessione"] == "continuata"
+    assert len(chiamate_ollama) == 2
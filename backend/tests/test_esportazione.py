@@ -0,0 +1,37 @@
+import asyncio
+import json
+
+import database
+from routes import mutui as rotte_mutui
+
+
+async def _esporta(righe: int) -> tuple[list[str], list[int]]:
+    """Esporta in NDJSON annotando i lettori liberi dopo ogni blocco ricevuto."""
+    await database.init_db()
+    pool = await database.apri_pool(lettori=1)
+    try:
+        async with pool.scrittore() as db:
+            await db.executemany(
+                "INSERT INTO mutui (banca, tipo_tasso, tan, importo, valore_immobile, durata_anni) "
+                "VALUES (?, 'fisso', 3.0, 200000, 300000, 25)",
+                [(f"Banca {i}",) for i in range(righe)],
+            )
+            await db.commit()
+        parti, liberi = [], []
+        async for parte in rotte_mutui._esporta_ndjson():
+            parti.append(parte)
+            liberi.append(pool.stato()["lettori_liberi"])
+        return parti, liberi
+    finally:
+        await database.chiudi_pool()
+
+
+def test_export_non_tiene_il_lettore_tra_un_blocco_e_l_altro(tmp_path, monkeypatch):
+    monkeypatch.setattr(database, "DB_PATH", tmp_path / "bancadvisor.db")
+    righe = rotte_mutui.EXPORT_BLOCCO * 2 + 1
+    parti, liberi = asyncio.run(_esporta(righe))
+
+    assert len(parti) == 4
+    assert liberi == [1] * len(parti)
+    record = [json.loads(r) for p in parti for r in p.splitlines()]
+    assert [r["dati"]["banca"] for r in record[1:]] == [f"Banca {i}" for i in range(righe)]
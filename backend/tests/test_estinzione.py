@@ -0,0 +1,60 @@
+import numpy as np
+import pytest
+
+from estinzione import Evento, EventoNonValido, simula_eventi
+from mortgage_engine import calcola_piano_ammortamento
+
+IMPORTO, TAN, DURATA_ANNI = 150000, 2.95, 25
+
+
+@pytest.fixture
+def base() -> np.ndarray:
+    piano = calcola_piano_ammortamento(IMPORTO, TAN, DURATA_ANNI)
+    return np.array(
+        [[r["rata"], r["quota_capitale"], r["quota_interessi"], r["debito_residuo"]] for r in piano]
+    )
+
+
+def test_piano_base_lascia_un_residuo(base):
+    # Il caso che interessa: l'ultima riga del piano in virgola mobile non chiude a zero
+    assert base[-1, 3] > 0
+
+
+@pytest.mark.parametrize(
+    "evento",
+    [
+        Evento(tipo="parziale", mese=300, importo=0.5, strategia="riduci_rata"),
+        Evento(tipo="surroga", mese=300, tan=2.0),
+    ],
+)
+def test_ricalcolo_rata_all_ultimo_mese_non_valido(base, evento):
+    with pytest.raises(EventoNonValido, match="ultima rata"):
+        simula_eventi(base, TAN, [evento])
+
+
+def test_dopo_surroga_l_ultimo_mese_chiude_il_debito(base):
+    eventi = [
+        Evento(tipo="surroga", mese=100, tan=2.0, durata_mesi=50),
+        Evento(tipo="parziale", mese=150, importo=100, strategia="riduci_rata"),
+    ]
+    esito = simula_eventi(base, TAN, eventi)
+    assert esito["mesi"] == 150
+    assert esito["eventi"][1] == {"tipo": "parziale", "mese": 150, "applicato": False}
+
+
+def test_eventi_all_ultimo_mese_validi(base):
+    residuo = float(base[-1, 3])
+    esito = simula_eventi(
+        base,
+        TAN,
+        [
+            Evento(tipo="parziale", mese=300, importo=0.5, strategia="riduci_durata"),
+            Evento(tipo="surroga", mese=300, tan=2.0, durata_mesi=1),
+        ],
+    )
+    assert esito["eventi"][0]["debito_dopo"] == round(residuo - 0.5, 2)
+    assert esito["mesi"] == 301
+
+    esito = simula_eventi(base, TAN, [Evento(tipo="totale", mese=300)])
+    assert esito["versamenti_extra"] == residuo
+    assert esito["mesi"] == 300
@@ -0,0 +1,31 @@
+import numpy as np
+import pytest
+
+from mortgage_engine import (
+    calcola_piani_ammortamento,
+    debito_residuo_al_mese,
+    interessi_cumulati_al_mese,
+    tolleranza_arrotondamento,
+)
+
+
+@pytest.mark.parametrize(
+    "importo, tan, durata_anni",
+    [(863432.46, 0, 37), (274850.98, 0, 40), (200000, 3.5, 30), (485345.49, 3.981, 24)],
+)
+def test_formule_chiuse_entro_tolleranza(importo, tan, durata_anni):
+    piani = calcola_piani_ammortamento(importo, tan, durata_anni)
+    num_rate = int(piani.num_rate[0])
+    interessi = np.cumsum(piani.quota_interessi[0, :num_rate])
+    for mese in range(1, num_rate + 1):
+        tolleranza = tolleranza_arrotondamento(tan, mese) + 1e-6
+        debito = debito_residuo_al_mese(importo, tan, durata_anni, mese)
+        assert abs(debito - piani.debito_residuo[0, mese - 1]) <= tolleranza
+        pagati = interessi_cumulati_al_mese(importo, tan, durata_anni, mese)
+        assert abs(pagati - interessi[mese - 1]) <= tolleranza
+
+
+def test_tan_zero_esatto():
+    piani = calcola_piani_ammortamento(863432.46, 0, 37)
+    assert debito_residuo_al_mese(863432.46, 0, 37, 434) == piani.debito_residuo[0, 433]
+    assert interessi_cumulati_al_mese(863432.46, 0, 37, 444) == 0
@@ -0,0 +1,45 @@
+import json
+from decimal import ROUND_HALF_UP, Decimal
+from pathlib import Path
+
+import pytest
+
+from mortgage_engine import calcola_piani_centesimi, calcola_piano_ammortamento
+
+CARTELLA = Path(__file__).resolve().parent / "golden"
+FILE = sorted(CARTELLA.glob("*.json"))
+
+
+def _euro(valore) -> str:
+    return str(Decimal(str(valore)).quantize(Decimal("0.01"), ROUND_HALF_UP))
+
+
+def test_ci_sono_piani_di_riferimento():
+    assert FILE
+
+
+@pytest.mark.parametrize("percorso", FILE, ids=[p.stem for p in FILE])
+def test_piano_esatto_come_riferimento(percorso):
+    atteso = json.loads(percorso.read_text())
+    piano = calcola_piano_ammortamento(
+        atteso["importo"], atteso["tan"], atteso["durata_anni"], esatto=True
+    )
+    ottenuto = [
+        [r["mese"], _euro(r["rata"]), _euro(r["quota_capitale"]),
+         _euro(r["quota_interessi"]), _euro(r["debito_residuo"])]
+        for r in piano
+    ]
+    assert _euro(piano[0]["rata"]) == atteso["rata"]
+    assert ottenuto == atteso["piano"]
+    assert sum(Decimal(r[2]) for r in ottenuto) == Decimal(_euro(atteso["importo"]))
+
+
+@pytest.mark.parametrize("tan", [3.12345, 0.00001, 2.5 + 1e-5])
+def test_tan_oltre_quattro_decimali_rifiutato(tan):
+    with pytest.raises(ValueError, match="decimali"):
+        calcola_piani_centesimi(100000, tan, 20)
+
+
+def test_tan_a_quattro_decimali_accettato():
+    piani = calcola_piani_centesimi(100000, [3.45, 5.875, 1.2345], 20)
+    assert (piani.debito_residuo[:, -1] == 0).all()
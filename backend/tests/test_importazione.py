@@ -0,0 +1,38 @@
+import json
+
+import pytest
+
+MUTUO = {
+    "banca": "Banca Test", "tipo_tasso": "fisso", "tan": 3.2,
+    "importo": 200000, "valore_immobile": 300000, "durata_anni": 25,
+}
+
+
+@pytest.mark.parametrize("documento, percorso", [
+    ({"mutui": {}}, "mutui"),
+    ({"mutui": "x"}, "mutui"),
+    ({"mutui": [MUTUO, "x"]}, "mutui[1]"),
+    ({"mutui": [MUTUO], "settings": ["eurirs_30y", 3]}, "settings"),
+    ({"mutui": [MUTUO], "settings": "x"}, "settings"),
+])
+@pytest.mark.parametrize("rotta", ["/api/mutui/import/all", "/api/mutui/import/bulk"])
+def test_documento_malformato_rifiutato_senza_importare(api, rotta, documento, percorso):
+    risposta = api.post(rotta, json=documento)
+    assert risposta.status_code == 422
+    assert risposta.json()["detail"].startswith(f"{percorso}:")
+    assert api.get("/api/mutui/").json() == []
+
+
+def test_lista_con_elemento_non_oggetto(api):
+    risposta = api.post("/api/mutui/import/bulk", json=[MUTUO, 3])
+    assert risposta.status_code == 422
+    assert risposta.json()["detail"].startswith("[1]:")
+
+
+def test_settings_ndjson_non_oggetto_segnalato(api):
+    corpo = '{"tipo": "settings", "dati": [1]}\n' + json.dumps({"tipo": "mutuo", "dati": MUTUO}) + "\n"
+    risposta = api.post(
+        "/api/mutui/import/bulk", content=corpo, headers={"Content-Type": "application/x-ndjson"}
+    ).json()
+    assert risposta["importati"] == 1
+    assert risposta["errori"] == [{"riga": 1, "errori": ["dati: serve un oggetto"]}]
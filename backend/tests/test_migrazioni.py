@@ -0,0 +1,34 @@
+import asyncio
+
+import aiosqlite
+import pytest
+
+import database
+
+
+async def _colonne_e_versione(percorso) -> tuple[list[str], int]:
+    async with aiosqlite.connect(percorso) as db:
+        colonne = await database._colonne_tabella(db, "mutui")
+        versione = (await (await db.execute("PRAGMA user_version")).fetchone())[0]
+    return colonne, versione
+
+
+def test_migrazione_fallita_non_lascia_schema_a_meta(tmp_path, monkeypatch):
+    percorso = tmp_path / "bancadvisor.db"
+    monkeypatch.setattr(database, "DB_PATH", percorso)
+    asyncio.run(database.init_db())
+    colonne, versione = asyncio.run(_colonne_e_versione(percorso))
+    assert versione == len(database.MIGRAZIONI)
+
+    async def _m_difettosa(db):
+        """Aggiunge una colonna e poi fallisce."""
+        await db.execute("ALTER TABLE mutui ADD COLUMN provvisoria REAL")
+        await db.execute("CREATE INDEX idx_provvisoria ON mutui(provvisoria)")
+        await db.execute("UPDATE mutui SET provvisoria = 1")
+        raise RuntimeError("migrazione interrotta")
+
+    monkeypatch.setattr(database, "MIGRAZIONI", [*database.MIGRAZIONI, _m_difettosa])
+    with pytest.raises(RuntimeError, match="interrotta"):
+        asyncio.run(database.init_db())
+
+    assert asyncio.run(_colonne_e_versione(percorso)) == (colonne, versione)
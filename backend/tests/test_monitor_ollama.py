@@ -0,0 +1,58 @@
+import asyncio
+
+import ollama_advisor
+from ollama_advisor import MonitorOllama
+
+
+def test_stato_non_aspetta_la_prima_sonda(monkeypatch):
+    sblocca = None
+
+    async def sonda_lenta():
+        await sblocca.wait()
+        return {"ollama_online": True, "modello_disponibile": True,
+                "modello": ollama_advisor.MODEL_NAME, "modelli_installati": ["x"]}
+
+    monkeypatch.setattr(ollama_advisor, "_sonda_ollama", sonda_lenta)
+
+    async def scenario():
+        nonlocal sblocca
+        sblocca = asyncio.Event()
+        monitor = MonitorOllama(intervallo=60)
+        monitor.avvia()
+        try:
+            prima = await asyncio.wait_for(monitor.stato(), timeout=0.5)
+            assert prima["in_verifica"] is True
+            assert prima["ollama_online"] is False
+            # Una sola sonda in volo: quella del ciclo in background
+            assert monitor._sonda_in_corso is None
+
+            sblocca.set()
+            await asyncio.sleep(0)
+            await asyncio.sleep(0)
+            dopo = await monitor.stato()
+            assert dopo["in_verifica"] is False
+            assert dopo["ollama_online"] is True
+        finally:
+            await monitor.ferma()
+
+    asyncio.run(scenario())
+
+
+def test_stato_senza_ciclo_sonda_in_background(monkeypatch):
+    chiamate = []
+
+    async def sonda():
+        chiamate.append(1)
+        return {"ollama_online": False, "modello_disponibile": False,
+                "modello": ollama_advisor.MODEL_NAME, "modelli_installati": []}
+
+    monkeypatch.setattr(ollama_advisor, "_sonda_ollama", sonda)
+
+    async def scenario():
+        monitor = MonitorOllama()
+        assert (await monitor.stato())["in_verifica"] is True
+        await monitor._sonda_in_corso
+        assert (await monitor.stato())["in_verifica"] is False
+        assert len(chiamate) == 1
+
+    asyncio.run(scenario())
@@ -0,0 +1,36 @@
+import pytest
+
+from mortgage_engine import calcola_metriche, calcola_punteggi, calcola_punteggio
+
+OFFERTA = {
+    "importo": 200000.0, "tan": 3.2, "taeg": None, "durata_anni": 25, "valore_immobile": 300000.0,
+    "spese_istruttoria": 1000.0, "spese_perizia": 300.0, "costo_assicurazione": 0.0,
+    "spese_notarili": 0.0, "altre_spese": 0.0,
+}
+
+
+def _con_metriche(mutuo: dict) -> dict:
+    metriche = calcola_metriche({nome: [valore] for nome, valore in mutuo.items()})
+    return {**mutuo, **{nome: valori[0].item() for nome, valori in metriche.items()}}
+
+
+def test_senza_taeg_dichiarato_le_spese_contano_una_volta():
+    mutuo = _con_metriche(OFFERTA)
+    # Il TAEG calcolato (3.31) include le spese: non deve pesare sul punteggio
+    assert mutuo["taeg_calcolato"] == 3.31
+    assert mutuo["punteggio"] == 60.0
+    assert calcola_punteggio(mutuo) == 60.0
+    assert calcola_punteggio({**mutuo, "taeg_calcolato": None}) == 60.0
+
+
+@pytest.mark.parametrize("taeg, atteso", [(3.0, 59.6), (3.31, 59.6), (3.6, 58.4)])
+def test_taeg_dichiarato_non_sotto_il_calcolato(taeg, atteso):
+    mutuo = _con_metriche({**OFFERTA, "taeg": taeg})
+    assert mutuo["punteggio"] == atteso
+    assert calcola_punteggio(mutuo) == atteso
+
+
+def test_scalare_e_colonnare_coincidono():
+    mutui = [_con_metriche({**OFFERTA, "taeg": taeg}) for taeg in (None, 0, 3.0, 3.31, 3.6)]
+    colonne = {nome: [m[nome] for m in mutui] for nome in mutui[0]}
+    assert calcola_punteggi(colonne).tolist() == [calcola_punteggio(m) for m in mutui]
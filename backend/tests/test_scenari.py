@@ -0,0 +1,33 @@
+import pytest
+
+
+def _griglia(api, tan):
+    return api.post("/api/scenari/", json={
+        "importo": [200000], "tan": tan, "durata_anni": [25], "spese": [0], "metriche": ["rata_mensile"],
+    })
+
+
+@pytest.mark.parametrize("tan", [
+    {"da": 0, "a": 1e308, "passo": 1e-300},
+    {"da": 0, "a": 10, "passo": 1e-12},
+    {"da": 0, "a": 2e6, "passo": 1},
+])
+def test_intervallo_troppo_fitto_rifiutato(api, tan):
+    risposta = _griglia(api, tan)
+    assert risposta.status_code == 422
+    assert "troppi valori" in risposta.json()["detail"]
+
+
+def test_intervallo_non_finito_rifiutato(api):
+    risposta = api.post(
+        "/api/scenari/",
+        content='{"importo": [200000], "tan": {"da": 0, "a": Infinity, "passo": 1}, "durata_anni": [25], "spese": [0]}',
+        headers={"Content-Type": "application/json"},
+    )
+    assert risposta.status_code == 422
+
+
+def test_intervallo_valido(api):
+    risposta = _griglia(api, {"da": 2.5, "a": 2.8, "passo": 0.1})
+    assert risposta.status_code == 200
+    assert risposta.json()["assi"]["tan"] == [2.5, 2.6, 2.7, 2.8]
@@ -7,11 +7,15 @@ import ComparisonView from './components/ComparisonView'
 import AdvisorChat from './components/AdvisorChat'
 import PrintReport from './components/PrintReport'
 import { api } from './api/client'
-import type { Mutuo, MutuoForm as MutuoFormType, ViewMode, AdvisorStatus } from './types'
+import type { Mutuo, MutuoForm as MutuoFormType, ViewMode, AdvisorStatus, PaginaMutui, RiepilogoMutui } from './types'
+
+const MUTUI_PER_PAGINA = 50
 
 export default function App() {
   const [view, setView] = useState<ViewMode>('dashboard')
   const [mutui, setMutui] = useState<Mutuo[]>([])
+  const [cursore, setCursore] = useState<string | null>(null)
+  const [riepilogo, setRiepilogo] = useState<RiepilogoMutui | null>(null)
   const [selectedIds, setSelectedIds] = useState<number[]>([])
   const [detailId, setDetailId] = useState<number | null>(null)
   const [editId, setEditId] = useState<number | null>(null)
@@ -25,10 +29,15 @@ export default function App() {
   }
 
   const loadMutui = useCallback(async () => {
+    const applyPagina = (pagina: PaginaMutui) => {
+      setMutui(pagina.mutui)
+      setCursore(pagina.cursore)
+      setRiepilogo(pagina.riepilogo ?? null)
+    }
     try {
-      const data = await api.listaMutui()
-      if (data.length > 0) {
-        setMutui(data)
+      const pagina = await api.paginaMutui({ limite: MUTUI_PER_PAGINA })
+      if (pagina.mutui.length > 0) {
+        applyPagina(pagina)
         // Auto-backup to localStorage
         try {
           const exportData = await api.esportaDati()
@@ -43,24 +52,36 @@ export default function App() {
             if (parsed.mutui?.length > 0) {
               const result = await api.importaDati(parsed)
               if (result.importati > 0) {
-                const restored = await api.listaMutui()
-                setMutui(restored)
+                applyPagina(await api.paginaMutui({ limite: MUTUI_PER_PAGINA }))
                 return
               }
             }
           } catch { /* ignore restore errors */ }
         }
-        setMutui(data)
+        applyPagina(pagina)
       }
     } catch {
       // handled by empty state
     }
   }, [])
 
+  const loadMoreMutui = useCallback(async () => {
+    if (!cursore) return
+    try {
+      const pagina = await api.paginaMutui({ limite: MUTUI_PER_PAGINA, cursore })
+      setMutui(prev => [...prev, ...pagina.mutui])
+      setCursore(pagina.cursore)
+    } catch {
+      // keep the rows already loaded
+    }
+  }, [cursore])
+
   const checkAdvisor = useCallback(async () => {
     try {
       const status = await api.statoAdvisor()
       setAdvisorStatus(status)
+      // The backend answers before its first Ollama check: ask again shortly
+      if (status.in_verifica) setTimeout(checkAdvisor, 2000)
     } catch {
       setAdvisorStatus({ ollama_online: false, modello_disponibile: false, modello: 'gemma2:2b', modelli_installati: [] })
     }
@@ -77,8 +98,10 @@ export default function App() {
 
   async function handleSaveEurirs(value: number) {
     try {
-      await api.setEurirs(value)
+      const data = await api.setEurirs(value)
       setEurirs30y(value)
+      // Lo spread dei fissi è ricalcolato dal server
+      if (data.mutui_aggiornati > 0) await loadMutui()
     } catch (e) {
       alert(e instanceof Error ? e.message : 'Errore nel salvataggio')
     }
@@ -200,6 +223,8 @@ export default function App() {
       {view === 'dashboard' && (
         <Dashboard
           mutui={mutui}
+          riepilogo={riepilogo}
+          onLoadMore={cursore ? loadMoreMutui : undefined}
           onView={handleViewDetail}
           onEdit={handleEditMutuo}
           onDelete={handleDeleteMutuo}
@@ -24,7 +24,10 @@ async function request<T>(path: string, options?: RequestInit): Promise<T> {
 
 export const api = {
   // Mutui
-  listaMutui: () => request<import('../types').Mutuo[]>('/mutui/'),
+  paginaMutui: (params: Record<string, string | number | boolean> = {}) =>
+    request<import('../types').PaginaMutui>(
+      `/mutui/pagina?${new URLSearchParams(Object.entries(params).map(([k, v]) => [k, String(v)]))}`,
+    ),
   creaMutuo: (data: import('../types').MutuoForm) =>
     request<import('../types').Mutuo>('/mutui/', { method: 'POST', body: JSON.stringify(data) }),
   dettaglioMutuo: (id: number) => request<import('../types').Mutuo>(`/mutui/${id}`),
@@ -34,8 +37,15 @@ export const api = {
     request<void>(`/mutui/${id}`, { method: 'DELETE' }),
   toggleVerificato: (id: number) =>
     request<{ id: number; verificato: boolean }>(`/mutui/${id}/verificato`, { method: 'PATCH' }),
-  pianoAmmortamento: (id: number) =>
-    request<{ mutuo_id: number; piano: import('../types').AmortizationRow[] }>(`/mutui/${id}/ammortamento`),
+  pianoAmmortamento: (id: number, da?: number, a?: number) => {
+    const params = new URLSearchParams()
+    if (da != null) params.set('da', String(da))
+    if (a != null) params.set('a', String(a))
+    const query = params.toString()
+    return request<{ mutuo_id: number; piano: import('../types').AmortizationRow[] }>(
+      `/mutui/${id}/ammortamento${query ? `?${query}` : ''}`,
+    )
+  },
 
   // Confronto
   confrontaMutui: (ids: number[]) =>
@@ -44,7 +54,7 @@ export const api = {
   // Advisor
   statoAdvisor: () => request<import('../types').AdvisorStatus>('/advisor/status'),
   chiediConsulenza: (mutuo_ids: number[], domanda?: string) =>
-    request<{ risposta: string; mutuo_ids: number[] }>('/advisor/consulenza', {
+    request<{ risposta: string; mutuo_ids: number[]; da_cache?: boolean }>('/advisor/consulenza', {
       method: 'POST',
       body: JSON.stringify({ mutuo_ids, domanda }),
     }),
@@ -56,7 +66,7 @@ export const api = {
   // Settings
   getEurirs: () => request<{ eurirs_30y: number | null }>('/settings/eurirs'),
   setEurirs: (value: number) =>
-    request<{ eurirs_30y: number }>('/settings/eurirs', { method: 'PUT', body: JSON.stringify({ eurirs_30y: value }) }),
+    request<{ eurirs_30y: number; versione: number; mutui_aggiornati: number }>('/settings/eurirs', { method: 'PUT', body: JSON.stringify({ eurirs_30y: value }) }),
 
   // Export/Import
   esportaDati: () => request<{ mutui: import('../types').Mutuo[]; settings: Record<string, string> }>('/mutui/export/all'),
@@ -1,10 +1,12 @@
 import { useState } from 'react'
-import { Mutuo } from '../types'
+import { Mutuo, RiepilogoMutui } from '../types'
 import { formatCurrency, formatPercent, punteggioColor, punteggioBgColor, tipoTassoBadgeClass, tipoTassoLabel } from '../utils/format'
 import { TrendingUp, Eye, Trash2, Trophy, Printer, Settings, Check, Download, Upload, CheckCircle2, Pencil } from 'lucide-react'
 
 interface Props {
   mutui: Mutuo[]
+  riepilogo: RiepilogoMutui | null
+  onLoadMore?: () => void
   onView: (id: number) => void
   onEdit: (id: number) => void
   onDelete: (id: number) => void
@@ -18,7 +20,7 @@ interface Props {
   onImport: (file: File) => void
 }
 
-export default function Dashboard({ mutui, onView, onEdit, onDelete, selectedIds, onToggleSelect, onToggleVerificato, onPrint, eurirs30y, onSaveEurirs, onExport, onImport }: Props) {
+export default function Dashboard({ mutui, riepilogo, onLoadMore, onView, onEdit, onDelete, selectedIds, onToggleSelect, onToggleVerificato, onPrint, eurirs30y, onSaveEurirs, onExport, onImport }: Props) {
   const [eurirsInput, setEurirsInput] = useState(eurirs30y?.toString() ?? '')
   const [showEurirs, setShowEurirs] = useState(false)
 
@@ -39,7 +41,10 @@ export default function Dashboard({ mutui, onView, onEdit, onDelete, selectedIds
     )
   }
 
-  const best = mutui.reduce((a, b) => ((a.punteggio ?? 0) > (b.punteggio ?? 0) ? a : b))
+  // Pages arrive by descending score, so the best offer is always the first row
+  const best = mutui[0]
+  const rataMin = riepilogo?.rata_min ?? Math.min(...mutui.map(m => m.rata_mensile ?? Infinity))
+  const tanMin = riepilogo?.tan_min ?? Math.min(...mutui.map(m => m.tan))
 
   return (
     <div className="space-y-6">
@@ -47,7 +52,7 @@ export default function Dashboard({ mutui, onView, onEdit, onDelete, selectedIds
       <div className="grid grid-cols-2 md:grid-cols-4 gap-3 sm:gap-4">
         <div className="card p-3 sm:p-5">
           <p className="label">Mutui</p>
-          <p className="text-xl sm:text-2xl font-bold text-gray-900">{mutui.length}</p>
+          <p className="text-xl sm:text-2xl font-bold text-gray-900">{riepilogo?.totale ?? mutui.length}</p>
         </div>
         <div className="card p-3 sm:p-5">
           <p className="label">Migliore</p>
@@ -56,13 +61,13 @@ export default function Dashboard({ mutui, onView, onEdit, onDelete, selectedIds
         <div className="card p-3 sm:p-5">
           <p className="label">Rata Min.</p>
           <p className="text-lg sm:text-2xl font-bold text-accent-700">
-            {formatCurrency(Math.min(...mutui.map(m => m.rata_mensile ?? Infinity)))}
+            {formatCurrency(rataMin)}
           </p>
         </div>
         <div className="card p-3 sm:p-5">
           <p className="label">TAN Min.</p>
           <p className="text-lg sm:text-2xl font-bold text-green-700">
-            {formatPercent(Math.min(...mutui.map(m => m.tan)))}
+            {formatPercent(tanMin)}
           </p>
         </div>
       </div>
@@ -204,9 +209,9 @@ export default function Dashboard({ mutui, onView, onEdit, onDelete, selectedIds
                     <span>{m.durata_anni}a · {formatCurrency(m.importo)}</span>
                   </div>
                   {/* Spread info */}
-                  {eurirs30y != null && m.tipo_tasso === 'fisso' && (
+                  {m.spread_eurirs != null && (
                     <div className="mt-1 text-xs text-gray-400">
-                      Spread: <strong className="text-gray-600">{formatPercent(Math.max(0, +(m.tan - eurirs30y).toFixed(2)))}</strong>
+                      Spread: <strong className="text-gray-600">{formatPercent(m.spread_eurirs)}</strong>
                     </div>
                   )}
                   {m.spread != null && m.spread > 0 && (
@@ -267,6 +272,15 @@ export default function Dashboard({ mutui, onView, onEdit, onDelete, selectedIds
             )}
           </div>
         ))}
+
+        {onLoadMore && (
+          <button
+            onClick={onLoadMore}
+            className="btn-secondary w-full !py-2 text-sm no-print"
+          >
+            Carica altri ({mutui.length} di {riepilogo?.totale ?? mutui.length})
+          </button>
+        )}
       </div>
     </div>
   )
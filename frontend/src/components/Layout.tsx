@@ -37,14 +37,18 @@ export default function Layout({ children, currentView, onNavigate, advisorStatu
             {advisorStatus && (
               <div className="flex items-center gap-1.5 text-xs">
                 <div className={`w-2 h-2 rounded-full ${
-                  advisorStatus.ollama_online && advisorStatus.modello_disponibile
+                  advisorStatus.in_verifica
+                    ? 'bg-gray-300'
+                    : advisorStatus.ollama_online && advisorStatus.modello_disponibile
                     ? 'bg-green-500'
                     : advisorStatus.ollama_online
                     ? 'bg-amber-500'
                     : 'bg-red-400'
                 }`} />
                 <span className="text-gray-500 hidden sm:inline">
-                  {advisorStatus.ollama_online && advisorStatus.modello_disponibile
+                  {advisorStatus.in_verifica
+                    ? 'Verifica Ollama...'
+                    : advisorStatus.ollama_online && advisorStatus.modello_disponibile
                     ? 'Gemma 2B Online'
                     : advisorStatus.ollama_online
                     ? 'Modello non trovato'
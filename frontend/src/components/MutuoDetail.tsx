@@ -127,6 +127,7 @@ export default function MutuoDetail({ mutuoId, onBack, onEdit }: Props) {
               ['Durata', `${mutuo.durata_anni} anni`],
               ['TAN', formatPercent(mutuo.tan)],
               ['TAEG', mutuo.taeg ? formatPercent(mutuo.taeg) : '\u2014'],
+              ['TAEG calcolato', mutuo.taeg_calcolato != null ? formatPercent(mutuo.taeg_calcolato) : '\u2014'],
               ['Spread', mutuo.spread ? formatPercent(mutuo.spread) : '\u2014'],
               ['Totale Interessi', formatCurrency(mutuo.totale_interessi ?? 0)],
             ].map(([label, value]) => (
@@ -19,11 +19,26 @@ export interface Mutuo {
   costo_totale: number | null
   totale_interessi: number | null
   punteggio: number | null
+  taeg_calcolato: number | null
+  spread_eurirs: number | null
+  eurirs_versione: number | null
   verificato: boolean
   created_at: string
   updated_at: string
 }
 
+export interface RiepilogoMutui {
+  totale: number
+  rata_min: number | null
+  tan_min: number | null
+}
+
+export interface PaginaMutui {
+  mutui: Mutuo[]
+  cursore: string | null
+  riepilogo?: RiepilogoMutui
+}
+
 export interface MutuoForm {
   banca: string
   tipo_tasso: 'fisso' | 'variabile' | 'misto'
@@ -64,6 +79,7 @@ export interface ClassificaItem {
   costo_totale: number
   tan: number
   taeg: number | null
+  taeg_calcolato: number | null
 }
 
 export interface AdvisorStatus {
@@ -71,6 +87,8 @@ export interface AdvisorStatus {
   modello_disponibile: boolean
   modello: string
   modelli_installati: string[]
+  // True until the backend's background check has produced its first result
+  in_verifica?: boolean
 }
 
 export interface Consulenza {